@@ -1,3 +1,4 @@
+-- The first schema, kept as it was so existing databases are adopted as they are
 CREATE TABLE IF NOT EXISTS USER (
     user_id INTEGER PRIMARY KEY AUTOINCREMENT,
     organization_id INTEGER,
@@ -9,10 +10,10 @@ CREATE TABLE IF NOT EXISTS USER (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-INSERT INTO USER(role, name, username, password)
+INSERT OR IGNORE INTO USER(role, name, username, password)
 VALUES (
         0,
         'System Admin',
         'sysadmin',
         '48a365b4ce1e322a55ae9017f3daf0c0'
-    )
\ No newline at end of file
+    );
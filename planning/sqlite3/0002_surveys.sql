@@ -0,0 +1,65 @@
+CREATE TABLE IF NOT EXISTS SURVEY (
+    survey_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER REFERENCES USER(user_id),
+    organization_id INTEGER,
+    title TEXT NOT NULL,
+    description TEXT,
+    start_date TIMESTAMP,
+    end_date TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- Open surveys, newest first
+CREATE INDEX IF NOT EXISTS SURVEY_START ON SURVEY(start_date);
+
+CREATE TABLE IF NOT EXISTS QUESTION (
+    question_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    survey_id INTEGER NOT NULL REFERENCES SURVEY(survey_id),
+    type INTEGER NOT NULL,
+    header TEXT NOT NULL,
+    description TEXT
+);
+
+CREATE INDEX IF NOT EXISTS QUESTION_SURVEY ON QUESTION(survey_id);
+
+CREATE TABLE IF NOT EXISTS ANSWER (
+    answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_id INTEGER NOT NULL REFERENCES QUESTION(question_id),
+    name TEXT NOT NULL,
+    description TEXT,
+    "order" INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ANSWER_QUESTION ON ANSWER(question_id);
+
+CREATE TABLE IF NOT EXISTS ATTRIBUTE (
+    attribute_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_id INTEGER NOT NULL REFERENCES QUESTION(question_id),
+    type INTEGER NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ATTRIBUTE_QUESTION ON ATTRIBUTE(question_id);
+
+CREATE TABLE IF NOT EXISTS RESULT (
+    result_id INTEGER PRIMARY KEY,
+    survey_id INTEGER NOT NULL REFERENCES SURVEY(survey_id),
+    ip TEXT,
+    submitted_date TIMESTAMP NOT NULL
+);
+-- By id (the latest result, exports) and by submission time (pages), the rowid ends both
+CREATE INDEX IF NOT EXISTS RESULT_SURVEY ON RESULT(survey_id);
+CREATE INDEX IF NOT EXISTS RESULT_SURVEY_SUBMITTED ON RESULT(survey_id, submitted_date);
+
+-- One row per answer, multiple selections are multiple rows.
+-- answer_id for selections, answer for text or numbers.
+-- Stored by result (WITHOUT ROWID), a result's answers are always read together,
+-- position keeps them in the order they were submitted.
+CREATE TABLE IF NOT EXISTS RESULT_ANSWER (
+    result_id INTEGER NOT NULL REFERENCES RESULT(result_id),
+    position INTEGER NOT NULL,
+    question_id INTEGER NOT NULL REFERENCES QUESTION(question_id),
+    answer_id INTEGER REFERENCES ANSWER(answer_id),
+    answer,
+    PRIMARY KEY (result_id, position)
+) WITHOUT ROWID;
+-- Answers by question, covers counting them (the primary key is part of it)
+CREATE INDEX IF NOT EXISTS RESULT_ANSWER_QUESTION ON RESULT_ANSWER(question_id, answer_id);
@@ -0,0 +1,33 @@
+-- Aggregates, updated with every inserted result.
+-- Respondents per question
+CREATE TABLE IF NOT EXISTS AGGREGATE_QUESTION (
+    question_id INTEGER PRIMARY KEY,
+    responses INTEGER NOT NULL
+);
+
+-- Times each option was selected
+CREATE TABLE IF NOT EXISTS AGGREGATE_OPTION (
+    question_id INTEGER NOT NULL,
+    answer_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (question_id, answer_id)
+) WITHOUT ROWID;
+
+-- Running stats of NUMBER, PERCENTAGE and SLIDE questions
+CREATE TABLE IF NOT EXISTS AGGREGATE_NUMERIC (
+    question_id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    sum_squares REAL NOT NULL,
+    min REAL,
+    max REAL
+);
+
+-- bucket covers [bucket * width, (bucket + 1) * width)
+CREATE TABLE IF NOT EXISTS AGGREGATE_HISTOGRAM (
+    question_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    width REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (question_id, bucket)
+) WITHOUT ROWID;
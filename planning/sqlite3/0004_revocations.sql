@@ -0,0 +1,11 @@
+-- Revoked JWTs, kept until they expire. Loaded in memory by every process.
+CREATE TABLE IF NOT EXISTS REVOKED_TOKEN (
+    jti TEXT PRIMARY KEY,
+    expires_at INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- Every token of the user issued before revoked_before (epoch seconds) is revoked
+CREATE TABLE IF NOT EXISTS REVOKED_USER (
+    user_id INTEGER PRIMARY KEY REFERENCES USER(user_id),
+    revoked_before INTEGER NOT NULL
+);
@@ -0,0 +1,48 @@
+"""
+Request thread cost of an AccessLog line, against a synchronous logger.info line per request
+like the handler used to write, both to /dev/null.\n
+Run from server/python/basic: python -m benchmark.access_log
+"""
+import logging
+import os
+import time
+from util import AccessLog
+
+RECORDS = 100_000
+
+
+def main():
+    access_log = AccessLog()
+    access_log.file = os.devnull
+    access_log.max_pending = 2 * RECORDS
+    start = time.perf_counter()
+    for _ in range(RECORDS):
+        access_log.record("GET", "/restapi/surveys/{survey_id:int}", "/restapi/surveys/1",
+                          200, 0.0012, 0, 512, "127.0.0.1")
+    elapsed = time.perf_counter() - start
+    print(f"access log:        {elapsed / RECORDS * 1e9:>6.0f} ns/request")
+    access_log.rates["/restapi/surveys/{survey_id:int}"] = 0.01
+    start = time.perf_counter()
+    for _ in range(RECORDS):
+        access_log.record("GET", "/restapi/surveys/{survey_id:int}", "/restapi/surveys/1",
+                          200, 0.0012, 0, 512, "127.0.0.1")
+    elapsed = time.perf_counter() - start
+    print(f"access log at 1%:  {elapsed / RECORDS * 1e9:>6.0f} ns/request")
+    access_log.close()
+
+    with open(os.devnull, "w") as devnull:
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(logging.Formatter('[%(name)s][%(levelname)s] - %(asctime)s: %(message)s'))
+        logger = logging.getLogger('WebApp')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        start = time.perf_counter()
+        for _ in range(RECORDS):
+            logger.info("GET"+": "+"/restapi/surveys/1")
+        elapsed = time.perf_counter() - start
+    print(f"logger.info:       {elapsed / RECORDS * 1e9:>6.0f} ns/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+JWTService.decode throughput, cold (first time a token is seen: signature, base64
+and JSON) vs warm (served from the verified-token cache), and encode throughput
+(the header segment is encoded once per content type).\n
+Run from server/python/basic: python -m benchmark.jwt
+"""
+import time
+from services.jwt import DecodedJWT, JWTService
+
+TOKENS = 5000
+
+
+def build(service: JWTService) -> list[str]:
+    now = int(time.time())
+    tokens = []
+    for i in range(TOKENS):
+        jwt = DecodedJWT()
+        jwt.set_content_type("access")
+        jwt.set_subject({"id": i, "role": "ANALYST", "name": f"User {i}"})
+        jwt.set_issued_at(now)
+        jwt.set_expiration_time(now + 1800)
+        tokens.append(service.encode(jwt))
+    return tokens
+
+
+def run(service: JWTService, tokens: list[str]) -> float:
+    start = time.perf_counter()
+    for token in tokens:
+        service.decode(token)
+    return time.perf_counter() - start
+
+
+def main():
+    service = JWTService()
+    start = time.perf_counter()
+    tokens = build(service)
+    encode = time.perf_counter() - start
+    print(f"{'encode':>5} {TOKENS / encode:>12,.0f} tokens/s")
+    cold = run(service, tokens)
+    warm = min(run(service, tokens) for _ in range(5))
+    print(f"{'':>5} {'decodes/s':>12} {'us/decode':>10}")
+    for name, elapsed in (("cold", cold), ("warm", warm)):
+        print(f"{name:>5} {TOKENS / elapsed:>12,.0f} {elapsed / TOKENS * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Requests per second against a ThreadPoolHTTPServer, with keep-alive connections
+vs a new connection per request ("Connection: close").\n
+Run from server/python/basic: python -m benchmark.keepalive
+"""
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import logging
+import threading
+import time
+from handler import Application, CustomHandler
+from server import ThreadPoolHTTPServer
+from util import inject
+
+CLIENTS = 8
+REQUESTS = 500
+
+
+class QuietHandler(CustomHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def client(port: int, keep_alive: bool) -> int:
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {} if keep_alive else {'Connection': 'close'}
+    for _ in range(REQUESTS):
+        connection.request('GET', '/benchmark/ping', headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if not keep_alive:
+            connection.close()
+    connection.close()
+    return REQUESTS
+
+
+def run(port: int, keep_alive: bool) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        total = sum(pool.map(lambda _: client(port, keep_alive), range(CLIENTS)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    logging.disable(logging.INFO)
+    app = inject(Application)
+    app.GET("/benchmark/ping")(lambda handler: "pong")
+    app.compile()
+    server = ThreadPoolHTTPServer(('127.0.0.1', 0), QuietHandler, CLIENTS)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_address[1]
+    try:
+        run(port, True)  # Warm up
+        print(f"{CLIENTS} clients x {REQUESTS} requests")
+        for name, keep_alive in (("keep-alive", True), ("close", False)):
+            print(f"{name:>10} {run(port, keep_alive):>10,.0f} req/s")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Memory and build time of 1M result answers: the plain dataclass ResultAnswer was
+(a __dict__ per instance), the slotted one in model and a tuple row like the ones
+the repository returns for reads that only need ids and values.\n
+Run from server/python/basic: python -m benchmark.memory
+"""
+from dataclasses import dataclass
+import gc
+import time
+import tracemalloc
+from model import Answer, Question, QuestionType, ResultAnswer
+
+COUNT = 1_000_000
+
+
+@dataclass
+class DictResultAnswer:
+    """ResultAnswer before slots."""
+    question: Question
+    answer: Answer | str | float
+
+
+def measure(build) -> tuple[float, float]:
+    gc.collect()
+    start = time.perf_counter()
+    items = build()
+    elapsed = time.perf_counter() - start
+    del items
+    gc.collect()
+    # Traced apart, tracemalloc slows allocations down
+    tracemalloc.start()
+    items = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return size, elapsed
+
+
+def main():
+    options = [Answer(i, f"Option {i}", None, i) for i in range(5)]
+    question = Question(1, QuestionType.MENU_SELECT, "Favourite", None, [], options)
+    candidates = (
+        ("__dict__", lambda: [DictResultAnswer(question, options[i % 5]) for i in range(COUNT)]),
+        ("slots", lambda: [ResultAnswer(question, options[i % 5]) for i in range(COUNT)]),
+        # What a ResultAnswer holds, as (question_id, answer_id, value)
+        ("row", lambda: [(question.id, options[i % 5].id, None) for i in range(COUNT)]),
+    )
+    print(f"{'':>9} {'MiB':>8} {'bytes/item':>11} {'build s':>8}")
+    for name, build in candidates:
+        size, elapsed = measure(build)
+        print(f"{name:>9} {size / 2**20:>8.1f} {size / COUNT:>11.1f} {elapsed:>8.2f}")
+    print("Sizes include the list holding them (8 bytes per item).")
+
+
+if __name__ == "__main__":
+    main()
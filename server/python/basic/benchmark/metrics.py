@@ -0,0 +1,42 @@
+"""
+Cost of recording a request in Metrics, from THREADS threads at once, and of rendering
+/metrics with ROUTES routes recorded.\n
+Run from server/python/basic: python -m benchmark.metrics
+"""
+from concurrent.futures import ThreadPoolExecutor
+import time
+from util import Metrics
+
+THREADS = 8
+RECORDS = 200_000
+ROUTES = 50
+STATUSES = (200, 201, 204, 400, 404)
+
+
+def record(metrics: Metrics, count: int):
+    for i in range(count):
+        metrics.request_started()
+        metrics.request_finished("GET", f"/restapi/route/{i % ROUTES}", STATUSES[i % len(STATUSES)],
+                                 (i % 100) / 1000, 0, 512)
+
+
+def main():
+    metrics = Metrics()
+    for threads in (1, THREADS):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            for _ in range(threads):
+                executor.submit(record, metrics, RECORDS // threads)
+        elapsed = time.perf_counter() - start
+        print(f"{threads:>2} threads: {elapsed / RECORDS * 1e9:>6.0f} ns/request")
+    metrics.enabled = False
+    start = time.perf_counter()
+    record(metrics, RECORDS)
+    print(f"  disabled: {(time.perf_counter() - start) / RECORDS * 1e9:>6.0f} ns/request")
+    start = time.perf_counter()
+    text = metrics.render()
+    print(f"    render: {(time.perf_counter() - start) * 1000:>6.1f} ms, {len(text)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Password verifications (logins) per second with CLIENTS concurrent request threads,
+for scrypt and PBKDF2 at different costs, hashing in the request threads (workers 0)
+or in PooledPasswordEncoder pools of different sizes.\n
+Run from server/python/basic: python -m benchmark.passwords
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from util import PasswordEncoder, Pbkdf2PasswordEncoder, PooledPasswordEncoder, ScryptPasswordEncoder
+
+CLIENTS = 8
+LOGINS = 32
+WORKERS = sorted({0, 1, 2, os.cpu_count()})
+
+ENCODERS = (
+    ("scrypt ln=12", ScryptPasswordEncoder(12)),
+    ("scrypt ln=14", ScryptPasswordEncoder(14)),
+    ("pbkdf2 100k", Pbkdf2PasswordEncoder(100_000)),
+    ("pbkdf2 600k", Pbkdf2PasswordEncoder(600_000)),
+)
+
+
+def run(encoder: PasswordEncoder, encoded: str) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CLIENTS) as clients:
+        assert all(clients.map(lambda _: encoder.matches("password", encoded), range(LOGINS)))
+    return time.perf_counter() - start
+
+
+def main():
+    print(f"{CLIENTS} clients, {os.cpu_count()} cpus")
+    print(f"{'':>13} {'workers':>7} {'logins/s':>9} {'ms/login':>9}")
+    for name, encoder in ENCODERS:
+        encoded = encoder.encode("password")
+        for workers in WORKERS:
+            pooled = PooledPasswordEncoder(encoder, workers)
+            # Starts the pool, not measured
+            pooled.matches("password", encoded)
+            elapsed = run(pooled, encoded)
+            pooled.close()
+            print(f"{name:>13} {workers:>7} {LOGINS / elapsed:>9.1f} {elapsed / LOGINS * CLIENTS * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
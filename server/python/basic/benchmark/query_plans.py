@@ -0,0 +1,132 @@
+"""
+Checks the query plans of the survey, question and result repositories against the schema
+the migrations build: every statement they run is captured, explained with
+EXPLAIN QUERY PLAN and has to use the expected indexes, without scanning RESULT or
+RESULT_ANSWER, sorting in a temporary b-tree or building automatic indexes.\n
+Exits with 1 when a plan is wrong, so it can run next to the build.\n
+Run from server/python/basic: python -m benchmark.query_plans
+"""
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import sys
+import tempfile
+from model import Answer, Question, QuestionType, Result, ResultAnswer, Survey
+from repository import (DataSession, QuestionInUseException, QuestionRepository, ResultRepository,
+                        SQLite3Migrator, SQLite3Session, SurveyRepository, load_repository)
+from repository.pool import SQLite3ConnectionPool
+from util import Context
+
+RESULTS = 2000
+# Anywhere in a plan, these mean rows or sorts growing with the table
+FORBIDDEN = ("SCAN RESULT", "SCAN RESULT_ANSWER", "USE TEMP B-TREE", "AUTOMATIC")
+
+
+class RecordingSession(SQLite3Session):
+    """Keeps every statement run through it with it's parameters."""
+
+    def __init__(self, pool: SQLite3ConnectionPool):
+        super().__init__(pool)
+        self.statements = list[tuple[str, tuple]]()
+
+    def query(self, sql: str, parameters=()):
+        self.statements.append((sql, tuple(parameters)))
+        return super().query(sql, parameters)
+
+
+def seed(context: Context):
+    surveys = context.get_instance(SurveyRepository)
+    now = datetime.now()
+    questions = [
+        Question(None, QuestionType.MENU_SELECT, "Favourite", None, [],
+                 [Answer(None, f"Option {i}", None, i) for i in range(5)]),
+        Question(None, QuestionType.NUMBER, "Age"),
+    ]
+    for i in range(50):
+        surveys.create_survey(Survey(None, None, None, f"Survey {i}", None,
+                                     now - timedelta(days=i), None), questions, None)
+    definition = context.get_instance(ResultRepository).get_survey_questions(1)
+    menu, number = definition.values()
+    results = [Result(None, 1 + i % 50, "127.0.0.1", now - timedelta(seconds=i),
+                      [ResultAnswer(menu, menu.answers[i % 5]), ResultAnswer(number, str(i % 90))])
+               for i in range(RESULTS)]
+    context.get_instance(ResultRepository).insert_results(results)
+
+
+def plan(conn: sqlite3.Connection, sql: str, parameters: tuple) -> list[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+
+
+def check(conn: sqlite3.Connection, session: RecordingSession, name: str, expected: tuple[str, ...]) -> bool:
+    """Plans of the statements run since the last check, expected index names must all show up."""
+    steps = list[str]()
+    for sql, parameters in session.statements:
+        steps.extend(plan(conn, sql, parameters))
+    session.statements.clear()
+    problems = [f"missing {index}" for index in expected if not any(index in s for s in steps)]
+    problems += [f"uses {s}" for s in steps if any(f in s for f in FORBIDDEN)]
+    print(f"{'ok' if not problems else 'FAIL':>4} {name}")
+    for step in steps:
+        print(f"       {step}")
+    for problem in problems:
+        print(f"       -> {problem}")
+    return not problems
+
+
+def main():
+    load_repository(init=False)
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, "plans.db")
+        SQLite3Migrator(lambda: sqlite3.connect(file)).migrate()
+        pool = SQLite3ConnectionPool(
+            lambda: sqlite3.connect(file, autocommit=False, check_same_thread=False),
+            size=1, max_idle=60, timeout=1)
+        context = Context()
+        session = RecordingSession(pool)
+        context.set_instance(DataSession, session)
+        seed(context)
+        session.close()
+
+        context = Context()
+        session = RecordingSession(pool)
+        context.set_instance(DataSession, session)
+        conn = sqlite3.connect(file)
+        conn.execute("ANALYZE")
+        surveys = context.get_instance(SurveyRepository)
+        questions = context.get_instance(QuestionRepository)
+        results = context.get_instance(ResultRepository)
+        now = datetime.now()
+
+        ok = True
+        surveys.open_surveys(now, None, 10)
+        ok &= check(conn, session, "open surveys", ("SURVEY_START",))
+        surveys.open_surveys(now, ("2024-01-01 00:00:00", 5), 10)
+        ok &= check(conn, session, "open surveys, next page", ("SURVEY_START",))
+        questions.get_questions(1)
+        ok &= check(conn, session, "questions of a survey",
+                    ("QUESTION_SURVEY", "ANSWER_QUESTION", "ATTRIBUTE_QUESTION"))
+        questions.get_question(1, 1)
+        ok &= check(conn, session, "question", ("ANSWER_QUESTION", "ATTRIBUTE_QUESTION"))
+        try:
+            questions.delete_question(1, 1)
+        except QuestionInUseException:
+            pass
+        ok &= check(conn, session, "question in use", ("RESULT_ANSWER_QUESTION",))
+        page = results.page_results(1, None, 20)
+        ok &= check(conn, session, "results page", ("RESULT_SURVEY_SUBMITTED",))
+        results.page_results(1, (page[-1][1], page[-1][0]), 20)
+        ok &= check(conn, session, "results, next page", ("RESULT_SURVEY_SUBMITTED",))
+        results.get_answers([row[0] for row in page])
+        ok &= check(conn, session, "answers of a page", ("PRIMARY KEY",))
+        results.last_result_id(1)
+        ok &= check(conn, session, "last result", ("RESULT_SURVEY",))
+        for _ in results.iter_answer_rows(1, 100):
+            pass
+        ok &= check(conn, session, "answers of a survey", ("RESULT_SURVEY", "PRIMARY KEY"))
+        session.close()
+        conn.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
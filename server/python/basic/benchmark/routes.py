@@ -0,0 +1,63 @@
+"""
+Route lookup time with 10, 100 and 1000 routes, linear list vs RouteTable.\n
+Run from server/python/basic: python -m benchmark.routes
+"""
+import re
+import timeit
+from routing import RouteTable
+
+
+def endpoint(handler):
+    pass
+
+
+def linear_solve(routes, incomming):
+    # Same as the previous Application.solve
+    for path, func in routes:
+        if isinstance(path, re.Pattern):
+            match = path.match(incomming)
+            if match is not None:
+                return func, match
+        elif path == incomming:
+            return func, None
+    return None, None
+
+
+def build(count: int):
+    linear = []
+    table = RouteTable()
+    for i in range(count):
+        if i % 2 == 0:
+            # Literal
+            path = f"/restapi/resource{i}/list"
+            linear.append((path, endpoint))
+            table.add(path, endpoint)
+        else:
+            # Parameterized
+            linear.append(
+                (re.compile(rf"^/restapi/resource{i}/(\d+)/items$"), endpoint))
+            table.add(f"/restapi/resource{i}/{{id:int}}/items", endpoint)
+    table.compile()
+    return linear, table
+
+
+def main():
+    print(f"{'routes':>7} {'path':>9} {'linear (us)':>12} {'table (us)':>11}")
+    for count in (10, 100, 1000):
+        linear, table = build(count)
+        paths = {
+            'literal': f"/restapi/resource{count - 2}/list",
+            'param': f"/restapi/resource{count - 1}/42/items",
+            'miss': "/restapi/missing",
+        }
+        for name, path in paths.items():
+            number = 2000
+            t_linear = timeit.timeit(
+                lambda: linear_solve(linear, path), number=number)
+            t_table = timeit.timeit(lambda: table.solve(path), number=number)
+            print(
+                f"{count:>7} {name:>9} {t_linear / number * 1e6:>12.2f} {t_table / number * 1e6:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
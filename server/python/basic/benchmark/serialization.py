@@ -0,0 +1,84 @@
+"""
+Encoding a page of 10k result answers (1k results of 10 answers) to JSON bytes, the __dict__
+fallback to_json used (taught Enums and datetimes, it couldn't encode them) vs the generated
+per-class encoders with each available backend.\n
+Run from server/python/basic: python -m benchmark.serialization
+"""
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+import json
+import time
+from model import Answer, Attribute, AttributeType, Question, QuestionType, Result, ResultAnswer
+from util import serialization
+
+RESULTS = 1000
+ANSWERS_PER_RESULT = 10
+ROUNDS = 5
+
+
+def build_page() -> list[Result]:
+    options = [Answer(i, f"Option {i}", None, i) for i in range(5)]
+    questions = [
+        Question(1, QuestionType.MENU_SELECT, "Favourite", "Pick one", [], options),
+        Question(2, QuestionType.CHECKBOX, "All that apply", None, [
+            Attribute(AttributeType.MAX_SELECT, "3")], options),
+        Question(3, QuestionType.SLIDE, "How much", None, [
+            Attribute(AttributeType.MIN_VALUE, "0"), Attribute(AttributeType.MAX_VALUE, "10")]),
+        Question(4, QuestionType.TEXT, "Anything else?"),
+    ]
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    page = list[Result]()
+    for i in range(RESULTS):
+        result = Result(i, 1, f"10.0.{i // 256}.{i % 256}", start + timedelta(minutes=i))
+        for j in range(ANSWERS_PER_RESULT):
+            question = questions[j % len(questions)]
+            match question.type:
+                case QuestionType.MENU_SELECT | QuestionType.CHECKBOX:
+                    answer = options[(i + j) % len(options)]
+                case QuestionType.SLIDE:
+                    answer = float((i * j) % 11)
+                case _:
+                    answer = f"Comment {i}-{j}"
+            result.answers.append(ResultAnswer(question, answer))
+        page.append(result)
+    return page
+
+
+def dict_fallback(o):
+    if isinstance(o, Enum):
+        return o.name
+    if isinstance(o, datetime):
+        return o.isoformat()
+    # The model has __slots__ now, __dict__ is what to_json used
+    return o.__dict__ if hasattr(o, '__dict__') else {k: getattr(o, k) for k in o.__slots__}
+
+
+def baseline(page: list[Result]) -> bytes:
+    return json.dumps(page, default=dict_fallback).encode('utf-8')
+
+
+def run(func, page: list[Result]) -> tuple[float, int]:
+    best = float('inf')
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        size = len(func(page))
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    page = build_page()
+    candidates = [("__dict__", baseline), ("json", serialization._json_dumps)]
+    if serialization.orjson is not None:
+        candidates.append(("orjson", serialization._orjson_dumps))
+    else:
+        print("orjson isn't installed, skipping it")
+    answers = RESULTS * ANSWERS_PER_RESULT
+    print(f"{'':>9} {'ms/page':>9} {'answers/s':>12} {'bytes':>10}")
+    for name, func in candidates:
+        elapsed, size = run(func, page)
+        print(f"{name:>9} {elapsed * 1000:>9.2f} {answers / elapsed:>12,.0f} {size:>10,}")
+
+
+if __name__ == "__main__":
+    main()
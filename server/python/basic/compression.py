@@ -0,0 +1,110 @@
+"""
+Negotiated response compression, br (when the brotli module is installed), gzip and deflate.\n
+Only text-like bodies of at least server.compression.min_size bytes are compressed,
+smaller ones grow or barely shrink and still cost CPU.
+"""
+from collections import OrderedDict
+import gzip
+import threading
+from typing import Optional
+import zlib
+from util import singleton, value
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENABLED = value('server.compression', 'true').lower() == 'true'
+MIN_SIZE = int(value('server.compression.min_size', '1024'))
+LEVEL = int(value('server.compression.level', '6'))
+# Past 5 brotli gets much slower for little gain, too slow for dynamic responses
+BROTLI_QUALITY = 5
+
+# In order of preference when the client accepts several with the same q
+ENCODINGS = ('br', 'gzip', 'deflate') if brotli is not None else ('gzip', 'deflate')
+COMPRESSIBLE = ('text/', 'application/json', 'application/x-ndjson',
+                'application/javascript', 'application/xml', 'image/svg+xml')
+
+# Accept-Encoding values are few (one per browser), negotiated once
+_negotiated = dict[str, Optional[str]]()
+
+
+def compressible(content_type: Optional[str]) -> bool:
+    return ENABLED and content_type is not None and content_type.lower().startswith(COMPRESSIBLE)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best encoding the client accepts, None for identity."""
+    if not ENABLED or not accept_encoding:
+        return None
+    if accept_encoding in _negotiated:
+        return _negotiated[accept_encoding]
+    accepted = dict[str, float]()
+    for item in accept_encoding.split(","):
+        name, *params = item.split(";")
+        q = 1.0
+        for param in params:
+            key, _, q_value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(q_value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    if len(_negotiated) < 256:
+        _negotiated[accept_encoding] = best
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    match encoding:
+        case 'br':
+            return brotli.compress(data, quality=BROTLI_QUALITY)
+        case 'gzip':
+            # mtime=0, the same body always compresses to the same bytes
+            return gzip.compress(data, LEVEL, mtime=0)
+        case 'deflate':
+            # HTTP's deflate is the zlib format, not raw deflate
+            return zlib.compress(data, LEVEL)
+    raise ValueError(f"Unknown encoding \"{encoding}\"")
+
+
+@singleton
+class CompressionCache:
+    """
+    Encoded bodies of immutable responses by (ETag, encoding), server.compression.cache_bytes at most.\n
+    Values are (body, encoding) as sent, the encoding is None when the body was left as is.
+    """
+    __entries: OrderedDict[tuple[str, Optional[str]], tuple[bytes, Optional[str]]]
+
+    def __init__(self):
+        self.capacity = int(value('server.compression.cache_bytes', '16777216'))
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def get(self, etag: str, encoding: Optional[str]) -> Optional[tuple[bytes, Optional[str]]]:
+        with self.__lock:
+            entry = self.__entries.get((etag, encoding))
+            if entry is not None:
+                self.__entries.move_to_end((etag, encoding))
+            return entry
+
+    def put(self, etag: str, encoding: Optional[str], body: bytes, sent_encoding: Optional[str]):
+        if len(body) > self.capacity:
+            return
+        with self.__lock:
+            previous = self.__entries.pop((etag, encoding), None)
+            if previous is not None:
+                self.__size -= len(previous[0])
+            self.__entries[(etag, encoding)] = (body, sent_encoding)
+            self.__size += len(body)
+            while self.__size > self.capacity:
+                _, (evicted, _) = self.__entries.popitem(last=False)
+                self.__size -= len(evicted)
@@ -1,15 +1,23 @@
+import asyncio
 from collections import defaultdict
 from http import HTTPMethod, HTTPStatus
 from http.server import BaseHTTPRequestHandler
-import json
+import inspect
+import io
 import logging
 import re
+import threading
+import time
 import traceback
-from typing import Any, Callable, List, Literal, Optional, Type, TypeVar
+from typing import Any, Callable, Iterable, List, Literal, Optional, Type, TypeVar
 from urllib.parse import urlparse, parse_qs
 from cgi import parse_header
-from repository import DataSession
-from util import inject, singleton, Context
+import compression
+from dataclasses import dataclass
+from model import Roles
+from repository import CommitException, DataSession
+from routing import RouteMatch, RouteTable
+from util import AccessLog, BodyValidationException, Metrics, decoder_for, dumps, inject, loads, singleton, value, Context
 
 logger = logging.getLogger('WebApp')
 
@@ -25,77 +33,166 @@ type EndpointWithBody[T] = Callable[[BaseHTTPRequestHandler, T], None]
 class HttpError(Exception):
     status: HTTPStatus
     message: str
+    # Sent as JSON with the message, like the fields of an invalid body
+    details: Optional[Any]
 
-    def __init__(self, status: HTTPStatus, message: str):
+    def __init__(self, status: HTTPStatus, message: str, details: Optional[Any] = None):
         super().__init__(f"HTTP Error {status}: {message}")
         self.status = status
         self.message = message
+        self.details = details
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """
+    Lets the ResponseCacheMiddleware keep an endpoint's 200 responses for ttl seconds.\n
+    depends_on is a (topic, path param) pair, like ("survey", "survey_id"), the cached responses
+    are dropped when a change of that topic and key is notified.
+    """
+    ttl: float
+    depends_on: Optional[tuple[str, str]] = None
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """A registered endpoint and what it requires from the request."""
+    func: Callable
+    # Any authenticated user when empty
+    roles: frozenset[Roles] = frozenset()
+    authenticated: bool = False
+    path: str = ""
+    cache: Optional[CachePolicy] = None
+    # Dataclass the JSON body is decoded to, passed to func after the handler
+    body: Optional[type] = None
+
+    def __call__(self, handler: 'CustomHandler'):
+        if self.body is None:
+            return self.func(handler)
+        return self.func(handler, handler.getBody(self.body))
+
+
+@singleton
+class SessionCounter:
+    """Requests and the DataSessions they actually opened, by route."""
+    __counts: defaultdict[str, list[int]]
+
+    def __init__(self):
+        self.__counts = defaultdict(lambda: [0, 0])
+        self.__lock = threading.Lock()
+
+    def record(self, route: str, opened: bool):
+        with self.__lock:
+            counts = self.__counts[route]
+            counts[0] += 1
+            counts[1] += opened
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        with self.__lock:
+            return {route: {"requests": requests, "sessions": sessions}
+                    for route, (requests, sessions) in self.__counts.items()}
+
+
+class Middleware:
+    """
+    Hooks around every endpoint, in the order they were added with Application.use.\n
+    before returns None to go on, or a response that skips the remaining middlewares and the endpoint.
+    after gets the response and returns the one to send, in reverse order and only for the
+    middlewares whose before ran. Raising HttpError from either is an error response.
+    With the async server they run on the event loop, they shouldn't block.
+    """
+
+    def before(self, handler: 'CustomHandler', endpoint: Endpoint) -> Any:
+        return None
+
+    def after(self, handler: 'CustomHandler', endpoint: Endpoint, response: Any) -> Any:
+        return response
 
 
 @singleton
 class Application:
+    _middlewares: list[Middleware]
+
     def __init__(self):
-        self._methods: defaultdict[HTTPMethod, List[tuple[str |
-                                                          re.Pattern, Callable]]] = defaultdict(list)
+        self._methods: defaultdict[HTTPMethod,
+                                   RouteTable] = defaultdict(RouteTable)
+        self._middlewares = []
 
     # Register
-    def register(self, method: HTTPMethod, path: str | re.Pattern, func: BaseEndpoint | EndpointWithBody):
-        self._methods[method].append((path, func))
-
-    # Simple solver
-    def solve(self, method: HTTPMethod, incomming: str) -> tuple[Optional[Callable],  Optional[re.Match]]:
-        for path, func in self._methods[method]:
-            # Checking if it's a pattern.
-            if isinstance(path, re.Pattern):
-                match = path.match(incomming)  # Checking for regex
-                if match is not None:
-                    return func, match
-            elif path == incomming:
-                return func, None
-        return None, None
+    def register(self, method: HTTPMethod, path: str | re.Pattern, func: BaseEndpoint | EndpointWithBody,
+                 roles: Iterable[Roles] = (), authenticated: bool = False, cache: Optional[CachePolicy] = None,
+                 body: Optional[type] = None):
+        roles = frozenset(roles)
+        if body is not None:
+            # Built now, a type it can't decode fails at startup
+            decoder_for(body)
+        self._methods[method].add(path, Endpoint(
+            func, roles, authenticated or bool(roles), path if isinstance(path, str) else path.pattern, cache, body))
+
+    def compile(self):
+        """Prepares every route table, otherwise it's done on the first request."""
+        for table in self._methods.values():
+            table.compile()
+
+    def solve(self, method: HTTPMethod, incomming: str) -> tuple[Optional[Endpoint],  Optional[re.Match | RouteMatch]]:
+        table = self._methods.get(method)
+        endpoint, m = (None, None) if table is None else table.solve(incomming)
+        if endpoint is None and method == HTTPMethod.HEAD:
+            # HEAD is a GET without the body, unless it has it's own route
+            return self.solve(HTTPMethod.GET, incomming)
+        return endpoint, m
+
+    def use(self, middleware: Middleware):
+        self._middlewares.append(middleware)
+
+    def before(self, handler: 'CustomHandler', endpoint: Endpoint) -> tuple[int, Any]:
+        """Runs the before hooks, returns how many ran and the response if one short-circuited."""
+        for index, middleware in enumerate(self._middlewares):
+            response = middleware.before(handler, endpoint)
+            if response is not None:
+                return index + 1, response
+        return len(self._middlewares), None
+
+    def after(self, handler: 'CustomHandler', endpoint: Endpoint, ran: int, response: Any) -> Any:
+        for middleware in reversed(self._middlewares[:ran]):
+            response = middleware.after(handler, endpoint, response)
+        return response
 
     # Decorators
-    def GET(self, path: str | re.Pattern):
-        def reg(func: BaseEndpoint[Any]):
-            self.register(HTTPMethod.GET, path,  func)
+    # roles: users with any of them, authenticated: any user. Public when neither is given.
+    # cache: responses kept by the ResponseCacheMiddleware, only for GET and HEAD.
+    # body: dataclass the JSON body is decoded to, the endpoint gets it as second argument.
+    def route(self, method: HTTPMethod, path: str | re.Pattern, roles: Iterable[Roles] = (), authenticated: bool = False,
+              cache: Optional[CachePolicy] = None, body: Optional[type] = None):
+        def reg(func: BaseEndpoint[Any] | EndpointWithBody[Any]):
+            self.register(method, path,  func, roles, authenticated, cache, body)
             return func
-        logger.debug(f"Registered Method GET on path: {path}")
+        logger.debug("Registered Method %s on path: %s", method, path)
         return reg
 
-    def HEAD(self, path: str | re.Pattern):
-        def reg(func: BaseEndpoint[Any]):
-            self.register(HTTPMethod.HEAD, path,  func)
-            return func
-        logger.debug(f"Registered Method HEAD on path: {path}")
-        return reg
+    def GET(self, path: str | re.Pattern, roles: Iterable[Roles] = (), authenticated: bool = False,
+            cache: Optional[CachePolicy] = None):
+        return self.route(HTTPMethod.GET, path, roles, authenticated, cache)
 
-    def DELETE(self, path: str | re.Pattern):
-        def reg(func: BaseEndpoint[Any]):
-            self.register(HTTPMethod.DELETE, path,  func)
-            return func
-        logger.debug(f"Registered Method DELETE on path: {path}")
-        return reg
+    def HEAD(self, path: str | re.Pattern, roles: Iterable[Roles] = (), authenticated: bool = False,
+            cache: Optional[CachePolicy] = None):
+        return self.route(HTTPMethod.HEAD, path, roles, authenticated, cache)
 
-    def POST(self,   path: str | re.Pattern):
-        def reg(func: EndpointWithBody[Any]):
-            self.register(HTTPMethod.POST, path,  func)
-            return func
-        logger.debug(f"Registered Method POST on path: {path}")
-        return reg
+    def DELETE(self, path: str | re.Pattern, roles: Iterable[Roles] = (), authenticated: bool = False,
+            body: Optional[type] = None):
+        return self.route(HTTPMethod.DELETE, path, roles, authenticated, body=body)
 
-    def PUT(self,   path: str | re.Pattern):
-        def reg(func: EndpointWithBody[Any]):
-            self.register(HTTPMethod.PUT, path,  func)
-            return func
-        logger.debug(f"Registered Method DELETE on path: {path}")
-        return reg
+    def POST(self, path: str | re.Pattern, roles: Iterable[Roles] = (), authenticated: bool = False,
+            body: Optional[type] = None):
+        return self.route(HTTPMethod.POST, path, roles, authenticated, body=body)
 
-    def PATCH(self, path: str | re.Pattern):
-        def reg(func: EndpointWithBody[Any]):
-            self.register(HTTPMethod.PATCH, path,  func)
-            return func
-        logger.debug(f"Registered Method PATCH on path: {path}")
-        return reg
+    def PUT(self, path: str | re.Pattern, roles: Iterable[Roles] = (), authenticated: bool = False,
+            body: Optional[type] = None):
+        return self.route(HTTPMethod.PUT, path, roles, authenticated, body=body)
+
+    def PATCH(self, path: str | re.Pattern, roles: Iterable[Roles] = (), authenticated: bool = False,
+            body: Optional[type] = None):
+        return self.route(HTTPMethod.PATCH, path, roles, authenticated, body=body)
 
 
 class Response[T]:
@@ -103,116 +200,445 @@ class Response[T]:
     headers: dict[str, str]
     body: T
 
-    def __init__(self, body: T, headers: dict[str, str] = dict(), status: HTTPStatus = HTTPStatus.OK):
+    def __init__(self, body: T, headers: Optional[dict[str, str]] = None, status: HTTPStatus = HTTPStatus.OK):
         self.body = body
-        self.headers = headers
+        self.headers = dict() if headers is None else headers
         self.status = status
 
+    def render(self) -> tuple[Optional[str], bytes]:
+        """Content type and body as sent, before compression."""
+        match self.body:
+            case None:
+                return None, b""
+            case str():
+                return "text/html; charset=utf-8", self.body.encode('utf-8')
+            case bytes():
+                return "application/octet-stream", self.body
+            case _:  # Try making it into a json
+                return "application/json; charset=utf-8", dumps(self.body)
+
+    def blocking(self) -> bool:
+        """If writing it may block, like building the body from a DataSession."""
+        return False
+
     def writeToHandler(self, handler: BaseHTTPRequestHandler):
-        for k, v in self.headers:
+        self.writePayload(handler, *self.render())
+
+    def writePayload(self, handler: BaseHTTPRequestHandler, content_type: Optional[str], payload: bytes):
+        """Status, headers and a body of known length, so the connection can be reused."""
+        encoding = None
+        if len(payload) >= compression.MIN_SIZE and compression.compressible(content_type) \
+                and "Content-Encoding" not in self.headers:
+            encoding = compression.negotiate(
+                handler.headers.get('Accept-Encoding'))
+            if encoding is not None:
+                payload = compression.compress(payload, encoding)
+        self.writeEncoded(handler, content_type, payload, encoding)
+
+    def writeCached(self, handler: BaseHTTPRequestHandler, etag: str, content_type: Optional[str], render: Callable[[], bytes]):
+        """
+        Body that only changes with it's ETag. 304 when the client already has it, otherwise
+        the encoded bytes come from the CompressionCache and render is only called on a miss.
+        """
+        self.headers["ETag"] = etag
+        if etag_matches(handler.headers.get('If-None-Match'), etag):
+            self.writeNotModified(handler)
+            return
+        encoding = compression.negotiate(handler.headers.get('Accept-Encoding')) \
+            if compression.compressible(content_type) else None
+        cache = compression.CompressionCache()
+        cached = cache.get(etag, encoding)
+        if cached is None:
+            payload = render()
+            sent_encoding = None
+            if encoding is not None and len(payload) >= compression.MIN_SIZE:
+                payload = compression.compress(payload, encoding)
+                sent_encoding = encoding
+            cached = (payload, sent_encoding)
+            cache.put(etag, encoding, *cached)
+        self.writeEncoded(handler, content_type, *cached)
+
+    def writeNotModified(self, handler: BaseHTTPRequestHandler):
+        handler.send_response(HTTPStatus.NOT_MODIFIED)
+        for k, v in self.headers.items():
             handler.send_header(k, v)
+        handler.end_headers()
+        handler.wfile.flush()
 
-        if self.body is None:
-            handler.end_headers()
-            handler.send_response_only(self.status)
-            return
-        if isinstance(self.body, str):
-            handler.send_response(self.status)
-            handler.send_header("Content-type", "text/html; charset=utf-8")
-            payload = self.body.encode('utf-8')
-            handler.send_header("Content-length", len(payload))
+    def writeEncoded(self, handler: BaseHTTPRequestHandler, content_type: Optional[str], payload: bytes, encoding: Optional[str]):
+        handler.send_response(self.status)
+        for k, v in self.headers.items():
+            handler.send_header(k, v)
+        if content_type is not None and "Content-Type" not in self.headers:
+            handler.send_header("Content-Type", content_type)
+        if encoding is not None:
+            handler.send_header("Content-Encoding", encoding)
+        if compression.compressible(content_type):
+            # Caches must not give a compressed body to a client that didn't ask for it
+            handler.send_header("Vary", "Accept-Encoding")
+        # 1xx and 204 can't have a body, not even an empty one
+        if self.status >= 200 and self.status != HTTPStatus.NO_CONTENT:
+            handler.send_header("Content-Length", len(payload))
+        handler.end_headers()
+        if payload and handler.command != "HEAD":
             handler.wfile.write(payload)
-            handler.wfile.flush()
-            handler.end_headers()
-        else:  # Try making it into a json
-            jsonResponse = JsonResponse(self.body, self.headers, self.status)
-            jsonResponse.writeToHandler(handler)
+        handler.wfile.flush()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, like If-None-Match requires."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
 
 
 class JsonResponse[T](Response[T]):
-    def __init__(self, body: T, headers: dict[str, str] = dict(), status: HTTPStatus = HTTPStatus.OK):
+    def __init__(self, body: T, headers: Optional[dict[str, str]] = None, status: HTTPStatus = HTTPStatus.OK):
         super().__init__(body, headers, status)
 
-    def writeToHandler(self, handler):
-        for k, v in self.headers:
-            handler.send_header(k, v)
+    def render(self) -> tuple[Optional[str], bytes]:
         if self.body is None:
-            handler.send_response_only(self.status)
-            handler.end_headers()
-            return
-        payload = json.dumps(self.body)
-        payload = payload.encode('utf-8')
+            return None, b""
+        return "application/json; charset=utf-8", dumps(self.body)
+
+
+class ImmutableResponse[T](JsonResponse[T]):
+    """
+    JSON that never changes for a given ETag, like a published survey.\n
+    It's serialized and compressed bytes are kept in the CompressionCache,
+    so a repeated fetch doesn't serialize, compress or even build the body when it's a callable.
+    """
+    etag: str
+
+    def __init__(self, etag: str, body: T | Callable[[], T], headers: Optional[dict[str, str]] = None, status: HTTPStatus = HTTPStatus.OK):
+        super().__init__(body, headers, status)
+        self.etag = etag
+
+    def blocking(self) -> bool:
+        return callable(self.body)
+
+    def render(self) -> tuple[Optional[str], bytes]:
+        body = self.body() if callable(self.body) else self.body
+        return "application/json; charset=utf-8", dumps(body)
+
+    def writeToHandler(self, handler):
+        self.writeCached(handler, self.etag, "application/json; charset=utf-8",
+                         lambda: self.render()[1])
+
+
+class CachedResponse(Response[bytes]):
+    """A rendered response from the ResponseCache, sent with it's ETag."""
+    etag: str
+    content_type: Optional[str]
+
+    def __init__(self, etag: str, content_type: Optional[str], body: bytes, headers: Optional[dict[str, str]] = None, status: HTTPStatus = HTTPStatus.OK):
+        super().__init__(body, headers, status)
+        self.etag = etag
+        self.content_type = content_type
+
+    def render(self) -> tuple[Optional[str], bytes]:
+        return self.content_type, self.body
+
+    def writeToHandler(self, handler):
+        self.writeCached(handler, self.etag,
+                         self.content_type, lambda: self.body)
+
+
+class StreamingResponse(Response[Iterable[bytes | str]]):
+    """
+    Response with an iterable body written as it's produced, so it never is whole in memory.\n
+    Uses chunked transfer encoding when the connection is HTTP/1.1,
+    otherwise the end of the body is signaled by closing the connection.
+    """
+    content_type: str
+
+    def __init__(self, body: Iterable[bytes | str], content_type: str, headers: Optional[dict[str, str]] = None, status: HTTPStatus = HTTPStatus.OK):
+        super().__init__(body, headers, status)
+        self.content_type = content_type
+
+    def writeToHandler(self, handler: BaseHTTPRequestHandler):
         handler.send_response(self.status)
-        handler.send_header("Content-type", "application/json; charset=utf-8")
-        handler.send_header("Content-length", len(payload))
+        for k, v in self.headers.items():
+            handler.send_header(k, v)
+        handler.send_header("Content-type", self.content_type)
+        chunked = handler.request_version >= "HTTP/1.1" and handler.protocol_version >= "HTTP/1.1"
+        if chunked:
+            handler.send_header("Transfer-Encoding", "chunked")
+        else:
+            handler.close_connection = True
         handler.end_headers()
-        handler.wfile.write(payload)
+        if handler.command == "HEAD":
+            handler.wfile.flush()
+            return
+        for chunk in self.body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue  # An empty chunk would end the body
+            if chunked:
+                handler.wfile.write(b"%x\r\n" % len(chunk))
+                handler.wfile.write(chunk)
+                handler.wfile.write(b"\r\n")
+            else:
+                handler.wfile.write(chunk)
+        if chunked:
+            handler.wfile.write(b"0\r\n\r\n")
         handler.wfile.flush()
 
 
+class TransportWriter:
+    """
+    File-like wfile for AsyncRequestHandler while streaming from an executor thread,
+    each write waits for the event loop to send it, so a slow client slows the producer down.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+        self.__writer = writer
+        self.__loop = loop
+        self.written = 0
+
+    async def __write(self, data: bytes):
+        self.__writer.write(data)
+        await self.__writer.drain()
+
+    def write(self, data: bytes):
+        asyncio.run_coroutine_threadsafe(
+            self.__write(bytes(data)), self.__loop).result()
+        self.written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class CountingWriter:
+    """The wfile of a connection, counting the bytes written to it for the metrics."""
+
+    def __init__(self, raw: io.BufferedIOBase):
+        self.raw = raw
+        self.written = 0
+
+    def write(self, data: bytes):
+        self.written += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    @property
+    def closed(self) -> bool:
+        return self.raw.closed
+
+    def close(self):
+        self.raw.close()
+
+
 T = TypeVar('T')
 
 class CustomHandler(BaseHTTPRequestHandler):
     app: Application = inject(Application)
+    metrics: Metrics = inject(Metrics)
+    access_log: AccessLog = inject(AccessLog)
     __context: Context
-    match: Optional[re.Match]
+    __body: Optional[bytes]
+    # re.Match for regex routes, RouteMatch (typed params) for templates
+    match: Optional[re.Match | RouteMatch]
+    endpoint: Optional[Endpoint]
+    # Sent status, None until the response starts
+    status: Optional[int]
+    # perf_counter when the request line was read, None before
+    started: Optional[float]
+    # Persistent connections, every response has a Content-Length or is chunked
+    protocol_version = "HTTP/1.1"
+    # Seconds a connection can wait for it's next request (or a slow read) before it's closed
+    timeout = float(value('server.timeout', '15'))
+    # Requests served by a connection before it's closed
+    max_requests = int(value('server.keep_alive.max_requests', '100'))
+    # Unread request bodies up to this size are skipped to reuse the connection
+    max_discard = 1 << 20
+    # Larger bodies get 413 without being read
+    max_body = int(value('server.max_body_size', '4194304'))
+    requests_served = 0
+    # Headers and body go out in one write, flushed at the end of each request
+    wbufsize = io.DEFAULT_BUFFER_SIZE
+    # Otherwise Nagle can hold the end of a response until the client ACKs
+    disable_nagle_algorithm = True
 
     def __init__(self, request, client_address, server):
-        self.__context = Context()
+        self._new_context()
         super().__init__(request, client_address, server)
 
+    def _new_context(self):
+        self.__context = Context()
+        self.__body = None
+        self.endpoint = None
+        self.status = None
+        self.started = None
+
+    def setup(self):
+        super().setup()
+        if self.metrics.enabled or self.access_log.enabled:
+            self.wfile = CountingWriter(self.wfile)
+
     def handle(self):
         try:
             super().handle()
         except Exception as e:
             self.handle_exception(e)
 
+    def handle_one_request(self):
+        # A Context per request, a connection can carry more than one
+        self._new_context()
+        self.command = None
+        self.route = None
+        self.requests_served += 1
+        try:
+            super().handle_one_request()
+            if self.command and not self.close_connection:
+                self.skip_body()
+        finally:
+            self.end_request()
+
+    def parse_request(self) -> bool:
+        self.started = time.perf_counter()
+        # Set by a valid request line, not the one of the previous request
+        self.path = ""
+        self.metrics.request_started()
+        if isinstance(self.wfile, CountingWriter):
+            self.wfile.written = 0
+        return super().parse_request()
+
+    def send_response_only(self, code, message=None):
+        self.status = code
+        super().send_response_only(code, message)
+
+    def bytes_written(self) -> int:
+        """Bytes of the current response written so far, 0 when metrics and the access log are disabled."""
+        return self.wfile.written if isinstance(self.wfile, CountingWriter) else 0
+
+    def skip_body(self):
+        """The next request starts after this one's body, even if the endpoint didn't read it."""
+        if 'Transfer-Encoding' in self.headers:
+            # Chunked request bodies aren't supported, their end is unknown
+            self.close_connection = True
+            return
+        try:
+            length = self.content_length()
+        except HttpError:
+            self.close_connection = True
+            return
+        if length > min(self.max_discard, self.max_body):
+            self.close_connection = True
+        else:
+            self.read_body()
+
+    def content_length(self) -> int:
+        """Content-Length of the request, 0 without one, 400 when it isn't only digits."""
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return 0
+        length = length.strip()
+        # int() would also take signs, underscores and non ASCII digits
+        if not (length.isascii() and length.isdigit()):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        return int(length)
+
+    def commit(self):
+        """
+        Commits what the endpoint wrote before the response is written, so a client that got it
+        can already read the changes. If the commit fails nothing was written, it's a 503.
+        """
+        session = self.__context.find_instance(DataSession)
+        if session is None:
+            return
+        try:
+            session.commit()
+        except CommitException as e:
+            logger.warning("%s: %s", e, e.__cause__)
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE,
+                            "The changes couldn't be saved, try again") from e
+
+    def end_request(self):
+        """
+        Closes the DataSession of the request, if it created one, on the thread that used it.
+        It was committed before the response (a StreamingResponse commits here, it reads while written),
+        so this mostly gives the connection back. Requests that didn't query anything never got one.
+        """
+        session = self.__context.find_instance(DataSession)
+        if session is not None:
+            session.close()
+        if self.command:
+            SessionCounter().record(self.route or self.command,
+                                    session is not None and session.opened)
+        if self.started is not None:
+            method = self.command or ""
+            route = self.endpoint.path if self.endpoint is not None else "(unmatched)"
+            status = self.status or 0
+            seconds = time.perf_counter() - self.started
+            bytes_in, bytes_out = len(self.__body or b""), self.bytes_written()
+            self.started = None
+            self.metrics.request_finished(
+                method, route, status, seconds, bytes_in, bytes_out)
+            self.access_log.record(method, route, self.path, status, seconds,
+                                   bytes_in, bytes_out, self.client_address[0])
+
+    async def run_blocking(self, func: Callable[..., T], *args) -> T:
+        """Runs blocking work (DataSession, hashing...) from an async endpoint.\n
+        Here it just runs inline, AsyncRequestHandler sends it to the executor."""
+        return func(*args)
+
     def get_context(self):
         return self.__context
 
     def parseResponse(self, response):
-        # logger.debug(response)
         match response:
-            case None:
-                self.send_response(HTTPStatus.OK)
-                self.end_headers()
-            case str():
-                self.send_response(200)
-                self.send_header("Content-type", "text/html; charset=utf-8")
-                payload = response.encode('utf-8')
-                self.send_header("Content-length", len(payload))
-                self.end_headers()
-                self.wfile.write(payload)
-                self.wfile.flush()
-            case x if isinstance(response, Response):
+            case Response():
                 response.writeToHandler(self)
+            case None | str() | bytes():
+                Response(response).writeToHandler(self)
             case _:
-                response = JsonResponse(response)
-                response.writeToHandler(self)
+                JsonResponse(response).writeToHandler(self)
+
+    def read_body(self) -> bytes:
+        """Raw request body, read once."""
+        if self.__body is None:
+            length = self.content_length()
+            if length > self.max_body:
+                raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                f"Bodies can't be larger than {self.max_body} bytes")
+            self.__body = self.rfile.read(length) if length > 0 else b""
+        return self.__body
 
     def getBody(self, target_clazz: Optional[Type[T]] = None) -> T:
-        content_length = int(self.headers['Content-Length'])
+        """
+        JSON bodies parsed, and decoded to target_clazz when given (a 400 lists every invalid field).
+        Other content types are returned as bytes, unless target_clazz expects JSON.
+        """
         content_type = self.headers['Content-Type']
-        data = self.rfile.read(content_length)
         mimetype, args = "bytes", {}
         if content_type is not None:
             mimetype, args = parse_header(self.headers['Content-Type'])
             mimetype = mimetype.lower()
+        if target_clazz is not None and mimetype != "application/json":
+            raise HttpError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                            "Expected \"Content-Type: application/json\"")
+        data = self.read_body()
         match mimetype:
             case "application/json":
                 try:
-                    data = data.decode("utf-8")
-                    data = json.loads(data)
-                except json.JSONDecodeError as e:
+                    data = loads(data)
+                except ValueError:
                     raise HttpError(
                         HTTPStatus.BAD_REQUEST, "Invalid Content for \"Content-Type: application/json\"")
                 if target_clazz is not None:
                     try:
-                        data = target_clazz(**data)
-                    except TypeError as e:
-                        logger.info(type(e))
+                        data = decoder_for(target_clazz)(data)
+                    except BodyValidationException as e:
                         raise HttpError(HTTPStatus.BAD_REQUEST,
-                                        "Wrong JSON format.")
+                                        "Wrong JSON format.", e.errors)
             case _:
                 pass
         return data
@@ -224,18 +650,39 @@ class CustomHandler(BaseHTTPRequestHandler):
         it shouldn't be in a production enviroment.
         """
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Methods',
+                         'GET, POST, PUT, PATCH, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers',
                          'Content-Type, Authorization, X-Requested-With')
+        if self.requests_served >= self.max_requests:
+            self.send_header('Connection', 'close')
+        elif self.request_version == 'HTTP/1.0' and not self.close_connection:
+            # HTTP/1.0 clients asked with "Connection: keep-alive", it has to be confirmed
+            self.send_header('Connection', 'keep-alive')
         super().end_headers()
 
+    def log_request(self, code='-', size='-'):
+        # Every request is in the AccessLog
+        pass
+
+    def log_message(self, format, *args):
+        # Errors and timeouts of http.server, the error responses are in the AccessLog too
+        logger.debug("%s - " + format, self.address_string(), *args)
+
     def do_OPTIONS(self):
-        self.send_response(HTTPStatus.OK)
+        self.send_response(HTTPStatus.NO_CONTENT)
         self.end_headers()
 
     def handle_exception(self, e: Exception):
-        self.__context.get_instance(DataSession).notifyError()
+        # Rejected requests (like a missing token) never opened one
+        session = self.__context.find_instance(DataSession)
+        if session is not None:
+            session.notifyError()
         if isinstance(e, HttpError):
+            if e.details is not None:
+                JsonResponse({"error": e.message, "details": e.details},
+                             status=e.status).writeToHandler(self)
+                return
             self.send_error(e.status, e.status.description, e.message)
             return
         if isinstance(e, ConnectionAbortedError):
@@ -243,33 +690,152 @@ class CustomHandler(BaseHTTPRequestHandler):
         traceback.print_exception(e)
         self.send_error(500, "Internal Error", "Something went wrong")
 
-    def do_GET(self):
+    def resolve(self) -> Optional[Endpoint]:
+        self.parsed_url = urlparse(self.path)
+        path = self.parsed_url.path
+        endpoint, m = self.app.solve(self.command, path)
+        self.match = m
+        self.endpoint = endpoint
+        if endpoint is None:
+            self.route = f"{self.command} (not found)"
+            self.send_error(404, "Not found", "Didn't match with any path")
+        else:
+            self.route = f"{self.command} {endpoint.path}"
+        return endpoint
+
+    def dispatch(self):
         try:
-            self.parsed_url = urlparse(self.path)
-            logger.info("GET: "+self.parsed_url.path)
-            path = self.parsed_url.path
-            endpoint, m = self.app.solve("GET", path)
-            self.match = m
+            endpoint = self.resolve()
             if endpoint is None:
-                self.send_error(404, "Not found", "Didn't match with any path")
                 return
-            response = endpoint(self)
+            ran, response = self.app.before(self, endpoint)
+            if response is None:
+                response = endpoint(self)
+                if inspect.isawaitable(response):
+                    response = asyncio.run(response)
+            response = self.app.after(self, endpoint, ran, response)
+            if not isinstance(response, StreamingResponse):
+                self.commit()
             self.parseResponse(response)
         except Exception as e:
             self.handle_exception(e)
-            
 
-    def do_POST(self):
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = dispatch
+
+
+class AsyncRequestHandler(CustomHandler):
+    """
+    Same API as CustomHandler for endpoints, but fed by asyncio streams instead of a blocking socket.\n
+    Sync endpoints run on the server executor, async endpoints run on the event loop.
+    Responses are written to a buffer, which the server flushes to the connection.
+    """
+    protocol_version = "HTTP/1.1"
+    framed: bool
+
+    def __init__(self, raw_requestline: bytes, headers: bytes, client_address, server):
+        # Not calling super().__init__, BaseHTTPRequestHandler would start reading a socket.
+        self._new_context()
+        self.client_address = client_address
+        self.server = server
+        self.raw_requestline = raw_requestline
+        self.rfile = io.BytesIO(headers)
+        self.wfile = io.BytesIO()
+        self.close_connection = True
+        self.framed = False
+        self.command = None
+        self.route = None
+        # Bytes sent by a StreamingResponse, the rest is in wfile
+        self.streamed = 0
+
+    def send_response_only(self, code, message=None):
+        # Responses that never have a body
+        if code < 200 or code in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+            self.framed = True
+        super().send_response_only(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() in ('content-length', 'transfer-encoding'):
+            self.framed = True
+        super().send_header(keyword, value)
+
+    def bytes_written(self) -> int:
+        return self.streamed + self.wfile.tell()
+
+    async def run_blocking(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.server.executor, func, *args)
+
+    async def handle_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Handles one request, returns if the connection can be kept open."""
+        self.writer = writer
+        try:
+            if not self.parse_request():
+                return False
+            if 'Transfer-Encoding' in self.headers:
+                self.close_connection = True
+            try:
+                length = self.content_length()
+            except HttpError as e:
+                # Where the next request starts is unknown
+                self.close_connection = True
+                self.send_error(e.status, None, e.message)
+                return False
+            if length > self.max_body:
+                # Not read, so the connection can't go on
+                self.close_connection = True
+                self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, None,
+                                f"Bodies can't be larger than {self.max_body} bytes")
+                return False
+            self.rfile = io.BytesIO(await reader.readexactly(length))
+            await self.dispatch_async()
+        finally:
+            if self.get_context().find_instance(DataSession) is not None:
+                await self.run_blocking(self.end_request)
+            else:
+                self.end_request()
+            writer.write(self.wfile.getvalue())
+            await writer.drain()
+        # Without Content-Length the client can only know the response ended when we close.
+        return not self.close_connection and self.framed
+
+    async def dispatch_async(self):
         try:
-            self.parsed_url = urlparse(self.path)
-            logger.info("POST: "+self.parsed_url.path)
-            path = self.parsed_url.path
-            endpoint, m = self.app.solve("POST", path)
-            self.match = m
+            match self.command:
+                case "GET" | "HEAD" | "POST" | "PUT" | "PATCH" | "DELETE":
+                    endpoint = self.resolve()
+                case "OPTIONS":
+                    self.do_OPTIONS()
+                    return
+                case _:
+                    self.send_error(HTTPStatus.NOT_IMPLEMENTED,
+                                    f"Unsupported method ({self.command!r})")
+                    return
             if endpoint is None:
-                self.send_error(404, "Not found", "Didn't match with any path")
                 return
-            response = endpoint(self)
+            ran, response = self.app.before(self, endpoint)
+            if response is None:
+                if inspect.iscoroutinefunction(endpoint.func):
+                    response = await endpoint(self)
+                else:
+                    response = await self.run_blocking(endpoint, self)
+            response = self.app.after(self, endpoint, ran, response)
+            if not isinstance(response, StreamingResponse) \
+                    and self.get_context().find_instance(DataSession) is not None:
+                await self.run_blocking(self.commit)
+            if isinstance(response, StreamingResponse):
+                # Produced on the executor (it may read a DataSession), sent by the loop
+                self.wfile = TransportWriter(
+                    self.writer, asyncio.get_running_loop())
+                try:
+                    await self.run_blocking(self.parseResponse, response)
+                finally:
+                    self.streamed += self.wfile.written
+                    self.wfile = io.BytesIO()
+                return
+            if isinstance(response, Response) and response.blocking():
+                # Building the body can query the DataSession
+                await self.run_blocking(self.parseResponse, response)
+                return
             self.parseResponse(response)
         except Exception as e:
-            self.handle_exception(e)
\ No newline at end of file
+            await self.run_blocking(self.handle_exception, e)
@@ -1,6 +1,8 @@
-import http.server
 import logging
-logging.basicConfig(format='[%(name)s][%(levelname)s] - %(asctime)s: %(message)s',level=logging.NOTSET)
+import sys
+from typing import Optional
+from util import configure_logging
+configure_logging() # levels from default.properties
 logger = logging.getLogger(__name__)
 
 #
@@ -9,21 +11,38 @@ from services import load_services
 load_repository() #load repositories first
 load_services() #load services
 
-from util import ProviderRegistry, PasswordEncoder, Md5PasswordEncoder
-ProviderRegistry().register_provider(PasswordEncoder, Md5PasswordEncoder)
-
-from handler import CustomHandler
+from handler import Application, CustomHandler
 # Importing all endpoints.
 import restapi
+from middleware import BearerTokenMiddleware, ResponseCacheMiddleware
+from server import create_server, serve
+from repository import AggregateRepository, DataSession
+from util import Context, inject, value
+inject(Application).use(BearerTokenMiddleware())
+inject(Application).use(ResponseCacheMiddleware())
+inject(Application).compile()
 
-PORT = 8080
+PORT = int(value('server.port', '8080'))
 
 def run():
     server_address = ('', PORT)
-    server = http.server.HTTPServer(server_address, CustomHandler)
-    server.serve_forever()
+    server = create_server(server_address, CustomHandler)
+    serve(server)
+
+def rebuild_aggregates(survey_id: Optional[int] = None):
+    context = Context()
+    context.get_instance(AggregateRepository).rebuild(survey_id)
+    context.get_instance(DataSession).close()
+    logger.info("Aggregates rebuilt")
 
 if __name__ == "__main__":
-    logger.info(f"Server running on port {PORT}")
-    run()
+    match sys.argv[1:]:
+        # python main.py rebuild-aggregates [survey_id]
+        case ["rebuild-aggregates"]:
+            rebuild_aggregates()
+        case ["rebuild-aggregates", survey_id]:
+            rebuild_aggregates(int(survey_id))
+        case _:
+            logger.info(f"Server running on port {PORT}")
+            run()
     
\ No newline at end of file
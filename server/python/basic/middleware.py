@@ -0,0 +1,274 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+from http import HTTPStatus
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qsl
+from handler import CachedResponse, CustomHandler, Endpoint, HttpError, ImmutableResponse, JsonResponse, Middleware, Response, StreamingResponse
+from model import Roles
+from services import RevocationList, UserSubject
+from services.jwt import JWTException, JWTService
+from util import inject, on_change, singleton, value
+
+logger = logging.getLogger('WebApp')
+
+
+def current_user(handler: CustomHandler) -> Optional[UserSubject]:
+    """User of the request, set by BearerTokenMiddleware."""
+    return handler.get_context().find_instance(UserSubject)
+
+
+class BearerTokenMiddleware(Middleware):
+    """
+    Decodes the "Authorization: Bearer" access token once and sets it's UserSubject in the request Context.\n
+    Endpoints declaring roles or authenticated get 401 without a valid token and 403 when the user
+    has none of the roles, before the endpoint runs, so a rejected request never opens a DataSession.
+    Public endpoints only get the user when the token is valid.
+    """
+    jwt_service: JWTService
+
+    def __init__(self):
+        self.jwt_service = inject(JWTService)
+        self.revocations = inject(RevocationList)
+
+    def before(self, handler: CustomHandler, endpoint: Endpoint) -> Any:
+        authorization = handler.headers.get('Authorization')
+        if authorization is None:
+            if endpoint.authenticated:
+                raise HttpError(HTTPStatus.UNAUTHORIZED,
+                                "Missing bearer token")
+            return None
+        try:
+            subject, role = self.authenticate(authorization)
+        except HttpError:
+            if endpoint.authenticated:
+                raise
+            return None
+        if endpoint.roles and role not in endpoint.roles:
+            raise HttpError(HTTPStatus.FORBIDDEN,
+                            "Not allowed for your role")
+        handler.get_context().set_instance(UserSubject, subject)
+        return None
+
+    def authenticate(self, authorization: str) -> tuple[UserSubject, Roles]:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HttpError(HTTPStatus.UNAUTHORIZED, "Expected a bearer token")
+        try:
+            decoded = self.jwt_service.decode(token.strip())
+        except JWTException as e:
+            raise HttpError(HTTPStatus.UNAUTHORIZED, str(e))
+        # Refresh tokens only get new access tokens
+        if decoded._header.get("cty") != "access":
+            raise HttpError(HTTPStatus.UNAUTHORIZED, "Expected an access token")
+        if self.revocations.is_revoked(decoded):
+            raise HttpError(HTTPStatus.UNAUTHORIZED, "Revoked JWT")
+        try:
+            subject = UserSubject(**decoded.get_subject())
+            return subject, Roles[subject.role]
+        except (KeyError, TypeError):
+            raise HttpError(HTTPStatus.UNAUTHORIZED, "Invalid JWT")
+
+
+type CacheKey = tuple[str, str, tuple[tuple[str, str], ...], Optional[str]]
+# HEAD responses are kept with their body, it's just not sent
+CACHED_METHODS = ("GET", "HEAD")
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    etag: str
+    content_type: Optional[str]
+    body: bytes
+    headers: dict[str, str]
+    expires: float
+    # (topic, key) of the change that drops it
+    tag: Optional[tuple[str, Any]]
+
+
+@dataclass(frozen=True)
+class CacheTicket:
+    """A miss, set in the request Context by before for after to store the response."""
+    key: CacheKey
+    tag: Optional[tuple[str, Any]]
+    # Of the tag when the miss happened, before the endpoint read anything
+    generation: Optional[tuple[int, int]]
+
+
+@singleton
+class ResponseCache:
+    """
+    Rendered responses of endpoints with a CachePolicy, server.response_cache.bytes of bodies at most (LRU).\n
+    Entries expire after the policy's ttl or when a change of their tag is notified (see util.notify_change).
+    Changes are only heard in this process, with prefork the ttl bounds how stale other workers get.\n
+    Every change bumps the generation of it's tag, so a response read before a change
+    and stored after it (with the generation of before) is dropped instead of kept stale.
+    """
+    # Tags with a generation, more start a new epoch
+    MAX_GENERATIONS = 100_000
+    __entries: OrderedDict[CacheKey, CacheEntry]
+    __tagged: dict[tuple[str, Any], set[CacheKey]]
+    __generations: dict[tuple[str, Any], int]
+
+    def __init__(self):
+        self.enabled = value('server.response_cache', 'true').lower() == 'true'
+        self.capacity = int(value('server.response_cache.bytes', '33554432'))
+        self.__entries = OrderedDict()
+        self.__tagged = dict()
+        self.__generations = dict()
+        self.__epoch = 0
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = 0
+        on_change(self.invalidate)
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self.__remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def generation(self, tag: Optional[tuple[str, Any]]) -> Optional[tuple[int, int]]:
+        if tag is None:
+            return None
+        with self.__lock:
+            return self.__epoch, self.__generations.get(tag, 0)
+
+    def put(self, key: CacheKey, entry: CacheEntry, generation: Optional[tuple[int, int]] = None):
+        """Stores entry, unless it's tag changed after generation was taken."""
+        if len(entry.body) > self.capacity:
+            return
+        with self.__lock:
+            if generation is not None and entry.tag is not None \
+                    and generation != (self.__epoch, self.__generations.get(entry.tag, 0)):
+                return
+            self.__remove(key)
+            self.__entries[key] = entry
+            self.__size += len(entry.body)
+            if entry.tag is not None:
+                self.__tagged.setdefault(entry.tag, set()).add(key)
+            while self.__size > self.capacity:
+                self.__remove(next(iter(self.__entries)))
+
+    def invalidate(self, topic: str, key: Any):
+        tag = (topic, key)
+        with self.__lock:
+            if len(self.__generations) >= self.MAX_GENERATIONS:
+                # Forgetting them would let stale responses in, a new epoch rejects every pending one
+                self.__generations.clear()
+                self.__epoch += 1
+            self.__generations[tag] = self.__generations.get(tag, 0) + 1
+            for cache_key in self.__tagged.pop(tag, ()):
+                if self.__remove(cache_key):
+                    self.invalidations += 1
+
+    def __remove(self, key: CacheKey) -> bool:
+        entry = self.__entries.pop(key, None)
+        if entry is None:
+            return False
+        self.__size -= len(entry.body)
+        if entry.tag is not None:
+            keys = self.__tagged.get(entry.tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.__tagged[entry.tag]
+        return True
+
+    def snapshot(self) -> dict[str, int]:
+        with self.__lock:
+            return {"entries": len(self.__entries), "bytes": self.__size, "hits": self.hits,
+                    "misses": self.misses, "invalidations": self.invalidations}
+
+
+class CachingResponse(Response[Response]):
+    """Renders the endpoint's response once, keeps it in the ResponseCache and sends it like a hit."""
+    store: Callable[[str, Optional[str], bytes, dict[str, str]], None]
+
+    def __init__(self, response: Response, store: Callable[[str, Optional[str], bytes, dict[str, str]], None]):
+        super().__init__(response, response.headers, response.status)
+        self.store = store
+
+    def render(self) -> tuple[Optional[str], bytes]:
+        return self.body.render()
+
+    def blocking(self) -> bool:
+        return self.body.blocking()
+
+    def writeToHandler(self, handler):
+        content_type, payload = self.render()
+        headers = {k: v for k, v in self.headers.items() if k != "ETag"}
+        if isinstance(self.body, ImmutableResponse):
+            etag = self.body.etag
+        else:
+            etag = f'W/"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+        self.store(etag, content_type, payload, headers)
+        CachedResponse(etag, content_type, payload,
+                       dict(headers)).writeToHandler(handler)
+
+
+class ResponseCacheMiddleware(Middleware):
+    """
+    Serves GET and HEAD requests of endpoints with a CachePolicy from the ResponseCache,
+    by path, query parameters and role of the user. Goes after BearerTokenMiddleware,
+    so requests are authorized before getting a cached response.
+    Only 200 responses are kept, the endpoint's response shouldn't depend on the user beyond it's role.
+    """
+    cache: ResponseCache
+
+    def __init__(self):
+        self.cache = inject(ResponseCache)
+
+    def key(self, handler: CustomHandler) -> CacheKey:
+        user = current_user(handler)
+        return (handler.command, handler.parsed_url.path,
+                tuple(sorted(parse_qsl(handler.parsed_url.query, keep_blank_values=True))),
+                None if user is None else user.role)
+
+    def before(self, handler: CustomHandler, endpoint: Endpoint) -> Any:
+        if endpoint.cache is None or handler.command not in CACHED_METHODS or not self.cache.enabled:
+            return None
+        key = self.key(handler)
+        entry = self.cache.get(key)
+        if entry is None:
+            tag = self.tag(handler, endpoint)
+            handler.get_context().set_instance(
+                CacheTicket, CacheTicket(key, tag, self.cache.generation(tag)))
+            return None
+        return CachedResponse(entry.etag, entry.content_type, entry.body, dict(entry.headers))
+
+    def tag(self, handler: CustomHandler, endpoint: Endpoint) -> Optional[tuple[str, Any]]:
+        if endpoint.cache.depends_on is None:
+            return None
+        topic, param = endpoint.cache.depends_on
+        return topic, handler.match[param]
+
+    def after(self, handler: CustomHandler, endpoint: Endpoint, response: Any) -> Any:
+        ticket = handler.get_context().find_instance(CacheTicket)
+        if ticket is None or isinstance(response, (CachedResponse, StreamingResponse)):
+            return response
+        match response:
+            case Response():
+                pass
+            case None | str() | bytes():
+                response = Response(response)
+            case _:
+                response = JsonResponse(response)
+        if response.status != HTTPStatus.OK:
+            return response
+        ttl = endpoint.cache.ttl
+
+        def store(etag: str, content_type: Optional[str], body: bytes, headers: dict[str, str]):
+            self.cache.put(ticket.key, CacheEntry(etag, content_type, body, headers,
+                                                  time.monotonic() + ttl, ticket.tag), ticket.generation)
+        return CachingResponse(response, store)
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from typing import Optional, List
 from datetime import datetime
@@ -11,10 +11,11 @@ class Roles(Enum):
     ANALYST = 3
 
 
+@dataclass
 class Organization:
     id: int
     name: str
-    description: Optional[str]
+    description: Optional[str] = None
 
 
 @dataclass
@@ -38,6 +39,7 @@ class QuestionType(Enum):
     MULTI_MENU_SELECT = 7
 
 
+@dataclass(slots=True, frozen=True)
 class Answer:
     id: int
     name: str
@@ -54,35 +56,42 @@ class AttributeType(Enum):
     MAX_LABEL = 5
 
 
+@dataclass(slots=True, frozen=True)
 class Attribute:
     type: AttributeType
     value: str
 
 
+@dataclass(slots=True, frozen=True)
 class Question:
     id: int
     type: QuestionType
     header: str
-    description: Optional[str]
-    attributes: List[Attribute]
-    answers: Optional[List[Answer]]
+    description: Optional[str] = None
+    attributes: List[Attribute] = field(default_factory=list)
+    answers: Optional[List[Answer]] = None
 
+# Not frozen, frozen dataclasses take 3 times longer to build and there's one per answer
+@dataclass(slots=True)
 class ResultAnswer:
     question: Question
     answer: Answer | str | float
 
+# Not frozen, the id is set once it's inserted
+@dataclass(slots=True)
 class Result:
-    id: int
+    id: Optional[int]
     survey_id: int
     ip: str
     submitted_date: datetime
-    answers: List[ResultAnswer]
+    answers: List[ResultAnswer] = field(default_factory=list)
 
+@dataclass
 class Survey:
     id: int
     user: Optional[User]
     organization: Optional[Organization]
     title: str
-    description: Optional[str]
-    start_date: Optional[datetime]
-    end_date: Optional[datetime]
\ No newline at end of file
+    description: Optional[str] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
\ No newline at end of file
@@ -1,13 +1,19 @@
 from util import Context
+from .aggregate import *
 from .base import *
+from .migration import *
 from .question import *
+from .result import *
+from .revocation import *
+from .survey import *
 from .users import *
 import logging
 
 logger = logging.getLogger('Repository')
 
 
-def load_repository():
+def load_repository(init: bool = True):
+    """Registers the configured repositories, init=False leaves the database alone (for tools setting their own DataSession)."""
     providerRegistry = ProviderRegistry()
     match value('datasource.type'):
         case 'SQLite3':
@@ -16,13 +22,29 @@ def load_repository():
             def getUserRepository(ctx: Context) -> UserRepositorySqlite3Impl:
                 return UserRepositorySqlite3Impl()
             providerRegistry.register_provider_for_context(UserRepository, getUserRepository)
+            def getResultRepository(ctx: Context) -> ResultRepositorySqlite3Impl:
+                return ResultRepositorySqlite3Impl()
+            providerRegistry.register_provider_for_context(ResultRepository, getResultRepository)
+            def getAggregateRepository(ctx: Context) -> AggregateRepositorySqlite3Impl:
+                return AggregateRepositorySqlite3Impl()
+            providerRegistry.register_provider_for_context(AggregateRepository, getAggregateRepository)
+            def getSurveyRepository(ctx: Context) -> SurveyRepositorySqlite3Impl:
+                return SurveyRepositorySqlite3Impl()
+            providerRegistry.register_provider_for_context(SurveyRepository, getSurveyRepository)
+            def getQuestionRepository(ctx: Context) -> QuestionRepositorySqlite3Impl:
+                return QuestionRepositorySqlite3Impl()
+            providerRegistry.register_provider_for_context(QuestionRepository, getQuestionRepository)
+            def getRevocationRepository(ctx: Context) -> RevocationRepositorySqlite3Impl:
+                return RevocationRepositorySqlite3Impl()
+            providerRegistry.register_provider_for_context(RevocationRepository, getRevocationRepository)
             logger.debug(f"Loaded datasource \"SQLite3\"")
         case _:
             raise Exception("Not datasource configured")
     
-    # Running init scripts
-    datasource = inject(Datasource)
-    datasource.init()
+    if init:
+        # Running init scripts
+        datasource = inject(Datasource)
+        datasource.init()
 
     def getTransactionForContext(ctx: Context) -> DataSession:
         dataSource = inject(Datasource)
@@ -0,0 +1,195 @@
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+import math
+from typing import Any, Optional
+
+from model import Answer, AttributeType, Question, QuestionType, Result
+from util import context_scoped, get_context
+from .base import DataSession, SQLite3Session
+
+NUMERIC_TYPES = (QuestionType.NUMBER, QuestionType.PERCENTAGE, QuestionType.SLIDE)
+HISTOGRAM_BUCKETS = 10
+
+
+def bucket_width(question_type: QuestionType, min_value: Optional[str], max_value: Optional[str]) -> float:
+    """Histogram bucket width, 10 buckets over the question range when it's known."""
+    if question_type == QuestionType.PERCENTAGE:
+        return 100 / HISTOGRAM_BUCKETS
+    try:
+        width = (float(max_value) - float(min_value)) / HISTOGRAM_BUCKETS
+    except (TypeError, ValueError):
+        return 1.0
+    return width if width > 0 else 1.0
+
+
+def question_bucket_width(question: Question) -> float:
+    attributes = {a.type: a.value for a in question.attributes}
+    return bucket_width(question.type, attributes.get(AttributeType.MIN_VALUE), attributes.get(AttributeType.MAX_VALUE))
+
+
+class NumericDelta:
+    __slots__ = ('count', 'sum', 'sum_squares', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.sum_squares += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+
+@context_scoped
+class AggregateRepository(ABC):
+    @abstractmethod
+    def add_results(self, results: list[Result]):
+        """Adds inserted results to the aggregates, in the same session as the insert."""
+        pass
+
+    @abstractmethod
+    def rebuild(self, survey_id: Optional[int] = None):
+        """Recomputes the aggregates of a survey, or all of them, from the stored results."""
+        pass
+
+    @abstractmethod
+    def get_question_aggregate(self, question_id: int) -> Optional[dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def get_survey_aggregates(self, survey_id: int) -> list[dict[str, Any]]:
+        pass
+
+
+class AggregateRepositorySqlite3Impl(AggregateRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def __session(self) -> SQLite3Session:
+        return get_context(self).get_instance(DataSession)
+
+    def add_results(self, results: list[Result]):
+        responses = Counter[int]()
+        options = Counter[tuple[int, int]]()
+        numeric = defaultdict[int, NumericDelta](NumericDelta)
+        histogram = Counter[tuple[int, int, float]]()
+        # Deltas of the whole batch first, so it's one upsert per key instead of per answer
+        for result in results:
+            answered = set[int]()
+            for result_answer in result.answers:
+                question = result_answer.question
+                answered.add(question.id)
+                answer = result_answer.answer
+                if isinstance(answer, Answer):
+                    options[(question.id, answer.id)] += 1
+                elif question.type in NUMERIC_TYPES:
+                    numeric[question.id].add(answer)
+                    width = question_bucket_width(question)
+                    histogram[(question.id, math.floor(
+                        answer / width), width)] += 1
+            responses.update(answered)
+        self.__upsert(responses, options, numeric, histogram)
+
+    def __upsert(self, responses: Counter, options: Counter, numeric: dict[int, NumericDelta], histogram: Counter):
+        session = self.__session()
+        session.executemany(
+            """INSERT INTO AGGREGATE_QUESTION(question_id, responses) VALUES (?, ?)
+            ON CONFLICT(question_id) DO UPDATE SET responses = responses + excluded.responses""",
+            list(responses.items()))
+        session.executemany(
+            """INSERT INTO AGGREGATE_OPTION(question_id, answer_id, count) VALUES (?, ?, ?)
+            ON CONFLICT(question_id, answer_id) DO UPDATE SET count = count + excluded.count""",
+            [(q, a, count) for (q, a), count in options.items()])
+        session.executemany(
+            """INSERT INTO AGGREGATE_NUMERIC(question_id, count, sum, sum_squares, min, max) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(question_id) DO UPDATE SET
+                count = count + excluded.count, sum = sum + excluded.sum,
+                sum_squares = sum_squares + excluded.sum_squares,
+                min = MIN(min, excluded.min), max = MAX(max, excluded.max)""",
+            [(q, d.count, d.sum, d.sum_squares, d.min, d.max) for q, d in numeric.items()])
+        session.executemany(
+            """INSERT INTO AGGREGATE_HISTOGRAM(question_id, bucket, width, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(question_id, bucket) DO UPDATE SET count = count + excluded.count""",
+            [(q, bucket, width, count) for (q, bucket, width), count in histogram.items()])
+
+    def rebuild(self, survey_id: Optional[int] = None):
+        session = self.__session()
+        if survey_id is None:
+            where, params = "", ()
+        else:
+            where, params = "WHERE question_id IN (SELECT question_id FROM QUESTION WHERE survey_id=?)", (survey_id,)
+        for table in ("AGGREGATE_QUESTION", "AGGREGATE_OPTION", "AGGREGATE_NUMERIC", "AGGREGATE_HISTOGRAM"):
+            session.execute(f"DELETE FROM {table} {where}", params)
+        session.execute(
+            f"""INSERT INTO AGGREGATE_QUESTION(question_id, responses)
+            SELECT question_id, COUNT(DISTINCT result_id) FROM RESULT_ANSWER {where} GROUP BY question_id""", params)
+        session.execute(
+            f"""INSERT INTO AGGREGATE_OPTION(question_id, answer_id, count)
+            SELECT question_id, answer_id, COUNT(*) FROM RESULT_ANSWER
+            {where or 'WHERE 1'} AND answer_id IS NOT NULL GROUP BY question_id, answer_id""", params)
+        # Histograms need each question range, so numeric answers are read page by page
+        numeric_types = ", ".join(str(t.value) for t in NUMERIC_TYPES)
+        questions = session.query(
+            f"""SELECT q.question_id, q.type,
+                (SELECT value FROM ATTRIBUTE WHERE question_id = q.question_id AND type = ?),
+                (SELECT value FROM ATTRIBUTE WHERE question_id = q.question_id AND type = ?)
+            FROM QUESTION q WHERE q.type IN ({numeric_types}) {'' if survey_id is None else 'AND q.survey_id=?'}""",
+            (AttributeType.MIN_VALUE.value, AttributeType.MAX_VALUE.value, *params)).fetchall()
+        for question_id, type, min_value, max_value in questions:
+            width = bucket_width(QuestionType(type), min_value, max_value)
+            delta = NumericDelta()
+            histogram = Counter[tuple[int, int, float]]()
+            cursor = session.query(
+                "SELECT answer FROM RESULT_ANSWER WHERE question_id=? AND answer IS NOT NULL", (question_id,))
+            while rows := cursor.fetchmany(1000):
+                for (answer,) in rows:
+                    delta.add(answer)
+                    histogram[(question_id, math.floor(
+                        answer / width), width)] += 1
+            numeric = {question_id: delta} if delta.count else {}
+            self.__upsert(Counter(), Counter(), numeric, histogram)
+
+    def get_question_aggregate(self, question_id: int) -> Optional[dict[str, Any]]:
+        session = self.__session()
+        row = session.query(
+            """SELECT q.type, a.responses FROM QUESTION q
+            LEFT JOIN AGGREGATE_QUESTION a ON a.question_id = q.question_id
+            WHERE q.question_id=?""", (question_id,)).fetchone()
+        if row is None:
+            return None
+        type, responses = row
+        aggregate = {"question": question_id, "responses": responses or 0}
+        question_type = QuestionType(type)
+        if question_type in NUMERIC_TYPES:
+            aggregate["numeric"] = self.__numeric(session, question_id)
+            aggregate["histogram"] = [
+                {"from": bucket * width, "to": (bucket + 1) * width, "count": count}
+                for bucket, width, count in session.query(
+                    "SELECT bucket, width, count FROM AGGREGATE_HISTOGRAM WHERE question_id=? ORDER BY bucket", (question_id,))]
+        elif question_type != QuestionType.TEXT:
+            aggregate["options"] = [
+                {"answer_id": answer_id, "count": count}
+                for answer_id, count in session.query(
+                    "SELECT answer_id, count FROM AGGREGATE_OPTION WHERE question_id=?", (question_id,))]
+        return aggregate
+
+    def __numeric(self, session: SQLite3Session, question_id: int) -> dict[str, Any]:
+        row = session.query(
+            "SELECT count, sum, sum_squares, min, max FROM AGGREGATE_NUMERIC WHERE question_id=?", (question_id,)).fetchone()
+        if row is None:
+            return {"count": 0, "mean": None, "stddev": None, "min": None, "max": None}
+        count, sum, sum_squares, min_value, max_value = row
+        mean = sum / count
+        variance = max(sum_squares / count - mean * mean, 0.0)
+        return {"count": count, "mean": mean, "stddev": math.sqrt(variance), "min": min_value, "max": max_value}
+
+    def get_survey_aggregates(self, survey_id: int) -> list[dict[str, Any]]:
+        question_ids = self.__session().query(
+            "SELECT question_id FROM QUESTION WHERE survey_id=? ORDER BY question_id", (survey_id,)).fetchall()
+        return [self.get_question_aggregate(question_id) for (question_id,) in question_ids]
@@ -2,13 +2,20 @@ from abc import ABC, abstractmethod
 from collections.abc import Callable
 from enum import Enum
 import logging
-import os
 import sqlite3
 from typing import Any, Optional
-from util import inject, ProviderRegistry, singleton, context_scoped, value
+from util import inject, Metrics, ProviderRegistry, singleton, context_scoped, value
+from .instrumentation import QueryStats, timed_execute, timed_executemany
+from .migration import MIGRATIONS, SQLite3Migrator
+from .pool import PoolStats, PoolTimeoutException, SQLite3ConnectionPool
 
 logger = logging.getLogger('Repository')
 
+class CommitException(Exception):
+    def __init__(self, session: 'DataSession'):
+        super().__init__(f"{session} couldn't commit it's changes")
+
+
 class DataSessionState(Enum):
     NOT_CHANGES = 0
     CHANGES = 1
@@ -19,6 +26,9 @@ class DataSessionState(Enum):
 @context_scoped
 class DataSession(ABC):
     state: DataSessionState = DataSessionState.NOT_CHANGES
+    # If it got a connection, sessions connect on their first statement
+    opened: bool = False
+    _after_commit: Optional[list[Callable[[], None]]] = None
 
     @abstractmethod
     def run(func: Callable[[Any], None]):
@@ -28,10 +38,28 @@ class DataSession(ABC):
     def query(self, *args, **kwargs):
         pass
 
+    @abstractmethod
+    def commit(self):
+        pass
+
     @abstractmethod
     def close(self):
         pass
 
+    def after_commit(self, func: Callable[[], None]):
+        """Runs func once the changes are committed, never if they are rolled back."""
+        if self._after_commit is None:
+            self._after_commit = []
+        self._after_commit.append(func)
+
+    def _run_after_commit(self):
+        callbacks, self._after_commit = self._after_commit, None
+        for func in callbacks or ():
+            try:
+                func()
+            except Exception:
+                logger.exception(f"After commit callback {func} failed")
+
     def notifyError(self):
         self.state = DataSessionState.ERROR
         self.close()
@@ -46,70 +74,151 @@ class Datasource(ABC):
     def init(self):
         pass
 
+    @abstractmethod
+    def stats(self) -> PoolStats:
+        pass
+
 
 class SQLite3Session(DataSession):
-    __conn: sqlite3.Connection
+    __conn: Optional[sqlite3.Connection]
+    __pool: SQLite3ConnectionPool
 
-    def __init__(self, conn: sqlite3.Connection):
-        logger.debug(f"{self} started")
+    def __init__(self, pool: SQLite3ConnectionPool):
         super().__init__()
-        self.__conn = conn
+        self.__conn = None
+        self.__pool = pool
+
+    @property
+    def __connection(self) -> sqlite3.Connection:
+        if self.__conn is None:
+            if self.state == DataSessionState.CLOSED:
+                raise sqlite3.ProgrammingError(f"{self} is closed")
+            self.__conn = self.__pool.acquire()
+            self.opened = True
+            Metrics().session_opened()
+            logger.debug("%s started", self)
+        return self.__conn
 
     def run(self, func: Callable[[sqlite3.Connection], None]):
         if self.state == DataSessionState.ERROR:
             return
         self.state = DataSessionState.CHANGES
-        func(self.__conn)
+        func(self.__connection)
 
     def query(self, *args, **kwargs):
-        return self.__conn.execute(*args)
+        return timed_execute(self.__connection, *args)
+
+    def execute(self, sql: str, parameters=()):
+        """Like query, for statements that write, so the session commits on close."""
+        if self.state == DataSessionState.ERROR:
+            raise sqlite3.OperationalError(f"{self} had an error")
+        self.state = DataSessionState.CHANGES
+        return timed_execute(self.__connection, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        if self.state == DataSessionState.ERROR:
+            raise sqlite3.OperationalError(f"{self} had an error")
+        self.state = DataSessionState.CHANGES
+        return timed_executemany(self.__connection, sql, seq_of_parameters)
+
+    def commit(self):
+        """
+        Commits the changes so far, so they are visible before the response says they were made.
+        The session can still be used, with a new transaction. CommitException if it fails, nothing was written.
+        """
+        if self.state != DataSessionState.CHANGES:
+            return
+        try:
+            self.__end(DataSessionState.NOT_CHANGES)
+        except sqlite3.Error as e:
+            raise CommitException(self) from e
 
     def close(self):
+        if self.state == DataSessionState.CLOSED:
+            logger.debug("%s is already stopped", self)
+            return
+        self.__end(DataSessionState.CLOSED)
+
+    def __end(self, next_state: DataSessionState):
+        conn, self.__conn = self.__conn, None
+        if conn is None:
+            # Never used, nothing to end
+            self.state = next_state
+            return
         match self.state:
-            case DataSessionState.CLOSED:
-                logger.debug(f"{self} is already stopped")
-                return
             case DataSessionState.ERROR:
-                self.__conn.rollback()
+                end = conn.rollback
             case DataSessionState.CHANGES:
-                self.__conn.commit()
-        self.__conn.close()
-        self.state = DataSessionState.CLOSED
-        logger.debug(f"{self} stopped")
+                end = conn.commit
+            case _:
+                # Nothing written, but ending the transaction releases read snapshots
+                end = conn.rollback
+        committed = self.state == DataSessionState.CHANGES
+        self.state = next_state
+        try:
+            end()
+        except sqlite3.Error:
+            # A failed commit leaves nothing written
+            self.state = DataSessionState.CLOSED
+            Metrics().session_ended(False)
+            self._after_commit = None
+            self.__pool.discard(conn)
+            raise
+        Metrics().session_ended(committed)
+        # Back to the pool instead of closing
+        self.__pool.release(conn)
+        logger.debug("%s stopped", self)
+        if committed:
+            self._run_after_commit()
+        else:
+            self._after_commit = None
 
     def __del__(self):
         # Just making sure it's destroyed
         if self.state == DataSessionState.CLOSED:
-            logger.debug(f"{self} destroyed")
+            logger.debug("%s destroyed", self)
             return
         self.close()
-        logger.debug(f"{self} destroyed")
+        logger.debug("%s destroyed", self)
 
 
 @singleton
 class SQLite3Datasource(Datasource):
     file = value('datasource.sqlite.file')
+    __pool: SQLite3ConnectionPool
 
     def __init__(self):
         super().__init__()
+        self.__pool = SQLite3ConnectionPool(
+            self.__createConn,
+            size=int(value('datasource.pool.size', '8')),
+            max_idle=float(value('datasource.pool.max_idle', '300')),
+            timeout=float(value('datasource.pool.timeout', '10')))
 
     def init(self):
-        if not os.path.exists(self.file):
-            self.__runInitScript()
-        elif value('datasource.prune', '').lower() == 'true':
-            os.remove(self.file)
-            self.__runInitScript()
-
-    def __runInitScript(self):
-        logger.info("Executing init script", exc_info=type(self))
-        conn = self.__createConn()
-        with open('../../../planning/sqlite3.sql', 'r') as script:
-            conn.executescript(script.read())
-        conn.commit()
-        conn.close()
+        """Applies the pending schema migrations, the database is created by the first one."""
+        SQLite3Migrator(self.__createConn,
+                        value('datasource.sqlite.migrations', MIGRATIONS)).migrate()
 
     def __createConn(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.file, autocommit=False)
+        # Sessions may be opened and closed on different executor threads, but never concurrently.
+        # Prepared statements are cached per connection, LRU of cached_statements
+        conn = sqlite3.connect(self.file, autocommit=True, check_same_thread=False,
+                               cached_statements=int(value('datasource.sqlite.cached_statements', '128')))
+        # PRAGMAs that can't run inside a transaction go first
+        conn.execute(
+            f"PRAGMA journal_mode={value('datasource.sqlite.journal_mode', 'WAL')}")
+        conn.execute(
+            f"PRAGMA synchronous={value('datasource.sqlite.synchronous', 'NORMAL')}")
+        conn.execute(
+            f"PRAGMA mmap_size={int(value('datasource.sqlite.mmap_size', '0'))}")
+        conn.execute(
+            f"PRAGMA cache_size={int(value('datasource.sqlite.cache_size', '-2000'))}")
+        conn.autocommit = False
+        return conn
 
     def createSession(self) -> DataSession:
-        return SQLite3Session(self.__createConn())
+        return SQLite3Session(self.__pool)
+
+    def stats(self) -> PoolStats:
+        return self.__pool.stats()
@@ -0,0 +1,157 @@
+from collections import deque
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+from util import singleton, value
+
+logger = logging.getLogger('Repository')
+
+Whitespace = re.compile(r"\s+")
+Literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class StatementStats:
+    # Recent latencies kept for the percentiles
+    SAMPLES = 1024
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=self.SAMPLES)
+
+    def percentile(self, samples: list[float], p: float) -> float:
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    def to_dict(self) -> dict[str, Any]:
+        samples = sorted(self.samples)
+        return {
+            "statement": self.statement,
+            "count": self.count,
+            "rows": self.rows,
+            "total_ms": self.total_time * 1000,
+            "avg_ms": self.total_time * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(samples, 0.50) * 1000,
+            "p95_ms": self.percentile(samples, 0.95) * 1000,
+            "p99_ms": self.percentile(samples, 0.99) * 1000,
+            "max_ms": self.max_time * 1000,
+        }
+
+
+@singleton
+class QueryStats:
+    """
+    Count, latency and rows returned for every statement, grouped by the normalized SQL.\n
+    Statements taking more than datasource.slow_query_ms are logged.
+    """
+    __statements: dict[str, StatementStats]
+    # Raw SQL -> normalized, repository queries are few and repeated
+    __normalized: dict[str, str]
+
+    def __init__(self):
+        self.__statements = dict()
+        self.__normalized = dict()
+        self.__lock = threading.Lock()
+        self.slow_query = float(value('datasource.slow_query_ms', '100')) / 1000
+
+    def normalize(self, sql: str) -> str:
+        normalized = self.__normalized.get(sql)
+        if normalized is None:
+            normalized = Literals.sub('?', Whitespace.sub(' ', sql).strip())
+            if len(self.__normalized) > 4096:
+                # Ad-hoc SQL with inlined values, don't grow forever
+                self.__normalized.clear()
+            self.__normalized[sql] = normalized
+        return normalized
+
+    def record(self, sql: str, elapsed: float) -> StatementStats:
+        key = self.normalize(sql)
+        with self.__lock:
+            stats = self.__statements.get(key)
+            if stats is None:
+                stats = self.__statements[key] = StatementStats(key)
+            stats.count += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.samples.append(elapsed)
+        if elapsed >= self.slow_query:
+            logger.warning(f"Slow query ({elapsed * 1000:.1f}ms): {key}")
+        return stats
+
+    def add_rows(self, stats: StatementStats, rows: int):
+        with self.__lock:
+            stats.rows += rows
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self.__lock:
+            result = [s.to_dict() for s in self.__statements.values()]
+        result.sort(key=lambda s: s["total_ms"], reverse=True)
+        return result
+
+    def reset(self):
+        with self.__lock:
+            self.__statements.clear()
+
+
+class InstrumentedCursor:
+    """Wraps a sqlite3.Cursor to count the rows fetched from it."""
+    __slots__ = ('_cursor', '_stats', '_query_stats')
+
+    def __init__(self, cursor: sqlite3.Cursor, stats: StatementStats, query_stats: QueryStats):
+        self._cursor = cursor
+        self._stats = stats
+        self._query_stats = query_stats
+
+    def fetchone(self) -> Optional[Any]:
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._query_stats.add_rows(self._stats, 1)
+        return row
+
+    def fetchmany(self, size: int = None) -> list[Any]:
+        rows = self._cursor.fetchmany(
+            self._cursor.arraysize if size is None else size)
+        self._query_stats.add_rows(self._stats, len(rows))
+        return rows
+
+    def fetchall(self) -> list[Any]:
+        rows = self._cursor.fetchall()
+        self._query_stats.add_rows(self._stats, len(rows))
+        return rows
+
+    def __iter__(self):
+        count = 0
+        try:
+            for row in self._cursor:
+                count += 1
+                yield row
+        finally:
+            self._query_stats.add_rows(self._stats, count)
+
+    def __getattr__(self, name: str):
+        # lastrowid, rowcount, description...
+        return getattr(self._cursor, name)
+
+
+def timed_execute(conn: sqlite3.Connection, sql: str, parameters=()) -> InstrumentedCursor:
+    query_stats = QueryStats()
+    start = time.perf_counter()
+    cursor = conn.execute(sql, parameters)
+    stats = query_stats.record(sql, time.perf_counter() - start)
+    return InstrumentedCursor(cursor, stats, query_stats)
+
+
+def timed_executemany(conn: sqlite3.Connection, sql: str, seq_of_parameters) -> sqlite3.Cursor:
+    query_stats = QueryStats()
+    start = time.perf_counter()
+    cursor = conn.executemany(sql, seq_of_parameters)
+    stats = query_stats.record(sql, time.perf_counter() - start)
+    query_stats.add_rows(stats, max(cursor.rowcount, 0))
+    return cursor
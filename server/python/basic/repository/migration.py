@@ -0,0 +1,133 @@
+"""
+Versioned schema migrations for SQLite.\n
+A migration is a NNNN_name.sql script, applied in version order, each one in it's own
+BEGIN IMMEDIATE transaction together with it's SCHEMA_MIGRATION row and PRAGMA user_version,
+so a failing script leaves the database at the previous version. Scripts must not BEGIN or COMMIT.\n
+user_version lives in the database header: when it's already the latest version, startup
+reads it and nothing else. Index builds only hold the write lock, in WAL mode readers keep going,
+so a migration adding indexes to a big table should do only that.
+"""
+from dataclasses import dataclass
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Callable
+
+logger = logging.getLogger('Repository')
+
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+# planning/sqlite3 of the repository, wherever the server is started from
+MIGRATIONS = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', '..', 'planning', 'sqlite3'))
+
+
+class MigrationException(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    file: str
+
+    def script(self) -> str:
+        with open(self.file, 'r', encoding='utf-8') as script:
+            return script.read()
+
+
+def find_migrations(directory: str) -> list[Migration]:
+    migrations = dict[int, Migration]()
+    for file in os.listdir(directory):
+        match = MIGRATION_FILE.match(file)
+        if match is None:
+            continue
+        version = int(match[1])
+        if version in migrations:
+            raise MigrationException(
+                f"Migrations {migrations[version].file} and {file} have the same version")
+        migrations[version] = Migration(
+            version, match[2], os.path.join(directory, file))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def checksum(script: str) -> str:
+    return hashlib.sha256(script.encode('utf-8')).hexdigest()
+
+
+class SQLite3Migrator:
+    """Brings the database to the latest migration of directory, safe to run from several processes at once."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], directory: str = MIGRATIONS):
+        self.__connect = connect
+        self.directory = directory
+
+    def migrate(self) -> int:
+        """Applies the pending migrations, returns how many."""
+        migrations = find_migrations(self.directory)
+        latest = migrations[-1].version if migrations else 0
+        conn = self.__connect()
+        try:
+            # Transactions are started and ended here, not by the sqlite3 module
+            conn.autocommit = True
+            current = self.__version(conn)
+            if current == latest:
+                logger.debug(f"Schema is at version {current}")
+                return 0
+            if current > latest:
+                raise MigrationException(
+                    f"Database is at version {current}, newer than the latest migration ({latest})")
+            conn.execute("""CREATE TABLE IF NOT EXISTS SCHEMA_MIGRATION (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                duration_ms REAL NOT NULL
+            )""")
+            self.__check_applied(conn, migrations)
+            applied = sum(self.__apply(conn, m)
+                          for m in migrations if m.version > current)
+            if applied:
+                # Statistics for the new indexes, only of the tables that need them
+                conn.execute("PRAGMA optimize")
+            return applied
+        finally:
+            conn.close()
+
+    def __version(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def __check_applied(self, conn: sqlite3.Connection, migrations: list[Migration]):
+        checksums = {m.version: checksum(m.script()) for m in migrations}
+        for version, name, applied_checksum in conn.execute(
+                "SELECT version, name, checksum FROM SCHEMA_MIGRATION"):
+            if checksums.get(version, applied_checksum) != applied_checksum:
+                logger.warning(
+                    f"Migration {version}_{name} changed after being applied, it won't run again")
+
+    def __apply(self, conn: sqlite3.Connection, migration: Migration) -> bool:
+        script = migration.script()
+        start = time.perf_counter()
+        # Takes the write lock before reading the version, so only one process applies it
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.__version(conn) >= migration.version:
+                conn.execute("ROLLBACK")
+                return False
+            conn.executescript(script)
+            elapsed = (time.perf_counter() - start) * 1000
+            conn.execute("INSERT INTO SCHEMA_MIGRATION(version, name, checksum, duration_ms) VALUES (?, ?, ?, ?)",
+                         (migration.version, migration.name, checksum(script), elapsed))
+            conn.execute(f"PRAGMA user_version={int(migration.version)}")
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise MigrationException(
+                f"Migration {migration.version}_{migration.name} failed: {e}") from e
+        logger.info(
+            f"Applied migration {migration.version}_{migration.name} in {elapsed:.1f}ms")
+        return True
@@ -0,0 +1,147 @@
+from collections import deque
+from dataclasses import dataclass, asdict
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger('Repository')
+
+
+class PoolTimeoutException(Exception):
+    def __init__(self, timeout: float):
+        super().__init__(
+            f"Couldn't get a connection from the pool after {timeout}s")
+
+
+@dataclass
+class PoolStats:
+    size: int
+    open: int
+    idle: int
+    created: int = 0
+    discarded: int = 0
+    checkouts: int = 0
+    waits: int = 0
+    # Seconds spent waiting for a connection, summed
+    wait_time: float = 0.0
+    timeouts: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class SQLite3ConnectionPool:
+    """
+    Bounded pool of SQLite connections.\n
+    Idle connections are reused most recent first, dropped after max_idle seconds,
+    and checked with a trivial query before being handed out.
+    """
+    __idle: deque[tuple[sqlite3.Connection, float]]
+
+    def __init__(self, factory: Callable[[], sqlite3.Connection], size: int, max_idle: float, timeout: float):
+        self.__factory = factory
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.__idle = deque()
+        self.__open = 0
+        self.__lock = threading.Condition()
+        self.__stats = PoolStats(size, 0, 0)
+        os.register_at_fork(after_in_child=self.__after_fork)
+
+    def __after_fork(self):
+        # Connections belong to the parent, closing them here could release it's locks.
+        self.__inherited = self.__idle
+        self.__idle = deque()
+        self.__open = 0
+        self.__lock = threading.Condition()
+        self.__stats = PoolStats(self.size, 0, 0)
+
+    def acquire(self) -> sqlite3.Connection:
+        while True:
+            conn = self.__checkout()
+            if conn is None:
+                return self.__create()
+            if self.__is_healthy(conn):
+                return conn
+            self.discard(conn)
+
+    def __checkout(self):
+        """Returns an idle connection, or None if a new one can be opened."""
+        deadline = None
+        with self.__lock:
+            while True:
+                now = time.monotonic()
+                while self.__idle:
+                    conn, since = self.__idle.pop()
+                    if now - since <= self.max_idle:
+                        self.__stats.checkouts += 1
+                        return conn
+                    self.__close(conn)
+                if self.__open < self.size:
+                    self.__open += 1
+                    self.__stats.checkouts += 1
+                    return None
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self.__stats.waits += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.__stats.timeouts += 1
+                    raise PoolTimeoutException(self.timeout)
+                self.__lock.wait(remaining)
+                self.__stats.wait_time += time.monotonic() - now
+
+    def __create(self) -> sqlite3.Connection:
+        try:
+            conn = self.__factory()
+        except Exception:
+            with self.__lock:
+                self.__open -= 1
+                self.__lock.notify()
+            raise
+        with self.__lock:
+            self.__stats.created += 1
+        return conn
+
+    def __is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding broken connection: {e}")
+            return False
+
+    def release(self, conn: sqlite3.Connection):
+        with self.__lock:
+            self.__idle.append((conn, time.monotonic()))
+            self.__lock.notify()
+
+    def discard(self, conn: sqlite3.Connection):
+        with self.__lock:
+            self.__close(conn)
+            self.__lock.notify()
+
+    def __close(self, conn: sqlite3.Connection):
+        # Called with the lock held
+        self.__open -= 1
+        self.__stats.discarded += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        with self.__lock:
+            while self.__idle:
+                conn, _ = self.__idle.pop()
+                self.__close(conn)
+
+    def stats(self) -> PoolStats:
+        with self.__lock:
+            self.__stats.open = self.__open
+            self.__stats.idle = len(self.__idle)
+            return PoolStats(**self.__stats.to_dict())
@@ -1,23 +1,145 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 
+from model import Answer, Attribute, AttributeType, Question, QuestionType
+from util import context_scoped, get_context
+from .base import DataSession, SQLite3Session
 
+
+class QuestionInUseException(Exception):
+    def __init__(self, question_id: int):
+        super().__init__(f"Question {question_id} already has results")
+
+
+@context_scoped
 class QuestionRepository(ABC):
+    """Questions with their answers and attributes, changing one is a change of it's survey."""
+
+    @abstractmethod
+    def get_question(self, survey_id: int, question_id: int) -> Optional[Question]:
+        pass
+
     @abstractmethod
-    def getQuestion(id):
+    def get_questions(self, survey_id: int) -> dict[int, Question]:
+        """Questions of a survey by id, in the order they were created."""
         pass
-    
+
     @abstractmethod
-    def createQuestion(question):
+    def insert_question(self, survey_id: int, question: Question) -> int:
+        """Inserts it with it's answers and attributes, the caller marks the survey as changed."""
         pass
 
     @abstractmethod
-    def deleteQuestion(question):
+    def create_question(self, survey_id: int, question: Question) -> int:
         pass
 
     @abstractmethod
-    def updateQuestion(question):
+    def update_question(self, survey_id: int, question: Question) -> bool:
+        """Header and description, False if the question isn't part of the survey."""
         pass
 
     @abstractmethod
-    def getQuestions():
-        pass
\ No newline at end of file
+    def delete_question(self, survey_id: int, question_id: int) -> bool:
+        """False if the question isn't part of the survey, QuestionInUseException once it has results."""
+        pass
+
+
+class QuestionRepositorySqlite3Impl(QuestionRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def __session(self) -> SQLite3Session:
+        return get_context(self).get_instance(DataSession)
+
+    def __survey_changed(self, survey_id: int):
+        # Imported here, survey imports this module
+        from .survey import SurveyRepository
+        get_context(self).get_instance(SurveyRepository).mark_changed(survey_id)
+
+    def get_question(self, survey_id: int, question_id: int) -> Optional[Question]:
+        transaction = self.__session()
+        row = transaction.query(
+            "SELECT question_id, type, header, description FROM QUESTION WHERE question_id=? AND survey_id=?",
+            (question_id, survey_id)).fetchone()
+        if row is None:
+            return None
+        question_id, type, header, description = row
+        question = Question(question_id, QuestionType(type),
+                            header, description, answers=[])
+        for answer_id, name, description, order in transaction.query(
+                """SELECT answer_id, name, description, "order" FROM ANSWER WHERE question_id=?""", (question_id,)):
+            question.answers.append(
+                Answer(answer_id, name, description, order))
+        for type, attribute_value in transaction.query(
+                "SELECT type, value FROM ATTRIBUTE WHERE question_id=?", (question_id,)):
+            question.attributes.append(
+                Attribute(AttributeType(type), attribute_value))
+        return question
+
+    def get_questions(self, survey_id: int) -> dict[int, Question]:
+        transaction = self.__session()
+        questions = dict[int, Question]()
+        cursor = transaction.query(
+            "SELECT question_id, type, header, description FROM QUESTION WHERE survey_id=? ORDER BY question_id", (survey_id,))
+        for question_id, type, header, description in cursor.fetchall():
+            questions[question_id] = Question(
+                question_id, QuestionType(type), header, description, answers=[])
+        if not questions:
+            return questions
+        cursor = transaction.query(
+            """SELECT a.answer_id, a.question_id, a.name, a.description, a."order" FROM QUESTION q
+            JOIN ANSWER a ON a.question_id = q.question_id WHERE q.survey_id=?""", (survey_id,))
+        for answer_id, question_id, name, description, order in cursor.fetchall():
+            questions[question_id].answers.append(
+                Answer(answer_id, name, description, order))
+        cursor = transaction.query(
+            """SELECT a.question_id, a.type, a.value FROM QUESTION q
+            JOIN ATTRIBUTE a ON a.question_id = q.question_id WHERE q.survey_id=?""", (survey_id,))
+        for question_id, type, attribute_value in cursor.fetchall():
+            questions[question_id].attributes.append(
+                Attribute(AttributeType(type), attribute_value))
+        return questions
+
+    def insert_question(self, survey_id: int, question: Question) -> int:
+        transaction = self.__session()
+        question_id = transaction.execute(
+            "INSERT INTO QUESTION(survey_id, type, header, description) VALUES (?, ?, ?, ?)",
+            (survey_id, question.type.value, question.header, question.description)).lastrowid
+        transaction.executemany(
+            """INSERT INTO ANSWER(question_id, name, description, "order") VALUES (?, ?, ?, ?)""",
+            [(question_id, a.name, a.description, a.order) for a in question.answers or ()])
+        transaction.executemany(
+            "INSERT INTO ATTRIBUTE(question_id, type, value) VALUES (?, ?, ?)",
+            [(question_id, a.type.value, a.value) for a in question.attributes])
+        return question_id
+
+    def create_question(self, survey_id: int, question: Question) -> int:
+        question_id = self.insert_question(survey_id, question)
+        self.__survey_changed(survey_id)
+        return question_id
+
+    def update_question(self, survey_id: int, question: Question) -> bool:
+        updated = self.__session().execute(
+            "UPDATE QUESTION SET header=?, description=? WHERE question_id=? AND survey_id=?",
+            (question.header, question.description, question.id, survey_id)).rowcount
+        if updated:
+            self.__survey_changed(survey_id)
+        return updated > 0
+
+    def delete_question(self, survey_id: int, question_id: int) -> bool:
+        transaction = self.__session()
+        if transaction.query(
+                "SELECT 1 FROM QUESTION WHERE question_id=? AND survey_id=?", (question_id, survey_id)).fetchone() is None:
+            return False
+        if transaction.query(
+                "SELECT 1 FROM RESULT_ANSWER WHERE question_id=? LIMIT 1", (question_id,)).fetchone() is not None:
+            raise QuestionInUseException(question_id)
+        transaction.execute(
+            "DELETE FROM ANSWER WHERE question_id=?", (question_id,))
+        transaction.execute(
+            "DELETE FROM ATTRIBUTE WHERE question_id=?", (question_id,))
+        transaction.execute(
+            "DELETE FROM QUESTION WHERE question_id=?", (question_id,))
+        self.__survey_changed(survey_id)
+        return True
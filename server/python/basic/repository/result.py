@@ -0,0 +1,154 @@
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional
+
+from model import Answer, Question, Result
+from util import context_scoped, get_context
+from .base import DataSession, SQLite3Session
+from .question import QuestionRepository
+
+# Rows as the cursor returns them, plain tuples weigh less than any object built from them.
+# (result_id, submitted_date, ip, question_id, answer_id, answer name or value)
+type ResultAnswerRow = tuple[int, str, str, int, Optional[int], Optional[str]]
+# (result_id, submitted_date, question_id, answer_id, value)
+type AnswerRow = tuple[int, str, int, Optional[int], Optional[str]]
+# (result_id, submitted_date, ip)
+type ResultRow = tuple[int, str, str]
+# (result_id, question_id, answer_id, value)
+type ResultAnswerValueRow = tuple[int, int, Optional[int], Optional[str]]
+
+
+@context_scoped
+class ResultRepository(ABC):
+    @abstractmethod
+    def get_survey_questions(self, survey_id: int) -> Optional[dict[int, Question]]:
+        """Questions of a survey with their answers and attributes, by id. None if the survey doesn't exist."""
+        pass
+
+    @abstractmethod
+    def insert_results(self, results: list[Result]) -> list[int]:
+        pass
+
+    @abstractmethod
+    def iter_result_answers(self, survey_id: int, page_size: int) -> Iterator[list[ResultAnswerRow]]:
+        """
+        Pages of (result_id, submitted_date, ip, question_id, answer_id, answer) ordered by result,
+        answer is the answer name for selections.
+        """
+        pass
+
+    @abstractmethod
+    def iter_answer_rows(self, survey_id: int, page_size: int) -> Iterator[list[AnswerRow]]:
+        """
+        Pages of (result_id, submitted_date, question_id, answer_id, value) ordered by result,
+        value is None for selections. For reading answers by id, without joining their names.
+        """
+        pass
+
+    @abstractmethod
+    def last_result_id(self, survey_id: int) -> Optional[int]:
+        """Id of the latest result of a survey, changes whenever results are added."""
+        pass
+
+    @abstractmethod
+    def page_results(self, survey_id: int, after: Optional[tuple[str, int]], limit: int) -> list[ResultRow]:
+        """
+        Results of a survey by submission time.
+        after is the (submitted_date, result_id) of the last one of the previous page.
+        """
+        pass
+
+    @abstractmethod
+    def get_answers(self, result_ids: list[int]) -> list[ResultAnswerValueRow]:
+        """Answers of the results, ordered by result and then as they were submitted."""
+        pass
+
+
+class ResultRepositorySqlite3Impl(ResultRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def get_survey_questions(self, survey_id: int) -> Optional[dict[int, Question]]:
+        transaction: SQLite3Session = get_context(
+            self).get_instance(DataSession)
+        cursor = transaction.query(
+            "SELECT survey_id FROM SURVEY WHERE survey_id=?", (survey_id,))
+        if cursor.fetchone() is None:
+            return None
+        return get_context(self).get_instance(QuestionRepository).get_questions(survey_id)
+
+    def insert_results(self, results: list[Result]) -> list[int]:
+        transaction: SQLite3Session = get_context(
+            self).get_instance(DataSession)
+        ids = list[int]()
+        rows = list[tuple]()
+        # One insert per result for it's id, every answer in a single executemany.
+        for result in results:
+            cursor = transaction.execute(
+                "INSERT INTO RESULT(survey_id, ip, submitted_date) VALUES (?, ?, ?)",
+                (result.survey_id, result.ip, result.submitted_date.strftime("%Y-%m-%d %H:%M:%S")))
+            result.id = cursor.lastrowid
+            ids.append(result.id)
+            for position, result_answer in enumerate(result.answers):
+                answer = result_answer.answer
+                if isinstance(answer, Answer):
+                    rows.append((result.id, position, result_answer.question.id,
+                                answer.id, None))
+                else:
+                    rows.append((result.id, position, result_answer.question.id,
+                                None, answer))
+        transaction.executemany(
+            "INSERT INTO RESULT_ANSWER(result_id, position, question_id, answer_id, answer) VALUES (?, ?, ?, ?, ?)", rows)
+        return ids
+
+    def iter_result_answers(self, survey_id: int, page_size: int) -> Iterator[list[ResultAnswerRow]]:
+        transaction: SQLite3Session = get_context(
+            self).get_instance(DataSession)
+        cursor = transaction.query(
+            """SELECT r.result_id, r.submitted_date, r.ip, ra.question_id, ra.answer_id, COALESCE(a.name, ra.answer)
+            FROM RESULT r
+            JOIN RESULT_ANSWER ra ON ra.result_id = r.result_id
+            LEFT JOIN ANSWER a ON a.answer_id = ra.answer_id
+            WHERE r.survey_id=? ORDER BY r.result_id, ra.position""", (survey_id,))
+        return self.__pages(cursor, page_size)
+
+    def iter_answer_rows(self, survey_id: int, page_size: int) -> Iterator[list[AnswerRow]]:
+        transaction: SQLite3Session = get_context(
+            self).get_instance(DataSession)
+        cursor = transaction.query(
+            """SELECT r.result_id, r.submitted_date, ra.question_id, ra.answer_id, ra.answer
+            FROM RESULT r
+            JOIN RESULT_ANSWER ra ON ra.result_id = r.result_id
+            WHERE r.survey_id=? ORDER BY r.result_id, ra.position""", (survey_id,))
+        return self.__pages(cursor, page_size)
+
+    def __pages(self, cursor, page_size: int) -> Iterator[list[tuple]]:
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                return
+            yield rows
+
+    def last_result_id(self, survey_id: int) -> Optional[int]:
+        transaction: SQLite3Session = get_context(
+            self).get_instance(DataSession)
+        return transaction.query(
+            "SELECT MAX(result_id) FROM RESULT WHERE survey_id=?", (survey_id,)).fetchone()[0]
+
+    def page_results(self, survey_id: int, after: Optional[tuple[str, int]], limit: int) -> list[ResultRow]:
+        transaction: SQLite3Session = get_context(
+            self).get_instance(DataSession)
+        # Seeks RESULT_SURVEY_SUBMITTED, (survey_id, submitted_date, rowid), instead of skipping an OFFSET
+        keyset, params = ("AND (submitted_date, result_id) > (?, ?)", after) if after is not None else ("", ())
+        return transaction.query(
+            f"""SELECT result_id, submitted_date, ip FROM RESULT WHERE survey_id=? {keyset}
+            ORDER BY submitted_date, result_id LIMIT ?""", (survey_id, *params, limit)).fetchall()
+
+    def get_answers(self, result_ids: list[int]) -> list[ResultAnswerValueRow]:
+        if not result_ids:
+            return []
+        transaction: SQLite3Session = get_context(
+            self).get_instance(DataSession)
+        return transaction.query(
+            f"""SELECT result_id, question_id, answer_id, answer FROM RESULT_ANSWER
+            WHERE result_id IN ({", ".join("?" * len(result_ids))}) ORDER BY result_id, position""", result_ids).fetchall()
@@ -0,0 +1,52 @@
+from abc import ABC, abstractmethod
+
+from util import context_scoped, get_context
+from .base import DataSession, SQLite3Session
+
+
+@context_scoped
+class RevocationRepository(ABC):
+    @abstractmethod
+    def load(self, now: int) -> tuple[dict[str, int], dict[int, float]]:
+        """Revoked tokens not expired by now, jti to expiration, and revoked_before by user (epoch seconds, with a fraction)."""
+        pass
+
+    @abstractmethod
+    def save(self, tokens: dict[str, int], users: dict[int, float]):
+        pass
+
+    @abstractmethod
+    def prune(self, now: int):
+        """Deletes revoked tokens that expired, they are rejected anyway."""
+        pass
+
+
+class RevocationRepositorySqlite3Impl(RevocationRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def __session(self) -> SQLite3Session:
+        return get_context(self).get_instance(DataSession)
+
+    def load(self, now: int) -> tuple[dict[str, int], dict[int, float]]:
+        transaction = self.__session()
+        tokens = dict(transaction.query(
+            "SELECT jti, expires_at FROM REVOKED_TOKEN WHERE expires_at > ?", (now,)).fetchall())
+        users = dict(transaction.query(
+            "SELECT user_id, revoked_before FROM REVOKED_USER").fetchall())
+        return tokens, users
+
+    def save(self, tokens: dict[str, int], users: dict[int, float]):
+        transaction = self.__session()
+        transaction.executemany(
+            "INSERT OR IGNORE INTO REVOKED_TOKEN(jti, expires_at) VALUES (?, ?)", tokens.items())
+        # Another process could have revoked later, the latest wins
+        transaction.executemany(
+            """INSERT INTO REVOKED_USER(user_id, revoked_before) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET revoked_before=MAX(revoked_before, excluded.revoked_before)""",
+            users.items())
+
+    def prune(self, now: int):
+        self.__session().execute(
+            "DELETE FROM REVOKED_TOKEN WHERE expires_at <= ?", (now,))
@@ -0,0 +1,119 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Optional
+
+from model import Question, Survey
+from util import context_scoped, get_context, notify_change
+from .base import DataSession, SQLite3Session
+from .question import QuestionRepository
+
+
+@context_scoped
+class SurveyRepository(ABC):
+    @abstractmethod
+    def get_survey(self, survey_id: int) -> Optional[Survey]:
+        pass
+
+    @abstractmethod
+    def get_survey_version(self, survey_id: int) -> Optional[str]:
+        """Changes whenever the survey is updated, None if it doesn't exist. Only digits, it goes in ETags."""
+        pass
+
+    @abstractmethod
+    def create_survey(self, survey: Survey, questions: list[Question], user_id: Optional[int]) -> int:
+        """Inserts it with it's questions, user_id is who created it."""
+        pass
+
+    @abstractmethod
+    def update_survey(self, survey: Survey) -> bool:
+        """Title, description and dates, False if it doesn't exist."""
+        pass
+
+    @abstractmethod
+    def mark_changed(self, survey_id: int):
+        """New version of the survey, caches of it are dropped once committed."""
+        pass
+
+    @abstractmethod
+    def open_surveys(self, now: datetime, after: Optional[tuple[str, int]], limit: int) -> list[Survey]:
+        """
+        Surveys started by now and not ended, newest first.
+        after is the (start_date, survey_id) of the last one of the previous page.
+        """
+        pass
+
+
+def parse_timestamp(timestamp: Optional[str]) -> Optional[datetime]:
+    return None if timestamp is None else datetime.fromisoformat(timestamp)
+
+
+def format_timestamp(date: Optional[datetime]) -> Optional[str]:
+    """In UTC like CURRENT_TIMESTAMP, so stored dates compare as text."""
+    if date is None:
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SurveyRepositorySqlite3Impl(SurveyRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def __session(self) -> SQLite3Session:
+        return get_context(self).get_instance(DataSession)
+
+    def get_survey(self, survey_id: int) -> Optional[Survey]:
+        row = self.__session().query(
+            "SELECT survey_id, title, description, start_date, end_date FROM SURVEY WHERE survey_id=?", (survey_id,)).fetchone()
+        return None if row is None else self.__survey(row)
+
+    def __survey(self, row: tuple) -> Survey:
+        survey_id, title, description, start_date, end_date = row
+        return Survey(survey_id, None, None, title, description,
+                      parse_timestamp(start_date), parse_timestamp(end_date))
+
+    def get_survey_version(self, survey_id: int) -> Optional[str]:
+        # updated_at as epoch milliseconds, it's text has a space ETags can't have
+        row = self.__session().query(
+            "SELECT CAST(round((julianday(updated_at) - 2440587.5) * 86400000) AS INTEGER) "
+            "FROM SURVEY WHERE survey_id=?", (survey_id,)).fetchone()
+        return None if row is None else str(row[0] or 0)
+
+    def create_survey(self, survey: Survey, questions: list[Question], user_id: Optional[int]) -> int:
+        survey_id = self.__session().execute(
+            "INSERT INTO SURVEY(user_id, organization_id, title, description, start_date, end_date) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, survey.organization and survey.organization.id, survey.title,
+             survey.description, format_timestamp(survey.start_date), format_timestamp(survey.end_date))).lastrowid
+        repository = get_context(self).get_instance(QuestionRepository)
+        for question in questions:
+            repository.insert_question(survey_id, question)
+        return survey_id
+
+    def update_survey(self, survey: Survey) -> bool:
+        updated = self.__session().execute(
+            "UPDATE SURVEY SET title=?, description=?, start_date=?, end_date=? WHERE survey_id=?",
+            (survey.title, survey.description, format_timestamp(survey.start_date),
+             format_timestamp(survey.end_date), survey.id)).rowcount
+        if updated:
+            self.mark_changed(survey.id)
+        return updated > 0
+
+    def mark_changed(self, survey_id: int):
+        transaction = self.__session()
+        # A new version (so a new ETag), with milliseconds so quick updates differ
+        transaction.execute(
+            "UPDATE SURVEY SET updated_at=strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE survey_id=?", (survey_id,))
+        # Cached responses go away once it's committed, not before
+        transaction.after_commit(lambda: notify_change("survey", survey_id))
+
+    def open_surveys(self, now: datetime, after: Optional[tuple[str, int]], limit: int) -> list[Survey]:
+        now_text = format_timestamp(now)
+        # The row value comparison seeks SURVEY_START, (start_date, rowid), instead of skipping an OFFSET
+        keyset, params = ("AND (start_date, survey_id) < (?, ?)", after) if after is not None else ("", ())
+        cursor = self.__session().query(
+            f"""SELECT survey_id, title, description, start_date, end_date FROM SURVEY
+            WHERE start_date <= ? AND (end_date IS NULL OR end_date > ?) {keyset}
+            ORDER BY start_date DESC, survey_id DESC LIMIT ?""", (now_text, now_text, *params, limit))
+        return [self.__survey(row) for row in cursor.fetchall()]
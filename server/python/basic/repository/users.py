@@ -4,14 +4,19 @@ from abc import ABC, abstractmethod
 from typing import Optional
 
 from model import Roles, User
-from util import context_scoped, get_context
+from util import context_scoped, get_context, notify_change
 from .base import DataSession, SQLite3Session
 
 
 @context_scoped
 class UserRepository(ABC):
     @abstractmethod
-    def get_user_by_username_and_password(self, username: str, password: str) -> Optional[User]:
+    def get_user_by_username(self, username: str) -> Optional[User]:
+        pass
+
+    @abstractmethod
+    def update_password(self, user: User, encoded_pwd: str):
+        """Cached copies of the user are dropped once committed."""
         pass
 
 
@@ -20,13 +25,19 @@ class UserRepositorySqlite3Impl(UserRepository):
     def __init__(self):
         super().__init__()
 
-    def get_user_by_username_and_password(self, username: str, encoded_pwd: str) -> Optional[User]:
+    def get_user_by_username(self, username: str) -> Optional[User]:
         context = get_context(self)
         transction: SQLite3Session = context.get_instance(DataSession)
         cursor = transction.query(
-            "SELECT user_id, role, name, username, password, organization_id FROM USER WHERE username=? AND password=? LIMIT 1", (username, encoded_pwd))
+            "SELECT user_id, role, name, username, password, organization_id FROM USER WHERE username=?", (username,))
         row = cursor.fetchone()
         if row is None:
             return None
         user_id, role, *row = row
         return User(user_id, Roles(role), *row)
+
+    def update_password(self, user: User, encoded_pwd: str):
+        transaction: SQLite3Session = get_context(self).get_instance(DataSession)
+        transaction.execute(
+            "UPDATE USER SET password=?, updated_at=CURRENT_TIMESTAMP WHERE user_id=?", (encoded_pwd, user.id))
+        transaction.after_commit(lambda: notify_change("user", user.username))
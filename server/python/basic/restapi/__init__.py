@@ -1,2 +1,7 @@
+from .aggregates import *
+from .analytics import *
 from .auth import *
-from .question import *
\ No newline at end of file
+from .question import *
+from .results import *
+from .stats import *
+from .surveys import *
@@ -0,0 +1,21 @@
+from http import HTTPStatus
+from handler import CustomHandler, Application, HttpError
+from repository import AggregateRepository
+from util import inject
+
+app: Application = inject(Application)
+
+
+@app.GET("/restapi/surveys/{survey_id:int}/aggregates", authenticated=True)
+def survey_aggregates(handler: CustomHandler):
+    repository = handler.get_context().get_instance(AggregateRepository)
+    return repository.get_survey_aggregates(handler.match['survey_id'])
+
+
+@app.GET("/restapi/questions/{question_id:int}/aggregate", authenticated=True)
+def question_aggregate(handler: CustomHandler):
+    repository = handler.get_context().get_instance(AggregateRepository)
+    aggregate = repository.get_question_aggregate(handler.match['question_id'])
+    if aggregate is None:
+        raise HttpError(HTTPStatus.NOT_FOUND, "Question not found")
+    return aggregate
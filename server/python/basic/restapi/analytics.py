@@ -0,0 +1,65 @@
+from datetime import datetime, timezone
+from http import HTTPStatus
+from typing import Optional
+from urllib.parse import parse_qs
+from handler import CustomHandler, Application, HttpError
+from services import AnalyticsService, InvalidQueryException, QuestionNotFoundException, SurveyNotFoundException
+from util import inject
+
+app: Application = inject(Application)
+
+DEFAULT_PERCENTILES = "25,50,75"
+
+
+def parse_date(params: dict[str, list[str]], name: str) -> Optional[datetime]:
+    if name not in params:
+        return None
+    try:
+        date = datetime.fromisoformat(params[name][0])
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Invalid \"{name}\"")
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+
+def parse_int(params: dict[str, list[str]], name: str) -> int:
+    try:
+        return int(params[name][0])
+    except (KeyError, ValueError):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Expected a question id as \"{name}\"")
+
+
+def run_query(func, *args):
+    try:
+        return func(*args)
+    except (SurveyNotFoundException, QuestionNotFoundException) as e:
+        raise HttpError(HTTPStatus.NOT_FOUND, str(e))
+    except InvalidQueryException as e:
+        raise HttpError(HTTPStatus.BAD_REQUEST, str(e))
+
+
+@app.GET("/restapi/surveys/{survey_id:int}/analytics/questions/{question_id:int}", authenticated=True)
+def question_distribution(handler: CustomHandler):
+    """
+    Distribution of a question among the results matching ?where=question:condition (repeatable),
+    ?since and ?until. Numbers include ?percentiles (comma separated, 25,50,75 by default).
+    """
+    params = parse_qs(handler.parsed_url.query)
+    try:
+        percentiles = [float(p) for p in params.get(
+            "percentiles", [DEFAULT_PERCENTILES])[0].split(",")]
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid \"percentiles\"")
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Percentiles go from 0 to 100")
+    service = handler.get_context().get_instance(AnalyticsService)
+    return run_query(service.distribution, handler.match['survey_id'], handler.match['question_id'],
+                     params.get("where", []), percentiles, parse_date(params, "since"), parse_date(params, "until"))
+
+
+@app.GET("/restapi/surveys/{survey_id:int}/analytics/crosstab", authenticated=True)
+def crosstab(handler: CustomHandler):
+    """Counts of ?rows options by ?columns options, filtered like the question distribution."""
+    params = parse_qs(handler.parsed_url.query)
+    service = handler.get_context().get_instance(AnalyticsService)
+    return run_query(service.crosstab, handler.match['survey_id'], parse_int(params, "rows"), parse_int(params, "columns"),
+                     params.get("where", []), parse_date(params, "since"), parse_date(params, "until"))
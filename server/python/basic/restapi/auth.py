@@ -2,9 +2,12 @@ from abc import ABC
 from dataclasses import dataclass
 from http import HTTPStatus
 from typing import Optional
-from handler import CustomHandler, Application, HttpError
+import math
+from handler import CustomHandler, Application, HttpError, JsonResponse, Response
+from model import Roles
 from repository import UserRepository
-from services import AuthService, AuthException
+from services import AuthService, AuthException, RevocationList, ThrottledException, UserSubject
+from services.jwt import JWTException, JWTService
 from util import inject, Context
 
 app: Application = inject(Application)
@@ -16,25 +19,66 @@ class LoginDetails:
     password: str
 
 
-@app.POST("/restapi/auth")
-def authenticate(handler: CustomHandler):
+@dataclass
+class RefreshDetails:
+    refreshToken: str
+
+
+@dataclass
+class LogoutDetails:
+    refreshToken: Optional[str] = None
+
+
+@app.POST("/restapi/auth", body=LoginDetails)
+def authenticate(handler: CustomHandler, details: LoginDetails):
     context: Context = handler.get_context()
     authService = context.get_instance(AuthService)
-    details = handler.getBody(LoginDetails)
     try:
-        user = authService.authenticate(details.username, details.password)
+        user = authService.authenticate(
+            details.username, details.password, handler.client_address[0])
+    except ThrottledException as e:
+        return JsonResponse({"error": "Too many attempts"},
+                            {"Retry-After": str(math.ceil(e.retry_after))}, HTTPStatus.TOO_MANY_REQUESTS)
     except AuthException:
         raise HttpError(HTTPStatus.UNAUTHORIZED, "Wrong credentials")
     return authService.generate_jwt_token(user)
     
-@app.GET("/restapi/auth/refresh")
-def authenticate(handler: CustomHandler):
-    context: Context = handler.get_context()
-    authService = context.get_instance(AuthService)
-    details = handler.getBody(LoginDetails)
+
+@app.POST("/restapi/auth/refresh", body=RefreshDetails)
+def refresh(handler: CustomHandler, details: RefreshDetails):
+    """A new access token, only the refresh token is checked (signature, expiration and revocations)."""
+    authService = handler.get_context().get_instance(AuthService)
     try:
-        user = authService.authenticate(details.username, details.password)
+        return authService.refresh(details.refreshToken)
     except AuthException:
         raise HttpError(HTTPStatus.UNAUTHORIZED, "Invalid refresh")
-    return authService.generate_jwt_token(user)
+
+
+@app.POST("/restapi/auth/logout", authenticated=True, body=LogoutDetails)
+def logout(handler: CustomHandler, details: LogoutDetails):
+    """Revokes the access token of the request and the refresh token if it's given."""
+    context: Context = handler.get_context()
+    revocations = inject(RevocationList)
+    if details.refreshToken is not None:
+        try:
+            refresh = context.get_instance(AuthService).decode_refresh(details.refreshToken)
+        except AuthException:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid refresh")
+        if refresh.get_subject()["id"] != context.find_instance(UserSubject).id:
+            raise HttpError(HTTPStatus.FORBIDDEN, "Not your refresh token")
+        revocations.revoke(refresh)
+    # Already decoded by the BearerTokenMiddleware, it's cached
+    _, _, token = handler.headers['Authorization'].partition(" ")
+    try:
+        revocations.revoke(inject(JWTService).decode(token.strip()))
+    except (JWTException, ValueError):
+        pass
+    return Response(None, status=HTTPStatus.NO_CONTENT)
+
+
+@app.POST("/restapi/auth/revoke/{user_id:int}", roles=[Roles.SYSADMIN])
+def revoke_user(handler: CustomHandler):
+    """Every token of the user issued until now, it has to log in again."""
+    inject(RevocationList).revoke_user(handler.match['user_id'])
+    return Response(None, status=HTTPStatus.NO_CONTENT)
     
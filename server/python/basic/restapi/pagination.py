@@ -0,0 +1,40 @@
+import base64
+import binascii
+from http import HTTPStatus
+from typing import Optional
+from urllib.parse import parse_qs
+from handler import CustomHandler, HttpError
+from util import dumps, loads
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def encode_cursor(sort_key: str, id: int) -> str:
+    """Opaque ?after of the next page, the sort key and id of the last item."""
+    return base64.urlsafe_b64encode(dumps([sort_key, id])).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        sort_key, id = loads(base64.urlsafe_b64decode(
+            cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError, binascii.Error):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid \"after\"")
+    if not isinstance(sort_key, str) or not isinstance(id, int):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid \"after\"")
+    return sort_key, id
+
+
+def page_params(handler: CustomHandler) -> tuple[Optional[tuple[str, int]], int]:
+    """?after (a cursor from the previous page) and ?limit, up to MAX_LIMIT."""
+    params = parse_qs(handler.parsed_url.query)
+    after = decode_cursor(params["after"][0]) if "after" in params else None
+    try:
+        limit = int(params.get("limit", [DEFAULT_LIMIT])[0])
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid \"limit\"")
+    if not 0 < limit <= MAX_LIMIT:
+        raise HttpError(HTTPStatus.BAD_REQUEST,
+                        f"\"limit\" goes from 1 to {MAX_LIMIT}")
+    return after, limit
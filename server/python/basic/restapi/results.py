@@ -0,0 +1,109 @@
+from http import HTTPStatus
+from typing import Any
+from urllib.parse import parse_qs
+from cgi import parse_header
+from handler import CustomHandler, Application, HttpError, Response, StreamingResponse
+from repository import ResultRepository
+from services import ResultService, ResultValidationException, ResultWriter, SurveyClosedException, SurveyNotFoundException
+from util import inject, loads
+from .pagination import encode_cursor, page_params
+
+app: Application = inject(Application)
+
+# Seconds a batch waits for it's group commit
+BATCH_TIMEOUT = 30
+
+
+def parse_ndjson(data: bytes) -> list[Any]:
+    """One questionnaire per line, a broken line is reported instead of failing the batch."""
+    items = list[Any]()
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            # Like the JSON array path, NaN and Infinity aren't JSON
+            items.append(loads(line))
+        except ValueError:
+            items.append(ResultValidationException("Invalid JSON line"))
+    return items
+
+
+def parse_results(handler: CustomHandler, items: list[Any]):
+    service = handler.get_context().get_instance(ResultService)
+    try:
+        return service.parse_results(handler.match['survey_id'], items, handler.client_address[0])
+    except SurveyNotFoundException as e:
+        raise HttpError(HTTPStatus.NOT_FOUND, str(e))
+    except SurveyClosedException as e:
+        raise HttpError(HTTPStatus.CONFLICT, str(e))
+
+
+@app.POST("/restapi/surveys/{survey_id:int}/results")
+def submit_result(handler: CustomHandler):
+    """
+    202 only means it's valid and queued, it's written by the next group commit without waiting for it.
+    If that fails it's logged and counted in result_writer.failed of /restapi/stats/database.
+    """
+    results, errors = parse_results(handler, [handler.getBody()])
+    if errors:
+        raise HttpError(HTTPStatus.BAD_REQUEST, errors[0]['error'])
+    # Written behind, in the next group commit
+    inject(ResultWriter).submit(results)
+    return Response({"accepted": 1}, status=HTTPStatus.ACCEPTED)
+
+
+@app.POST("/restapi/surveys/{survey_id:int}/results/batch")
+def submit_results(handler: CustomHandler):
+    """Accepts a JSON array or NDJSON (application/x-ndjson) of questionnaires."""
+    mimetype, _ = parse_header(handler.headers['Content-Type'] or '')
+    if mimetype.lower() == "application/x-ndjson":
+        items = parse_ndjson(handler.getBody())
+    else:
+        items = handler.getBody()
+        if not isinstance(items, list):
+            raise HttpError(HTTPStatus.BAD_REQUEST,
+                            "Expected an array of questionnaires")
+    results, errors = parse_results(handler, items)
+    ids = inject(ResultWriter).submit(results).result(BATCH_TIMEOUT)
+    return {"accepted": len(ids), "ids": ids, "errors": errors}
+
+
+@app.GET("/restapi/surveys/{survey_id:int}/results", authenticated=True)
+def page_results(handler: CustomHandler):
+    """Results in the order they were submitted, ?limit of them after the ?after cursor of the previous page."""
+    after, limit = page_params(handler)
+    results = handler.get_context().get_instance(ResultRepository)
+    rows = results.page_results(handler.match['survey_id'], after, limit)
+    page = {result_id: {"id": result_id, "submitted_date": submitted_date, "ip": ip, "answers": []}
+            for result_id, submitted_date, ip in rows}
+    # One query for the answers of the whole page
+    for result_id, question_id, answer_id, answer in results.get_answers(list(page)):
+        page[result_id]["answers"].append(
+            {"question": question_id, "answer": answer_id, "value": answer})
+    last = rows[-1] if len(rows) == limit else None
+    return {
+        "results": list(page.values()),
+        "next": last and encode_cursor(last[1], last[0]),
+    }
+
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+
+@app.GET("/restapi/surveys/{survey_id:int}/results/export", authenticated=True)
+def export_results(handler: CustomHandler):
+    """Streams every result, ?format=csv (default) or ?format=ndjson."""
+    format = parse_qs(handler.parsed_url.query).get("format", ["csv"])[0]
+    if format not in CONTENT_TYPES:
+        raise HttpError(HTTPStatus.BAD_REQUEST,
+                        f"Unknown export format \"{format}\"")
+    service = handler.get_context().get_instance(ResultService)
+    try:
+        body = service.export(handler.match['survey_id'], format)
+    except SurveyNotFoundException as e:
+        raise HttpError(HTTPStatus.NOT_FOUND, str(e))
+    return StreamingResponse(body, CONTENT_TYPES[format], {
+        "Content-Disposition": f"attachment; filename=\"survey-{handler.match['survey_id']}.{format}\""})
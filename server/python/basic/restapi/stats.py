@@ -0,0 +1,36 @@
+from handler import CustomHandler, Application, Response, SessionCounter
+from model import Roles
+from repository import Datasource, QueryStats
+from services import LoginThrottle, ResultWriter, UserCache
+from util import Metrics, inject
+from util.metrics import CONTENT_TYPE
+
+app: Application = inject(Application)
+
+
+@app.GET("/restapi/stats/database", roles=[Roles.SYSADMIN])
+def database_stats(handler: CustomHandler):
+    datasource = inject(Datasource)
+    return {
+        "pool": datasource.stats().to_dict(),
+        "queries": inject(QueryStats).snapshot(),
+        # DataSessions opened by route, most requests shouldn't need one
+        "sessions": inject(SessionCounter).snapshot(),
+        # Results written behind, failed ones were already answered with 202
+        "result_writer": inject(ResultWriter).snapshot(),
+    }
+
+
+@app.GET("/restapi/stats/auth", roles=[Roles.SYSADMIN])
+def auth_stats(handler: CustomHandler):
+    return {
+        "user_cache": inject(UserCache).snapshot(),
+        "throttle": inject(LoginThrottle).snapshot(),
+    }
+
+
+if inject(Metrics).enabled:
+    # Unauthenticated, like scrapers expect, it only tells routes and counts
+    @app.GET("/metrics")
+    def metrics(handler: CustomHandler):
+        return Response(inject(Metrics).render(), {"Content-Type": CONTENT_TYPE})
@@ -0,0 +1,203 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http import HTTPStatus
+from typing import Any, Optional
+from handler import CachePolicy, CustomHandler, Application, HttpError, ImmutableResponse, Response
+from model import Answer, Attribute, AttributeType, Question, QuestionType, Roles, Survey
+from repository import QuestionInUseException, QuestionRepository, ResultRepository, SurveyRepository
+from repository.survey import format_timestamp
+from services import UserSubject
+from util import inject, value
+from .pagination import encode_cursor, page_params
+
+app: Application = inject(Application)
+
+EDITORS = [Roles.SYSADMIN, Roles.ORGANIZATION_ADMIN, Roles.RESEARCHER]
+# Questions answered by choosing from their answers
+SELECTIONS = {QuestionType.CHECKBOX, QuestionType.RATIO_SELECT,
+              QuestionType.MENU_SELECT, QuestionType.MULTI_MENU_SELECT}
+# Seconds a survey definition is served from the ResponseCache, updates drop it earlier
+DEFINITION_TTL = float(value('server.response_cache.survey_ttl', '300'))
+
+
+def question_to_dict(question: Question) -> dict[str, Any]:
+    return {
+        "id": question.id,
+        "type": question.type.name,
+        "header": question.header,
+        "description": question.description,
+        "attributes": [{"type": a.type.name, "value": a.value} for a in question.attributes],
+        "answers": None if question.answers is None else [
+            {"id": a.id, "name": a.name, "description": a.description, "order": a.order}
+            for a in sorted(question.answers, key=lambda a: a.order)],
+    }
+
+
+@dataclass
+class SurveyDetails:
+    title: str
+    description: Optional[str] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+
+
+@dataclass
+class QuestionDetails:
+    header: str
+    description: Optional[str] = None
+
+
+@dataclass
+class NewAnswer:
+    name: str
+    description: Optional[str] = None
+    order: Optional[int] = None
+
+
+@dataclass
+class NewAttribute:
+    type: AttributeType
+    value: str
+
+
+@dataclass
+class NewQuestion:
+    type: QuestionType
+    header: str
+    description: Optional[str] = None
+    attributes: list[NewAttribute] = field(default_factory=list)
+    answers: list[NewAnswer] = field(default_factory=list)
+
+
+@dataclass
+class NewSurvey:
+    title: str
+    description: Optional[str] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    questions: list[NewQuestion] = field(default_factory=list)
+
+
+def to_question(details: NewQuestion, path: str) -> Question:
+    if not details.header.strip():
+        raise HttpError(HTTPStatus.BAD_REQUEST, "The header can't be empty",
+                        [{"field": f"{path}header", "error": "Empty"}])
+    if details.type in SELECTIONS and not details.answers:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Wrong JSON format.",
+                        [{"field": f"{path}answers", "error": f"A {details.type.name} needs answers"}])
+    # Answers keep the order they were sent in unless it's given
+    answers = [Answer(None, a.name, a.description, index if a.order is None else a.order)
+               for index, a in enumerate(details.answers)]
+    return Question(None, details.type, details.header, details.description,
+                    [Attribute(a.type, a.value) for a in details.attributes],
+                    answers if details.type in SELECTIONS else None)
+
+
+def survey_to_dict(survey: Survey) -> dict[str, Any]:
+    return {
+        "id": survey.id,
+        "title": survey.title,
+        "description": survey.description,
+        "start_date": survey.start_date and survey.start_date.isoformat(),
+        "end_date": survey.end_date and survey.end_date.isoformat(),
+    }
+
+
+@app.GET("/restapi/surveys")
+def open_surveys(handler: CustomHandler):
+    """Surveys open now, newest first, ?limit of them after the ?after cursor of the previous page."""
+    after, limit = page_params(handler)
+    surveys = handler.get_context().get_instance(SurveyRepository).open_surveys(
+        datetime.now(timezone.utc), after, limit)
+    last = surveys[-1] if len(surveys) == limit else None
+    return {
+        "surveys": [survey_to_dict(s) for s in surveys],
+        "next": last and encode_cursor(format_timestamp(last.start_date), last.id),
+    }
+
+
+@app.POST("/restapi/surveys", roles=EDITORS, body=NewSurvey)
+def create_survey(handler: CustomHandler, details: NewSurvey):
+    """Creates the survey with it's questions, opened now unless start_date is given."""
+    if not details.title.strip():
+        raise HttpError(HTTPStatus.BAD_REQUEST, "The title can't be empty")
+    questions = [to_question(q, f"questions[{index}].")
+                 for index, q in enumerate(details.questions)]
+    survey = Survey(None, None, None, details.title, details.description,
+                    details.start_date or datetime.now(timezone.utc), details.end_date)
+    context = handler.get_context()
+    user = context.find_instance(UserSubject)
+    survey_id = context.get_instance(SurveyRepository).create_survey(
+        survey, questions, user and user.id)
+    return Response({"id": survey_id}, status=HTTPStatus.CREATED)
+
+
+@app.GET("/restapi/surveys/{survey_id:int}", cache=CachePolicy(DEFINITION_TTL, ("survey", "survey_id")))
+def survey_definition(handler: CustomHandler):
+    """Survey with it's questions, what respondents fetch to answer it."""
+    context = handler.get_context()
+    survey_id = handler.match['survey_id']
+    surveys = context.get_instance(SurveyRepository)
+    version = surveys.get_survey_version(survey_id)
+    if version is None:
+        raise HttpError(HTTPStatus.NOT_FOUND, "Survey not found")
+
+    def definition():
+        # Only built when it isn't cached for this version
+        survey = surveys.get_survey(survey_id)
+        questions = context.get_instance(
+            ResultRepository).get_survey_questions(survey_id)
+        return survey_to_dict(survey) | {
+            "questions": [question_to_dict(q) for q in questions.values()],
+        }
+    return ImmutableResponse(f'W/"survey-{survey_id}-{version}"', definition)
+
+
+@app.PUT("/restapi/surveys/{survey_id:int}", roles=EDITORS, body=SurveyDetails)
+def update_survey(handler: CustomHandler, details: SurveyDetails):
+    """Replaces the title, description, start_date and end_date."""
+    if not details.title.strip():
+        raise HttpError(HTTPStatus.BAD_REQUEST, "The title can't be empty")
+    survey = Survey(handler.match['survey_id'], None, None, details.title,
+                    details.description, details.start_date, details.end_date)
+    if not handler.get_context().get_instance(SurveyRepository).update_survey(survey):
+        raise HttpError(HTTPStatus.NOT_FOUND, "Survey not found")
+    return Response(None, status=HTTPStatus.NO_CONTENT)
+
+
+@app.PUT("/restapi/surveys/{survey_id:int}/questions/{question_id:int}", roles=EDITORS, body=QuestionDetails)
+def update_question(handler: CustomHandler, details: QuestionDetails):
+    """Replaces the header and description."""
+    if not details.header.strip():
+        raise HttpError(HTTPStatus.BAD_REQUEST, "The header can't be empty")
+    question = Question(handler.match['question_id'], None,
+                        details.header, details.description)
+    if not handler.get_context().get_instance(QuestionRepository).update_question(handler.match['survey_id'], question):
+        raise HttpError(HTTPStatus.NOT_FOUND, "Question not found")
+    return Response(None, status=HTTPStatus.NO_CONTENT)
+
+
+@app.POST("/restapi/surveys/{survey_id:int}/questions", roles=EDITORS, body=NewQuestion)
+def create_question(handler: CustomHandler, details: NewQuestion):
+    question = to_question(details, "")
+    context = handler.get_context()
+    survey_id = handler.match['survey_id']
+    if context.get_instance(SurveyRepository).get_survey_version(survey_id) is None:
+        raise HttpError(HTTPStatus.NOT_FOUND, "Survey not found")
+    question_id = context.get_instance(
+        QuestionRepository).create_question(survey_id, question)
+    return Response({"id": question_id}, status=HTTPStatus.CREATED)
+
+
+@app.DELETE("/restapi/surveys/{survey_id:int}/questions/{question_id:int}", roles=EDITORS)
+def delete_question(handler: CustomHandler):
+    """Only while nobody answered it, results keep pointing to their questions."""
+    questions = handler.get_context().get_instance(QuestionRepository)
+    try:
+        deleted = questions.delete_question(
+            handler.match['survey_id'], handler.match['question_id'])
+    except QuestionInUseException as e:
+        raise HttpError(HTTPStatus.CONFLICT, str(e))
+    if not deleted:
+        raise HttpError(HTTPStatus.NOT_FOUND, "Question not found")
+    return Response(None, status=HTTPStatus.NO_CONTENT)
@@ -0,0 +1,251 @@
+"""
+Routes can be registered as:
+* Literal: "/restapi/auth"
+* Template: "/restapi/survey/{id:int}/results", typed by the converters below, "{id}" is a str.
+* re.Pattern: Matched with re.match, like before. Only tried when nothing else matched.
+"""
+import logging
+import re
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger('Routing')
+
+# Converter name -> (segment regex, python type)
+CONVERTERS: dict[str, tuple[re.Pattern, Callable[[str], Any]]] = {
+    'int': (re.compile(r"-?\d+"), int),
+    'float': (re.compile(r"-?\d+(?:\.\d+)?"), float),
+    'str': (re.compile(r"[^/]+"), str),
+}
+# More specific converters are tried first on the same segment.
+PRIORITY = {'int': 0, 'float': 1, 'str': 2}
+
+TemplateParam = re.compile(r"^\{(\w+)(?::(\w+))?\}$")
+NamedGroup = re.compile(r"\(\?P<\w+>")
+BackReference = re.compile(r"\\\d|\(\?P=")
+# Inline flags like (?i) apply to the whole expression, so they can't be inside an alternative
+GlobalFlags = re.compile(r"\(\?[aiLmsux]+\)")
+# Flags a group can scope, as (?ims:...), re.UNICODE is the default of str patterns.
+# Not re.VERBOSE, a trailing comment would swallow the closing parenthesis.
+ScopedFlags = {re.IGNORECASE: 'i', re.MULTILINE: 'm', re.DOTALL: 's'}
+
+
+def _combinable(pattern: re.Pattern) -> bool:
+    """Whether the pattern keeps it's meaning as a group of the combined alternation."""
+    if not isinstance(pattern.pattern, str) or BackReference.search(pattern.pattern) \
+            or GlobalFlags.search(pattern.pattern):
+        return False
+    flags = pattern.flags & ~re.UNICODE
+    for flag in ScopedFlags:
+        flags &= ~flag
+    return flags == 0
+
+
+def _scoped_flags(pattern: re.Pattern) -> str:
+    return "".join(letter for flag, letter in ScopedFlags.items() if pattern.flags & flag)
+
+
+class RouteConflictException(Exception):
+    def __init__(self, path: str | re.Pattern, other: str | re.Pattern):
+        super().__init__(f"Route {path} is ambiguous with {other}")
+
+
+class InvalidRouteException(Exception):
+    def __init__(self, path: str, cause: str):
+        super().__init__(f"Invalid route {path}: {cause}")
+
+
+class RouteMatch:
+    """
+    Result of matching a template route, behaves like a re.Match for endpoints
+    (group, groupdict, [name]), but the values are already converted.
+    """
+    __slots__ = ('params',)
+    params: dict[str, Any]
+
+    def __init__(self, params: dict[str, Any]):
+        self.params = params
+
+    def group(self, name: str | int = 0):
+        if isinstance(name, int):
+            return list(self.params.values())[name - 1]
+        return self.params[name]
+
+    def groupdict(self) -> dict[str, Any]:
+        return self.params
+
+    def __getitem__(self, name: str | int):
+        return self.group(name)
+
+    def __repr__(self):
+        return f"<RouteMatch {self.params}>"
+
+
+class _Node:
+    __slots__ = ('literals', 'params', 'func', 'path')
+
+    def __init__(self):
+        self.literals: dict[str, _Node] = dict()
+        # (converter, param name, fullmatch, cast, child), sorted by converter priority
+        self.params: list[tuple[str, str, Callable, Callable, _Node]] = list()
+        self.func: Optional[Callable] = None
+        self.path: Optional[str] = None
+
+    def param_child(self, converter: str, name: str, path: str) -> '_Node':
+        for other_converter, other_name, _, _, child in self.params:
+            if other_converter == converter:
+                if other_name != name:
+                    raise RouteConflictException(
+                        path, f"parameter {{{other_name}:{other_converter}}}")
+                return child
+        child = _Node()
+        pattern, cast = CONVERTERS[converter]
+        self.params.append((converter, name, pattern.fullmatch, cast, child))
+        self.params.sort(key=lambda p: PRIORITY[p[0]])
+        return child
+
+
+class RouteTable:
+    """
+    Routes of a single HTTP method, compiled for lookup:
+    literal paths in a dict, templates in a segment tree, and
+    all regex routes combined into a single alternation.
+    """
+    __static: dict[str, tuple[Callable, str]]
+    __regex: list[tuple[re.Pattern, Callable]]
+    __combined: Optional[re.Pattern]
+
+    def __init__(self):
+        self.__static = dict()
+        self.__root = _Node()
+        self.__regex = list()
+        self.__combined = None
+        self.__compiled = True
+
+    def __len__(self):
+        return len(self.__static) + self.__count(self.__root) + len(self.__regex)
+
+    def __count(self, node: _Node) -> int:
+        total = 0 if node.func is None else 1
+        for child in node.literals.values():
+            total += self.__count(child)
+        for *_, child in node.params:
+            total += self.__count(child)
+        return total
+
+    def add(self, path: str | re.Pattern, func: Callable):
+        if isinstance(path, re.Pattern):
+            self.__add_regex(path, func)
+        elif '{' in path:
+            self.__add_template(path, func)
+        else:
+            if path in self.__static:
+                raise RouteConflictException(path, self.__static[path][1])
+            self.__static[path] = (func, path)
+            for pattern, _ in self.__regex:
+                if pattern.match(path):
+                    logger.warning(
+                        f"Route {path} shadows regex {pattern.pattern} for that path")
+
+    def __add_template(self, path: str, func: Callable):
+        node = self.__root
+        for segment in path.split('/'):
+            m = TemplateParam.match(segment)
+            if m is None:
+                if '{' in segment or '}' in segment:
+                    raise InvalidRouteException(
+                        path, f"\"{segment}\" should be a whole segment like {{name:type}}")
+                node = node.literals.setdefault(segment, _Node())
+                continue
+            name, converter = m.group(1), m.group(2) or 'str'
+            if converter not in CONVERTERS:
+                raise InvalidRouteException(
+                    path, f"unknown converter \"{converter}\"")
+            node = node.param_child(converter, name, path)
+        if node.func is not None:
+            raise RouteConflictException(path, node.path)
+        node.func = func
+        node.path = path
+
+    def __add_regex(self, pattern: re.Pattern, func: Callable):
+        for other, _ in self.__regex:
+            if other.pattern == pattern.pattern:
+                raise RouteConflictException(pattern.pattern, other.pattern)
+        for path in self.__static:
+            if pattern.match(path):
+                logger.warning(
+                    f"Regex {pattern.pattern} is shadowed by route {path} for that path")
+        self.__regex.append((pattern, func))
+        self.__compiled = False
+
+    def compile(self):
+        """
+        Combines the regex routes, so a miss costs a single match. Each keeps it's flags in a
+        (?ims:...) group, with other flags or back references they're matched one by one.
+        """
+        self.__combined = None
+        if self.__regex and all(_combinable(p) for p, _ in self.__regex):
+            # Only used to know which route matched, the route's own pattern builds the re.Match
+            alternatives = [f"(?P<_r{i}>(?{_scoped_flags(p)}:{NamedGroup.sub('(?:', p.pattern)}))"
+                            for i, (p, _) in enumerate(self.__regex)]
+            try:
+                self.__combined = re.compile("|".join(alternatives))
+            except re.error:
+                logger.debug(
+                    "Regex routes can't be combined, matching one by one")
+        self.__compiled = True
+
+    def solve(self, path: str) -> tuple[Optional[Callable], Optional[re.Match | RouteMatch]]:
+        static = self.__static.get(path)
+        if static is not None:
+            return static[0], None
+        params = dict()
+        node = self.__find(self.__root, path.split('/'), 0, params)
+        if node is not None:
+            return node.func, RouteMatch(params)
+        return self.__solve_regex(path)
+
+    def __find(self, node: _Node, segments: list[str], index: int, params: dict[str, Any]) -> Optional[_Node]:
+        count = len(segments)
+        while index < count:
+            segment = segments[index]
+            child = node.literals.get(segment)
+            if not node.params:
+                # Only literals, nothing to backtrack to
+                if child is None:
+                    return None
+                node = child
+                index += 1
+                continue
+            if child is not None:
+                found = self.__find(child, segments, index + 1, params)
+                if found is not None:
+                    return found
+            for _, name, fullmatch, cast, child in node.params:
+                if fullmatch(segment) is None:
+                    continue
+                params[name] = cast(segment)
+                found = self.__find(child, segments, index + 1, params)
+                if found is not None:
+                    return found
+                del params[name]
+            return None
+        return node if node.func is not None else None
+
+    def __solve_regex(self, path: str) -> tuple[Optional[Callable], Optional[re.Match]]:
+        if not self.__compiled:
+            self.compile()
+        if not self.__regex:
+            return None, None
+        if self.__combined is not None:
+            m = self.__combined.match(path)
+            if m is None:
+                return None, None
+            # Leftmost alternative wins, same as trying them in registration order.
+            # Its wrapping group is the last one to close, so it's lastgroup.
+            pattern, func = self.__regex[int(m.lastgroup[2:])]
+            return func, pattern.match(path)
+        for pattern, func in self.__regex:
+            m = pattern.match(path)
+            if m is not None:
+                return func, m
+        return None, None
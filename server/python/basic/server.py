@@ -0,0 +1,241 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import logging
+import os
+import signal
+import threading
+from typing import Type
+from handler import AsyncRequestHandler
+from util import run_shutdown_hooks, run_startup_hooks, value
+
+logger = logging.getLogger('Server')
+
+
+class InvalidServerModeException(Exception):
+    def __init__(self, mode: str):
+        super().__init__(f"Unknown server mode \"{mode}\"")
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    HTTPServer that handles each connection on a bounded pool of worker threads.\n
+    When every worker is busy the accept loop waits, so extra connections stay in the listen backlog
+    instead of piling up in memory.
+    """
+
+    def __init__(self, server_address, handler: Type[BaseHTTPRequestHandler], workers: int, bind_and_activate=True):
+        super().__init__(server_address, handler, bind_and_activate)
+        self.__executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='Worker')
+        self.__slots = threading.BoundedSemaphore(workers)
+
+    def process_request(self, request, client_address):
+        self.__slots.acquire()
+        try:
+            self.__executor.submit(
+                self.__process_request, request, client_address)
+        except RuntimeError:
+            # Executor already shut down
+            self.__slots.release()
+            self.shutdown_request(request)
+
+    def __process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.__slots.release()
+
+    def server_close(self):
+        # Stop accepting, then drain what is already being handled.
+        super().server_close()
+        self.__executor.shutdown(wait=True)
+
+
+class PreforkHTTPServer:
+    """
+    Binds the listening socket once and forks N worker processes that accept from it.\n
+    Each worker has it's own singletons, Contexts and DataSessions after the fork.
+    """
+    __children: list[int]
+
+    def __init__(self, server_address, handler: Type[BaseHTTPRequestHandler], workers: int):
+        self.__server = HTTPServer(server_address, handler)
+        self.workers = workers
+        self.__children = []
+        self.__stopping = False
+
+    def serve_forever(self):
+        for _ in range(self.workers):
+            pid = os.fork()
+            if pid == 0:
+                self.__run_worker()
+            self.__children.append(pid)
+        logger.info(f"Started {self.workers} workers: {self.__children}")
+        self.__server.socket.close()  # Only workers accept
+        while self.__children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            if pid in self.__children:
+                self.__children.remove(pid)
+            if not self.__stopping:
+                logger.warning(
+                    f"Worker {pid} exited with status {status}")
+
+    def shutdown(self):
+        self.__stopping = True
+        logger.info("Stopping workers...")
+        for pid in self.__children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def __run_worker(self):
+        code = 0
+        try:
+            serve(self.__server)
+        except Exception:
+            logger.exception("Worker crashed")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def server_close(self):
+        pass
+
+
+class AsyncHTTPServer:
+    """
+    asyncio server, one task per connection, so idle keep-alive connections only cost a coroutine.\n
+    Requests are handled by AsyncRequestHandler, blocking work goes to a bounded executor.
+    Exposes serve_forever/shutdown/server_close like HTTPServer, so it can be used with serve().
+    """
+    executor: ThreadPoolExecutor
+    __connections: set[asyncio.Task]
+    __idle: set[asyncio.Task]
+
+    def __init__(self, server_address, handler: Type[AsyncRequestHandler], workers: int):
+        self.server_address = server_address
+        self.RequestHandlerClass = handler
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='Worker')
+        # Seconds a keep-alive connection can wait for it's next request
+        self.timeout = float(value('server.timeout', '15'))
+        self.__connections = set()
+        self.__idle = set()
+        self.__stopping = False
+        self.__stopped = threading.Event()
+
+    def serve_forever(self):
+        self.__stopped.clear()
+        try:
+            asyncio.run(self.__serve())
+        finally:
+            self.__stopped.set()
+
+    async def __serve(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__stop = asyncio.Event()
+        host, port = self.server_address
+        server = await asyncio.start_server(
+            self.__handle_connection, host or None, port, backlog=1024, reuse_address=True)
+        async with server:
+            await self.__stop.wait()
+            # Stop accepting, close idle connections and let busy ones finish their request.
+            server.close()
+            self.__stopping = True
+            for task in self.__idle:
+                task.cancel()
+            if self.__connections:
+                await asyncio.wait(self.__connections)
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.__connections.add(task)
+        client_address = writer.get_extra_info('peername')
+        served = 0
+        handler = None
+        try:
+            while not self.__stopping:
+                self.__idle.add(task)
+                try:
+                    raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, TimeoutError):
+                    break
+                finally:
+                    self.__idle.discard(task)
+                requestline, _, headers = raw.partition(b"\r\n")
+                handler = self.RequestHandlerClass(
+                    requestline + b"\r\n", headers, client_address, self)
+                served += 1
+                handler.requests_served = served
+                keep_alive = await handler.handle_async(reader, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            logger.exception(f"Request from {client_address} failed")
+            if handler is not None and handler.status is None:
+                # Nothing was sent yet, the client gets an answer instead of a dropped connection
+                try:
+                    writer.write(b"HTTP/1.1 500 Internal Server Error\r\n"
+                                 b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+        finally:
+            self.__connections.discard(task)
+            writer.close()
+
+    def shutdown(self):
+        self.__loop.call_soon_threadsafe(self.__stop.set)
+        self.__stopped.wait()
+
+    def server_close(self):
+        self.executor.shutdown(wait=True)
+
+
+def serve(server: HTTPServer):
+    """
+    Runs the server until SIGTERM/SIGINT, then stops accepting and drains in-flight requests.
+    """
+    def stop(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, shutting down")
+        # shutdown() blocks until serve_forever() returns, so it can't run on this thread.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if not isinstance(server, PreforkHTTPServer):
+        # The prefork parent doesn't serve, each worker runs them in it's own serve()
+        run_startup_hooks()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        run_shutdown_hooks()
+        logger.info("Server stopped")
+
+
+def create_server(server_address, handler: Type[BaseHTTPRequestHandler]):
+    mode = value('server.mode', 'threaded').lower()
+    workers = int(value('server.workers', str(os.cpu_count() or 1)))
+    logger.info(f"Server mode \"{mode}\" with {workers} workers")
+    match mode:
+        case 'single':
+            return HTTPServer(server_address, handler)
+        case 'threaded':
+            return ThreadPoolHTTPServer(server_address, handler, workers)
+        case 'prefork':
+            return PreforkHTTPServer(server_address, handler, workers)
+        case 'async':
+            return AsyncHTTPServer(server_address, AsyncRequestHandler, workers)
+        case _:
+            raise InvalidServerModeException(mode)
@@ -1,8 +1,16 @@
 import logging
-from util import ProviderRegistry
+from util import PasswordEncoder, ProviderRegistry
 from .auth import *
+from .revocation import *
+from .results import *
+from .analytics import *
 
 
 def load_services():
     providerRegistry = ProviderRegistry()
+    # One for the process, it holds the hashing pool
+    password_encoder = create_password_encoder()
+    providerRegistry.register_provider(PasswordEncoder, lambda: password_encoder)
     providerRegistry.register_provider_for_context(AuthService, lambda _: AuthService())
+    providerRegistry.register_provider_for_context(ResultService, lambda _: ResultService())
+    providerRegistry.register_provider_for_context(AnalyticsService, lambda _: AnalyticsService())
@@ -0,0 +1,393 @@
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from itertools import compress
+import logging
+import math
+import threading
+from typing import Any, Optional
+from model import Question, QuestionType
+from repository import ResultRepository
+from util import context_scoped, get_context, singleton, value
+from .results import SurveyNotFoundException
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('Analytics')
+
+SINGLE_SELECT = {QuestionType.RATIO_SELECT, QuestionType.MENU_SELECT}
+MULTI_SELECT = {QuestionType.CHECKBOX, QuestionType.MULTI_MENU_SELECT}
+NUMERIC = {QuestionType.NUMBER, QuestionType.PERCENTAGE, QuestionType.SLIDE}
+
+# Code of an unanswered single selection
+MISSING = 255
+LOAD_PAGE_SIZE = 5000
+
+
+class InvalidQueryException(Exception):
+    def __init__(self, cause: str):
+        super().__init__(cause)
+
+
+class QuestionNotFoundException(Exception):
+    def __init__(self, survey_id: int, question_id: int):
+        super().__init__(
+            f"Question {question_id} isn't part of survey {survey_id}")
+
+
+# Masks are bytearrays of 0/1, one byte per result. Read as a big integer,
+# combining two of them is a single C level operation.
+
+def mask_and(a: bytearray, b: bytearray) -> bytearray:
+    return bytearray((int.from_bytes(a, 'little') & int.from_bytes(b, 'little')).to_bytes(len(a), 'little'))
+
+
+def mask_or(a: bytearray, b: bytearray) -> bytearray:
+    return bytearray((int.from_bytes(a, 'little') | int.from_bytes(b, 'little')).to_bytes(len(a), 'little'))
+
+
+def mask_count(mask: bytearray) -> int:
+    return int.from_bytes(mask, 'little').bit_count()
+
+
+def range_mask(values: array, low: float, high: float) -> bytearray:
+    """Results with low <= value <= high, NaN (unanswered) never matches."""
+    if numpy is not None:
+        data = numpy.frombuffer(values, dtype=numpy.float64)
+        return bytearray(((data >= low) & (data <= high)).astype(numpy.uint8).tobytes())
+    return bytearray(low <= v <= high for v in values)
+
+
+def percentile(ordered: list[float], p: float) -> Optional[float]:
+    """Linear interpolation between the closest ranks, like numpy's default."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * p / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Column(ABC):
+    question: Question
+
+    def __init__(self, question: Question):
+        self.question = question
+
+    @abstractmethod
+    def append_missing(self):
+        pass
+
+    @abstractmethod
+    def set(self, row: int, answer_id: Optional[int], answer: Any):
+        pass
+
+
+class SelectionColumn(Column):
+    """Options dictionary encoded, code i is the i-th answer by Answer.order."""
+    labels: list[dict[str, Any]]
+
+    def __init__(self, question: Question):
+        super().__init__(question)
+        answers = sorted(question.answers or [], key=lambda a: a.order)
+        self.labels = [{"answer_id": a.id, "name": a.name} for a in answers]
+        self.codes = {a.id: code for code, a in enumerate(answers)}
+
+    def code(self, answer_id: int) -> int:
+        if answer_id not in self.codes:
+            raise InvalidQueryException(
+                f"Answer {answer_id} isn't an option of question {self.question.id}")
+        return self.codes[answer_id]
+
+    @abstractmethod
+    def option_mask(self, code: int) -> bytearray:
+        pass
+
+    @abstractmethod
+    def counts(self, mask: bytearray) -> list[int]:
+        pass
+
+    def select_mask(self, answer_ids: list[int]) -> bytearray:
+        codes = [self.code(answer_id) for answer_id in answer_ids]
+        mask = self.option_mask(codes[0])
+        for code in codes[1:]:
+            mask = mask_or(mask, self.option_mask(code))
+        return mask
+
+
+class SingleSelectionColumn(SelectionColumn):
+    values: array
+
+    def __init__(self, question: Question):
+        super().__init__(question)
+        # One byte per result while the options fit
+        self.values = array('B' if len(self.labels) < MISSING else 'H')
+        self.missing = MISSING if self.values.typecode == 'B' else 0xFFFF
+
+    def append_missing(self):
+        self.values.append(self.missing)
+
+    def set(self, row: int, answer_id: Optional[int], answer: Any):
+        code = self.codes.get(answer_id)
+        if code is not None:
+            self.values[row] = code
+
+    def option_mask(self, code: int) -> bytearray:
+        if self.values.typecode == 'B':
+            table = bytearray(256)
+            table[code] = 1
+            return bytearray(self.values.tobytes().translate(table))
+        return bytearray(v == code for v in self.values)
+
+    def counts(self, mask: bytearray) -> list[int]:
+        counter = Counter(compress(self.values, mask))
+        return [counter[code] for code in range(len(self.labels))]
+
+
+class MultiSelectionColumn(SelectionColumn):
+    """One 0/1 indicator per option, a result can pick many."""
+    indicators: list[bytearray]
+
+    def __init__(self, question: Question):
+        super().__init__(question)
+        self.indicators = [bytearray() for _ in self.labels]
+
+    def append_missing(self):
+        for indicator in self.indicators:
+            indicator.append(0)
+
+    def set(self, row: int, answer_id: Optional[int], answer: Any):
+        code = self.codes.get(answer_id)
+        if code is not None:
+            self.indicators[code][row] = 1
+
+    def option_mask(self, code: int) -> bytearray:
+        return self.indicators[code]
+
+    def counts(self, mask: bytearray) -> list[int]:
+        return [mask_count(mask_and(indicator, mask)) for indicator in self.indicators]
+
+
+class NumericColumn(Column):
+    values: array
+
+    def __init__(self, question: Question):
+        super().__init__(question)
+        self.values = array('d')
+
+    def append_missing(self):
+        self.values.append(math.nan)
+
+    def set(self, row: int, answer_id: Optional[int], answer: Any):
+        if answer is not None:
+            self.values[row] = answer
+
+    def selected(self, mask: bytearray) -> list[float]:
+        """Answered values of the masked results, sorted."""
+        if numpy is not None:
+            data = numpy.frombuffer(self.values, dtype=numpy.float64)[
+                numpy.frombuffer(mask, dtype=numpy.bool_)]
+            return numpy.sort(data[~numpy.isnan(data)]).tolist()
+        return sorted(v for v in compress(self.values, mask) if v == v)
+
+
+class ColumnSet:
+    """The results of a survey, a column per question and a row per result."""
+    survey_id: int
+    version: Optional[int]
+    size: int
+    submitted: array
+    columns: dict[int, Column]
+
+    def __init__(self, survey_id: int, version: Optional[int], questions: dict[int, Question]):
+        self.survey_id = survey_id
+        self.version = version
+        self.size = 0
+        self.submitted = array('d')
+        self.columns = dict()
+        # Questions without a column, like TEXT ones
+        self.unaggregated = dict[int, QuestionType]()
+        for question in questions.values():
+            if question.type in SINGLE_SELECT:
+                self.columns[question.id] = SingleSelectionColumn(question)
+            elif question.type in MULTI_SELECT:
+                self.columns[question.id] = MultiSelectionColumn(question)
+            elif question.type in NUMERIC:
+                self.columns[question.id] = NumericColumn(question)
+            else:
+                # Free text isn't aggregated
+                self.unaggregated[question.id] = question.type
+
+    def load(self, pages):
+        last_result = None
+        for rows in pages:
+            for result_id, submitted_date, question_id, answer_id, answer in rows:
+                if result_id != last_result:
+                    last_result = result_id
+                    self.size += 1
+                    self.submitted.append(datetime.fromisoformat(
+                        submitted_date).replace(tzinfo=timezone.utc).timestamp())
+                    for column in self.columns.values():
+                        column.append_missing()
+                column = self.columns.get(question_id)
+                if column is not None:
+                    column.set(self.size - 1, answer_id, answer)
+
+    def column(self, question_id: int) -> Column:
+        column = self.columns.get(question_id)
+        if column is None:
+            if question_id in self.unaggregated:
+                kind = self.unaggregated[question_id].name
+                raise InvalidQueryException(
+                    f"Question {question_id} is {kind}, {kind} questions have no column analytics")
+            raise QuestionNotFoundException(self.survey_id, question_id)
+        return column
+
+    def all(self) -> bytearray:
+        return bytearray(b'\x01') * self.size
+
+    def memory(self) -> int:
+        """Approximate bytes held by the columns."""
+        total = len(self.submitted) * self.submitted.itemsize
+        for column in self.columns.values():
+            if isinstance(column, MultiSelectionColumn):
+                total += sum(len(i) for i in column.indicators)
+            else:
+                total += len(column.values) * column.values.itemsize
+        return total
+
+
+@singleton
+class ColumnCache:
+    """
+    LRU of loaded ColumnSets, analytics.cache_size surveys at most.\n
+    Entries carry the latest result id of their survey when loaded, once new results
+    are written (by any process) the id changes and the entry is dropped on lookup.
+    """
+    __entries: OrderedDict[int, ColumnSet]
+
+    def __init__(self):
+        self.size = int(value('analytics.cache_size', '8'))
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, survey_id: int, version: Optional[int]) -> Optional[ColumnSet]:
+        with self.__lock:
+            columns = self.__entries.get(survey_id)
+            if columns is None:
+                return None
+            if columns.version != version:
+                del self.__entries[survey_id]
+                return None
+            self.__entries.move_to_end(survey_id)
+            return columns
+
+    def put(self, columns: ColumnSet):
+        with self.__lock:
+            self.__entries[columns.survey_id] = columns
+            self.__entries.move_to_end(columns.survey_id)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+
+
+@context_scoped
+class AnalyticsService:
+    """
+    Cross tabulations, percentiles and filtered distributions over a survey's results,
+    computed on columns instead of rows.\n
+    Filters are "question:answer_id[|answer_id...]" for selections and "question:min..max"
+    for numbers (either bound can be left out), results must match all of them.
+    """
+
+    def columns(self, survey_id: int) -> ColumnSet:
+        repository = get_context(self).get_instance(ResultRepository)
+        version = repository.last_result_id(survey_id)
+        cache = ColumnCache()
+        columns = cache.get(survey_id, version)
+        if columns is not None:
+            return columns
+        questions = repository.get_survey_questions(survey_id)
+        if questions is None:
+            raise SurveyNotFoundException(survey_id)
+        columns = ColumnSet(survey_id, version, questions)
+        columns.load(repository.iter_answer_rows(
+            survey_id, LOAD_PAGE_SIZE))
+        if logger.isEnabledFor(logging.DEBUG):
+            # memory() walks every column
+            logger.debug("Loaded %d results of survey %s (%d bytes)",
+                         columns.size, survey_id, columns.memory())
+        cache.put(columns)
+        return columns
+
+    def filter(self, columns: ColumnSet, filters: list[str],
+               since: Optional[datetime] = None, until: Optional[datetime] = None) -> bytearray:
+        mask = columns.all()
+        if since is not None or until is not None:
+            mask = mask_and(mask, range_mask(
+                columns.submitted,
+                since.timestamp() if since is not None else -math.inf,
+                until.timestamp() if until is not None else math.inf))
+        for expression in filters:
+            mask = mask_and(mask, self.__filter(columns, expression))
+        return mask
+
+    def __filter(self, columns: ColumnSet, expression: str) -> bytearray:
+        question, _, condition = expression.partition(":")
+        try:
+            column = columns.column(int(question))
+            if isinstance(column, NumericColumn):
+                low, separator, high = condition.partition("..")
+                if not separator:
+                    low = high = condition
+                return range_mask(column.values,
+                                  float(low) if low else -math.inf,
+                                  float(high) if high else math.inf)
+            return column.select_mask([int(a) for a in condition.split("|")])
+        except ValueError:
+            raise InvalidQueryException(f"Invalid filter \"{expression}\"")
+
+    def distribution(self, survey_id: int, question_id: int, filters: list[str], percentiles: list[float],
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> dict[str, Any]:
+        """Option counts of a selection, or summary and percentiles of a number."""
+        columns = self.columns(survey_id)
+        column = columns.column(question_id)
+        mask = self.filter(columns, filters, since, until)
+        result = {"question": question_id, "results": mask_count(mask)}
+        if isinstance(column, SelectionColumn):
+            result["options"] = [{**label, "count": count}
+                                 for label, count in zip(column.labels, column.counts(mask))]
+            return result
+        values = column.selected(mask)
+        count = len(values)
+        mean = math.fsum(values) / count if count else None
+        result["numeric"] = {
+            "count": count,
+            "mean": mean,
+            "stddev": math.sqrt(math.fsum((v - mean) ** 2 for v in values) / count) if count else None,
+            "min": values[0] if count else None,
+            "max": values[-1] if count else None,
+        }
+        result["percentiles"] = {format(p, 'g'): percentile(values, p)
+                                 for p in percentiles}
+        return result
+
+    def crosstab(self, survey_id: int, rows: int, cols: int, filters: list[str],
+                 since: Optional[datetime] = None, until: Optional[datetime] = None) -> dict[str, Any]:
+        """Counts of every pair of options of two selection questions."""
+        columns = self.columns(survey_id)
+        row_column, col_column = columns.column(rows), columns.column(cols)
+        if not isinstance(row_column, SelectionColumn) or not isinstance(col_column, SelectionColumn):
+            raise InvalidQueryException(
+                "Cross tabulations need two selection questions")
+        mask = self.filter(columns, filters, since, until)
+        return {
+            "rows": {"question": rows, "options": row_column.labels},
+            "columns": {"question": cols, "options": col_column.labels},
+            "results": mask_count(mask),
+            "counts": [col_column.counts(mask_and(mask, row_column.option_mask(code)))
+                       for code in range(len(row_column.labels))],
+        }
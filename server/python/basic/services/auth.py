@@ -1,8 +1,16 @@
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime
+from functools import cache
+import math
+import secrets
+import threading
+from typing import Any, Optional
 from repository import UserRepository
-from .jwt import DecodedJWT, JWTService
-from util import context_scoped, get_context, PasswordEncoder, inject, value
+from .jwt import DecodedJWT, JWTException, JWTService
+from .revocation import RevocationList
+from util import (context_scoped, DelegatingPasswordEncoder, get_context, inject, on_change, PasswordEncoder,
+                  Pbkdf2PasswordEncoder, PooledPasswordEncoder, ScryptPasswordEncoder, singleton, TokenBucketLimiter, value)
 from model import User
 
 
@@ -14,10 +22,44 @@ class AuthException(Exception):
         super().__init__(cause)
 
 
+class ThrottledException(AuthException):
+    retry_after: float
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too many attempts.")
+        self.retry_after = retry_after
+
+
 ACCESS_EXPIRATION = int(value('jwt.access_expiration', '1800'))
 EXPIRATION_EXPIRATION = int(value('jwt.refresh_expiration', '1800'))
 
 
+def create_password_encoder() -> PasswordEncoder:
+    """
+    New passwords use auth.password.algorithm (scrypt or pbkdf2) with it's configured cost,
+    hashes of the other one and MD5 ones still verify and are rehashed on login.
+    """
+    scrypt = ScryptPasswordEncoder(int(value('auth.password.scrypt.ln', '14')),
+                                   int(value('auth.password.scrypt.r', '8')),
+                                   int(value('auth.password.scrypt.p', '1')))
+    pbkdf2 = Pbkdf2PasswordEncoder(
+        int(value('auth.password.pbkdf2.iterations', '600000')))
+    match value('auth.password.algorithm', 'scrypt'):
+        case 'scrypt':
+            encoder = DelegatingPasswordEncoder(scrypt, pbkdf2)
+        case 'pbkdf2':
+            encoder = DelegatingPasswordEncoder(pbkdf2, scrypt)
+        case algorithm:
+            raise ValueError(f"Unknown password algorithm \"{algorithm}\"")
+    return PooledPasswordEncoder(encoder, int(value('auth.password.workers', '2')))
+
+
+@cache
+def unknown_user_hash(encoder: PasswordEncoder) -> str:
+    """Checked for usernames that don't exist, so they take as long as a wrong password."""
+    return encoder.encode(secrets.token_urlsafe())
+
+
 @dataclass
 class UserSubject:
     id: int
@@ -25,6 +67,103 @@ class UserSubject:
     name: str
 
 
+@singleton
+class UserCache:
+    """
+    Users by username for logins, LRU of auth.user_cache_size.
+
+    A user is dropped once a change of it is committed, notify_change("user", username).
+    Unknown usernames aren't kept, the LoginThrottle bounds how often they reach the database.
+    """
+    __users: OrderedDict[str, User]
+
+    def __init__(self):
+        self.size = int(value('auth.user_cache_size', '10000'))
+        self.__users = OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        on_change(self.__changed)
+
+    def get(self, username: str) -> Optional[User]:
+        with self.__lock:
+            user = self.__users.get(username)
+            if user is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__users.move_to_end(username)
+            return user
+
+    def put(self, user: User):
+        with self.__lock:
+            self.__users[user.username] = user
+            self.__users.move_to_end(user.username)
+            if len(self.__users) > self.size:
+                self.__users.popitem(last=False)
+
+    def invalidate(self, username: str):
+        with self.__lock:
+            self.__users.pop(username, None)
+
+    def __changed(self, topic: str, key: Any):
+        if topic == "user":
+            self.invalidate(key)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self.__users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+@singleton
+class LoginThrottle:
+    """
+    Token buckets of login attempts per username and per IP, in memory of each process.
+
+    A flood is rejected before it's password is hashed or the database is queried.
+    """
+
+    def __init__(self):
+        self.by_username = TokenBucketLimiter(
+            float(value('auth.throttle.username.burst', '5')),
+            float(value('auth.throttle.username.per_minute', '10')) / 60)
+        self.by_ip = TokenBucketLimiter(
+            float(value('auth.throttle.ip.burst', '20')),
+            float(value('auth.throttle.ip.per_minute', '60')) / 60)
+        self.__lock = threading.Lock()
+        self.throttled_usernames = 0
+        self.throttled_ips = 0
+
+    def check(self, username: str, ip: Optional[str]):
+        """Takes an attempt of both, raises ThrottledException when either has none left."""
+        # The IP first, a throttled client doesn't use up the attempts of the users it tries
+        wait = 0.0 if ip is None else self.by_ip.acquire(ip)
+        if wait:
+            with self.__lock:
+                self.throttled_ips += 1
+            raise ThrottledException(wait)
+        wait = self.by_username.acquire(username)
+        if wait:
+            with self.__lock:
+                self.throttled_usernames += 1
+            raise ThrottledException(wait)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.__lock:
+            return {
+                "throttled_usernames": self.throttled_usernames,
+                "throttled_ips": self.throttled_ips,
+                "usernames": len(self.by_username),
+                "ips": len(self.by_ip),
+            }
+
+
 @context_scoped
 class AuthService:
     password_encoder: PasswordEncoder
@@ -33,37 +172,82 @@ class AuthService:
     def __init__(self):
         self.password_encoder = inject(PasswordEncoder)
         self.jwt_service = inject(JWTService)
+        self.user_cache = inject(UserCache)
+        self.throttle = inject(LoginThrottle)
+        self.revocations = inject(RevocationList)
 
-    def authenticate(self, username: str, password: str) -> User:
-        userRepository = get_context(self).get_instance(UserRepository)
-        user = userRepository.get_user_by_username_and_password(
-            username, self.password_encoder.encode(password))
+    def authenticate(self, username: str, password: str, ip: Optional[str] = None) -> User:
+        """
+        ThrottledException when there were too many attempts for the username or from the ip.
+        A password hashed with an older algorithm or cost is hashed again once it matches.
+        """
+        self.throttle.check(username, ip)
+        user = self.user_cache.get(username)
         if user is None:
+            user = get_context(self).get_instance(
+                UserRepository).get_user_by_username(username)
+            if user is not None:
+                self.user_cache.put(user)
+        if user is None:
+            self.password_encoder.matches(
+                password, unknown_user_hash(self.password_encoder))
+            raise AuthException("Wrong credentials.")
+        if not self.password_encoder.matches(password, user.password):
             raise AuthException("Wrong credentials.")
+        if self.password_encoder.needs_rehash(user.password):
+            get_context(self).get_instance(UserRepository).update_password(
+                user, self.password_encoder.encode(password))
         return user
 
     def generate_jwt_token(self, user: User, include_refresh: bool = True):
-        subject = UserSubject(user.id, user.role.name, user.name)
-        now = int(datetime.now().timestamp())
+        return self.__tokens(UserSubject(user.id, user.role.name, user.name), include_refresh)
+
+    def __tokens(self, subject: UserSubject, include_refresh: bool):
+        issued = datetime.now().timestamp()
+        now = int(issued)
+        # With milliseconds, a user revoked in the same second doesn't lose tokens issued after it
+        issued = math.floor(issued * 1000) / 1000
         # Access Token
         access = DecodedJWT()
         access.set_content_type("access")
         access.set_subject(subject)
-        access.set_issued_at(now)
+        access.set_issued_at(issued)
         access.set_expiration_time(now+ACCESS_EXPIRATION)
+        access.set_jwt_id(secrets.token_urlsafe(12))
         access = self.jwt_service.encode(access)
         ans = {"accessToken": access}
         if include_refresh:
-            # Refresh Token
+            # Refresh Token, with the subject so refreshing doesn't need the user
             refresh = DecodedJWT()
             refresh.set_content_type("refresh")
-            refresh.set_subject(user.id)  # Only the user ID
-            refresh.set_issued_at(now)
+            refresh.set_subject(subject)
+            refresh.set_issued_at(issued)
             refresh.set_expiration_time(now+EXPIRATION_EXPIRATION)
+            refresh.set_jwt_id(secrets.token_urlsafe(12))
             refresh = self.jwt_service.encode(refresh)
             ans['refreshToken'] = refresh
         ans['expiration'] = ACCESS_EXPIRATION
         return ans
 
+    def decode_refresh(self, token: str) -> DecodedJWT:
+        """The refresh token if it's valid and not revoked, AuthException otherwise."""
+        try:
+            decoded = self.jwt_service.decode(token)
+        except JWTException as e:
+            raise AuthException(str(e))
+        if decoded._header.get("cty") != "refresh" or not isinstance(decoded._payload.get("sub"), dict):
+            raise AuthException("Expected a refresh token")
+        if self.revocations.is_revoked(decoded):
+            raise AuthException("Revoked JWT")
+        return decoded
+
+    def refresh(self, token: str):
+        """A new access token from a refresh token, without the database or the password."""
+        try:
+            subject = UserSubject(**self.decode_refresh(token).get_subject())
+        except TypeError:
+            raise AuthException("Invalid JWT")
+        return self.__tokens(subject, include_refresh=False)
+
     def register_user(self, user: User) -> User:
         pass
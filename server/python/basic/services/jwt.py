@@ -1,11 +1,15 @@
 import base64
+import binascii
+from collections import OrderedDict
 from datetime import datetime
 import hashlib
 import hmac
 import json
+import threading
+import time
 from typing import Any, Optional, Union
 
-from util import to_json, value
+from util import dumps, singleton, value
 
 
 class JWTException(Exception):
@@ -23,6 +27,11 @@ class ExpiredJWTException(JWTException):
         super().__init__("Expired JWT")
 
 
+class NotYetValidJWTException(JWTException):
+    def __init__(self):
+        super().__init__("JWT not valid yet")
+
+
 type JWTDateTime = Union[datetime, int]
 
 
@@ -30,7 +39,7 @@ class DecodedJWT:
     _header: dict[str, str]
     _payload: dict[str, Any]
 
-    def __init__(self, payload: dict[str, Any] = dict(), header: Optional[dict[str, str]] = None):
+    def __init__(self, payload: Optional[dict[str, Any]] = None, header: Optional[dict[str, str]] = None):
         super().__init__()
         # All JWT will be of algoritm HS256
         if header is None:
@@ -40,7 +49,7 @@ class DecodedJWT:
             }
         else:
             self._header = header
-        self._payload = payload
+        self._payload = dict() if payload is None else payload
 
     def set_content_type(self, content_type: str):
         """Set Content Type of JWT"""
@@ -76,11 +85,10 @@ class DecodedJWT:
     def set_issued_at(self, date_time: JWTDateTime):
         self._payload["iat"] = self.__parse_datetime(date_time)
 
-    # This won't be used.
-    def set_jwt_id(self, id: int):
+    def set_jwt_id(self, id: str):
+        """Unique id of the token, what a revocation refers to."""
         self._payload["jti"] = id
 
-    # This won't be used.
     def get_jwt_id(self):
         return self._payload["jti"]
 
@@ -94,7 +102,7 @@ class DecodedJWT:
         return self._payload["aud"]
 
     def get_expiration_time(self):
-        self._payload["exp"]
+        return self._payload["exp"]
 
     def get_not_before(self,):
         return self._payload["nbf"]
@@ -103,36 +111,112 @@ class DecodedJWT:
         return self._payload["iat"]
 
 
+def b64decode(segment: str) -> bytes:
+    # Padding is stripped when encoding
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+@singleton
 class JWTService:
-    __secret: str = value('jwt.secret', 'SECRET')
+    """
+    HS256 tokens.\n
+    Verified tokens are cached until they expire (jwt.cache_size at most), a repeated
+    token is returned without checking the signature or parsing it again.
+    Decoded tokens are shared by the cache, they shouldn't be modified.
+    """
+    __cache: OrderedDict[str, tuple[DecodedJWT, float]]
+    # Encoded header segments, there's one per content type
+    __headers: dict[tuple[tuple[str, str], ...], str]
 
     def __init__(self):
-        pass
-
-    def __sign(self, encoded_header: str, encoded_payload: str):
-        return hmac.new(
-            bytes(self.__secret, 'utf-8'),
-            msg=bytes(encoded_header+"."+encoded_payload, 'utf-8'),
-            digestmod=hashlib.sha256
-        ).digest()
+        # The key is hashed into the HMAC state once, signing copies it
+        self.__hmac = hmac.new(
+            value('jwt.secret', 'SECRET').encode('utf-8'), digestmod=hashlib.sha256)
+        self.cache_size = int(value('jwt.cache_size', '10000'))
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__headers = dict()
+        for content_type in ("access", "refresh"):
+            jwt = DecodedJWT()
+            jwt.set_content_type(content_type)
+            self.__encoded_header(jwt._header)
+
+    def __encoded_header(self, header: dict[str, str]) -> str:
+        key = tuple(header.items())
+        encoded = self.__headers.get(key)
+        if encoded is None:
+            encoded = self.__headers[key] = base64.urlsafe_b64encode(
+                dumps(header)).decode('utf-8').rstrip("=")
+        return encoded
+
+    def __sign(self, encoded_header: str, encoded_payload: str) -> bytes:
+        mac = self.__hmac.copy()
+        mac.update(f"{encoded_header}.{encoded_payload}".encode('utf-8'))
+        return mac.digest()
 
     def encode(self, content: DecodedJWT) -> str:
-        header = base64.urlsafe_b64encode(
-            to_json(content._header).encode('utf-8')).decode('utf-8').rstrip("=")
+        header = self.__encoded_header(content._header)
         payload = base64.urlsafe_b64encode(
-            to_json(content._payload).encode('utf-8')).decode('utf-8').rstrip("=")
+            dumps(content._payload)).decode('utf-8').rstrip("=")
         signature = self.__sign(header, payload)
         signature = base64.urlsafe_b64encode(signature).decode('utf-8').rstrip("=")
         return f"{header}.{payload}.{signature}"
 
     def decode(self, jwt: str) -> DecodedJWT:
-        header, payload, signature = jwt.split(".")
-        if self.__sign(header, payload) != signature:
-            raise InvalidJWTException()
-        # Not need to decode header because it will be the same
-        payload = base64.urlsafe_b64decode(payload).decode("utf-8")
-
-        json.loads(payload)
-        decoded = DecodedJWT()
-        decoded._payload.update(payload)
+        now = time.time()
+        decoded = self.__cached(jwt, now)
+        if decoded is None:
+            decoded = self.__verify(jwt, now)
+            self.__store(jwt, decoded)
+        # Checked even when cached, it could have been stored before it's nbf
+        if "nbf" in decoded._payload and now < decoded._payload["nbf"]:
+            raise NotYetValidJWTException()
         return decoded
+
+    def __cached(self, jwt: str, now: float) -> Optional[DecodedJWT]:
+        with self.__lock:
+            cached = self.__cache.get(jwt)
+            if cached is None:
+                return None
+            decoded, expiration = cached
+            if now >= expiration:
+                del self.__cache[jwt]
+                return None
+            self.__cache.move_to_end(jwt)
+            return decoded
+
+    def __verify(self, jwt: str, now: float) -> DecodedJWT:
+        parts = jwt.split(".")
+        # Segments are unpadded, a padded one is a different token with the same signature
+        if len(parts) != 3 or "=" in jwt:
+            raise InvalidJWTException()
+        header, payload, signature = parts
+        try:
+            valid = hmac.compare_digest(
+                self.__sign(header, payload), b64decode(signature))
+            if not valid:
+                raise InvalidJWTException()
+            decoded_header = json.loads(b64decode(header))
+            decoded_payload = json.loads(b64decode(payload))
+        except (binascii.Error, ValueError):
+            # Broken base64, JSON or non ascii characters
+            raise InvalidJWTException()
+        if not isinstance(decoded_header, dict) or decoded_header.get("alg") != "HS256" \
+                or not isinstance(decoded_payload, dict):
+            raise InvalidJWTException()
+        for claim in ("exp", "nbf"):
+            if claim in decoded_payload and not isinstance(decoded_payload[claim], (int, float)):
+                raise InvalidJWTException()
+        if "exp" in decoded_payload and now >= decoded_payload["exp"]:
+            raise ExpiredJWTException()
+        return DecodedJWT(decoded_payload, decoded_header)
+
+    def __store(self, jwt: str, decoded: DecodedJWT):
+        # Tokens without exp are verified every time
+        if self.cache_size <= 0 or "exp" not in decoded._payload:
+            return
+        with self.__lock:
+            self.__cache[jwt] = (decoded, decoded._payload["exp"])
+            self.__cache.move_to_end(jwt)
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
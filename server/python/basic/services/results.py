@@ -0,0 +1,358 @@
+from concurrent.futures import Future
+import csv
+from datetime import datetime, timezone
+import io
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from typing import Any, Iterator, Optional
+from model import Answer, AttributeType, Question, QuestionType, Result, ResultAnswer, Survey
+from repository import AggregateRepository, DataSession, ResultRepository, SurveyRepository
+from util import Context, context_scoped, dumps, get_context, on_shutdown, singleton, value
+
+logger = logging.getLogger('Results')
+
+SINGLE_SELECT = {QuestionType.RATIO_SELECT, QuestionType.MENU_SELECT}
+MULTI_SELECT = {QuestionType.CHECKBOX, QuestionType.MULTI_MENU_SELECT}
+NUMERIC = {QuestionType.NUMBER, QuestionType.PERCENTAGE, QuestionType.SLIDE}
+
+# Rows fetched from the cursor for each chunk of an export
+EXPORT_PAGE_SIZE = int(value('results.export_page_size', '1000'))
+
+
+class ResultValidationException(Exception):
+    cause: str
+
+    def __init__(self, cause: str):
+        self.cause = cause
+        super().__init__(cause)
+
+
+class SurveyNotFoundException(Exception):
+    def __init__(self, survey_id: int):
+        super().__init__(f"Survey {survey_id} doesn't exist")
+
+
+class SurveyClosedException(Exception):
+    def __init__(self, survey_id: int):
+        super().__init__(f"Survey {survey_id} isn't accepting results")
+
+
+def is_open(survey: Survey, now: datetime) -> bool:
+    """Started by now and not ended, like SurveyRepository.open_surveys. Survey dates are naive UTC."""
+    now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    return survey.start_date is not None and survey.start_date <= now \
+        and (survey.end_date is None or survey.end_date > now)
+
+
+def parse_bound(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def numeric_range(question: Question) -> tuple[Optional[float], Optional[float]]:
+    """MIN_VALUE and MAX_VALUE of a question, None when it doesn't have them."""
+    low = high = None
+    for attribute in question.attributes:
+        match attribute.type:
+            case AttributeType.MIN_VALUE:
+                low = parse_bound(attribute.value)
+            case AttributeType.MAX_VALUE:
+                high = parse_bound(attribute.value)
+    return low, high
+
+
+@context_scoped
+class ResultService:
+    """
+    Builds Results from submitted questionnaires.\n
+    A submission looks like {"answers": [{"question": 1, "answer": ...}], "submitted_date": "..."},
+    where answer is an answer id for single selections, a list of them for multiple selections,
+    a number for NUMBER/PERCENTAGE/SLIDE and a string for TEXT.
+    """
+
+    def parse_results(self, survey_id: int, items: list[Any], ip: str) -> tuple[list[Result], list[dict[str, Any]]]:
+        """
+        Returns the valid results and an error for each invalid item, with it's index.
+        SurveyClosedException if the survey isn't open now.
+        """
+        survey = get_context(self).get_instance(SurveyRepository).get_survey(survey_id)
+        if survey is None:
+            raise SurveyNotFoundException(survey_id)
+        if not is_open(survey, datetime.now(timezone.utc)):
+            raise SurveyClosedException(survey_id)
+        repository = get_context(self).get_instance(ResultRepository)
+        questions = repository.get_survey_questions(survey_id)
+        if questions is None:
+            raise SurveyNotFoundException(survey_id)
+        results = list[Result]()
+        errors = list[dict[str, Any]]()
+        for index, item in enumerate(items):
+            try:
+                results.append(self.parse_result(
+                    survey_id, questions, item, ip))
+            except ResultValidationException as e:
+                errors.append({"index": index, "error": e.cause})
+        return results, errors
+
+    def parse_result(self, survey_id: int, questions: dict[int, Question], item: Any, ip: str) -> Result:
+        if isinstance(item, ResultValidationException):
+            # Already failed to parse, like a broken NDJSON line
+            raise item
+        if not isinstance(item, dict) or not isinstance(item.get("answers"), list):
+            raise ResultValidationException(
+                "Expected an object with a list of \"answers\"")
+        submitted = datetime.now(timezone.utc)
+        if item.get("submitted_date") is not None:
+            try:
+                submitted = datetime.fromisoformat(item["submitted_date"])
+            except (TypeError, ValueError):
+                raise ResultValidationException("Invalid \"submitted_date\"")
+            if submitted.tzinfo is not None:
+                submitted = submitted.astimezone(timezone.utc)
+        result = Result(None, survey_id, ip, submitted)
+        answered = set[int]()
+        for entry in item["answers"]:
+            if not isinstance(entry, dict) or "question" not in entry:
+                raise ResultValidationException(
+                    "Each answer should be {\"question\": id, \"answer\": ...}")
+            question_id = entry["question"]
+            # Unhashable ids ([1], {}) would fail the lookup, and the whole batch with it
+            if isinstance(question_id, bool) or not isinstance(question_id, int):
+                raise ResultValidationException(
+                    "\"question\" should be a question id")
+            question = questions.get(question_id)
+            if question is None:
+                raise ResultValidationException(
+                    f"Question {question_id} isn't part of survey {survey_id}")
+            if question.id in answered:
+                raise ResultValidationException(
+                    f"Question {question.id} answered more than once")
+            answered.add(question.id)
+            for answer in self.parse_answer(question, entry.get("answer")):
+                result.answers.append(ResultAnswer(question, answer))
+        return result
+
+    def parse_answer(self, question: Question, answer: Any) -> list[Answer | str | float]:
+        if answer is None:
+            return []
+        if question.type in SINGLE_SELECT:
+            return [self.find_answer(question, answer)]
+        if question.type in MULTI_SELECT:
+            if not isinstance(answer, list):
+                raise ResultValidationException(
+                    f"Question {question.id} expects a list of answer ids")
+            # Repeated ids count once
+            selected = {a.id: a for a in (
+                self.find_answer(question, answer_id) for answer_id in answer)}
+            return list(selected.values())
+        if question.type in NUMERIC:
+            if isinstance(answer, bool) or not isinstance(answer, (int, float)):
+                raise ResultValidationException(
+                    f"Question {question.id} expects a number")
+            try:
+                number = float(answer)
+            except OverflowError:
+                number = math.inf
+            # NaN and infinities can't be aggregated
+            if not math.isfinite(number):
+                raise ResultValidationException(
+                    f"Question {question.id} expects a finite number")
+            if question.type == QuestionType.PERCENTAGE and not 0 <= number <= 100:
+                raise ResultValidationException(
+                    f"Question {question.id} expects a percentage")
+            low, high = numeric_range(question)
+            if low is not None and number < low:
+                raise ResultValidationException(
+                    f"Question {question.id} expects a number of at least {low:g}")
+            if high is not None and number > high:
+                raise ResultValidationException(
+                    f"Question {question.id} expects a number of at most {high:g}")
+            return [number]
+        if not isinstance(answer, str):
+            raise ResultValidationException(
+                f"Question {question.id} expects a text")
+        return [answer]
+
+    def find_answer(self, question: Question, answer_id: Any) -> Answer:
+        for answer in question.answers or []:
+            if answer.id == answer_id:
+                return answer
+        raise ResultValidationException(
+            f"Answer {answer_id} isn't an option of question {question.id}")
+
+    def export(self, survey_id: int, format: str) -> Iterator[str | bytes]:
+        """
+        Results of a survey as "csv" (one line per answer) or "ndjson" (one line per result),
+        produced a page of rows at a time.
+        """
+        repository = get_context(self).get_instance(ResultRepository)
+        # Checked now, not once the response started
+        if repository.get_survey_questions(survey_id) is None:
+            raise SurveyNotFoundException(survey_id)
+        pages = repository.iter_result_answers(survey_id, EXPORT_PAGE_SIZE)
+        match format:
+            case "csv":
+                return self.__csv(pages)
+            case "ndjson":
+                return self.__ndjson(pages)
+            case _:
+                raise ResultValidationException(
+                    f"Unknown export format \"{format}\"")
+
+    def __csv(self, pages: Iterator[list[tuple]]) -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["result_id", "submitted_date", "ip",
+                        "question_id", "answer_id", "answer"])
+        yield buffer.getvalue()
+        for rows in pages:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+
+    def __ndjson(self, pages: Iterator[list[tuple]]) -> Iterator[bytes]:
+        # Answers of a result are consecutive rows, a result can span two pages.
+        current = None
+        for rows in pages:
+            lines = list[bytes]()
+            for result_id, submitted_date, ip, question_id, answer_id, answer in rows:
+                if current is None or current["id"] != result_id:
+                    if current is not None:
+                        lines.append(dumps(current) + b"\n")
+                    current = {"id": result_id, "submitted_date": submitted_date,
+                               "ip": ip, "answers": []}
+                current["answers"].append(
+                    {"question": question_id, "answer_id": answer_id, "answer": answer})
+            yield b"".join(lines)
+        if current is not None:
+            yield dumps(current) + b"\n"
+
+
+@singleton
+class ResultWriter:
+    """
+    Write-behind queue for results.\n
+    Submissions are coalesced and written in a single transaction (group commit)
+    every results.flush_ms, or earlier once results.batch_size answers are pending.
+    A submission that can't be written is logged and counted in failed, see snapshot.
+    """
+    __queue: queue.Queue[Optional[tuple[list[Result], Future]]]
+    __thread: Optional[threading.Thread]
+
+    def __init__(self):
+        self.flush_interval = float(value('results.flush_ms', '50')) / 1000
+        self.batch_size = int(value('results.batch_size', '1000'))
+        self.__queue = queue.Queue()
+        self.__thread = None
+        self.__lock = threading.Lock()
+        # Results, only counted by the writer thread
+        self.written = 0
+        self.failed = 0
+        os.register_at_fork(after_in_child=self.__after_fork)
+        on_shutdown(self.close)
+
+    def __after_fork(self):
+        # Threads don't survive a fork
+        self.__queue = queue.Queue()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def submit(self, results: list[Result]) -> Future[list[int]]:
+        """Queues results to be written, the future resolves to their ids once committed."""
+        future = Future()
+        if not results:
+            future.set_result([])
+            return future
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    target=self.__run, name='ResultWriter', daemon=True)
+                self.__thread.start()
+        self.__queue.put((results, future))
+        return future
+
+    def __run(self):
+        stop = False
+        while not stop:
+            item = self.__queue.get()
+            if item is None:
+                break
+            pending = [item]
+            rows = sum(len(r.answers) for r in item[0])
+            deadline = time.monotonic() + self.flush_interval
+            while rows < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.__queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                pending.append(item)
+                rows += sum(len(r.answers) for r in item[0])
+            self.__flush(pending)
+
+    def __flush(self, pending: list[tuple[list[Result], Future]]):
+        try:
+            ids = self.__write([r for results, _ in pending for r in results])
+        except Exception as e:
+            if len(pending) == 1:
+                results, future = pending[0]
+                logger.exception("Couldn't write %d results of survey %d",
+                                 len(results), results[0].survey_id)
+                self.failed += len(results)
+                future.set_exception(e)
+                return
+            # Don't let one submission fail the whole group
+            for item in pending:
+                self.__flush([item])
+            return
+        self.written += len(ids)
+        index = 0
+        for results, future in pending:
+            future.set_result(ids[index:index + len(results)])
+            index += len(results)
+
+    def __write(self, results: list[Result]) -> list[int]:
+        context = Context()
+        session = context.get_instance(DataSession)
+        try:
+            try:
+                ids = context.get_instance(
+                    ResultRepository).insert_results(results)
+                # Same transaction, aggregates never count uncommitted results
+                context.get_instance(AggregateRepository).add_results(results)
+            except Exception:
+                session.notifyError()
+                raise
+        finally:
+            # The retries in __flush hold the traceback, and so the session, it can't wait for __del__
+            session.close()
+        logger.debug("Wrote %d results", len(results))
+        return ids
+
+    def snapshot(self) -> dict[str, int]:
+        return {
+            "queued": self.__queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    def close(self):
+        """Writes whatever is still queued and stops the writer."""
+        with self.__lock:
+            thread = self.__thread
+            self.__thread = None
+        if thread is not None:
+            self.__queue.put(None)
+            thread.join()
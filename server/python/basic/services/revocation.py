@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional
+from repository import DataSession, RevocationRepository
+from util import Context, on_shutdown, on_startup, singleton, value
+from .jwt import DecodedJWT
+
+logger = logging.getLogger('Revocation')
+
+# Expired revocations are deleted from the database this often, in seconds
+PRUNE_INTERVAL = 3600
+
+
+def token_user_id(decoded: DecodedJWT) -> Optional[int]:
+    """Access tokens have the UserSubject, older refresh tokens only the id."""
+    subject = decoded._payload.get("sub")
+    return subject.get("id") if isinstance(subject, dict) else subject
+
+
+@singleton
+class RevocationList:
+    """
+    Revoked JWTs, by jti until they expire and by user (every token issued before a time).
+    Checking a token is two dict lookups.\n
+    A background thread writes new revocations to the database and reads back the ones of other
+    processes every jwt.revocation.sync_seconds, so with prefork a token revoked in a worker
+    is rejected by the others after that long at most.
+    The first sync runs when the server starts, not in the first check (on the event loop in async mode).
+    """
+    __tokens: dict[str, int]
+    __users: dict[int, float]
+    __thread: Optional[threading.Thread]
+
+    def __init__(self):
+        self.sync_interval = float(value('jwt.revocation.sync_seconds', '10'))
+        # Replaced as a whole by every sync, readers don't lock
+        self.__tokens = dict()
+        self.__users = dict()
+        # Not written to the database yet
+        self.__pending_tokens = dict[str, int]()
+        self.__pending_users = dict[int, float]()
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__next_prune = 0
+        os.register_at_fork(after_in_child=self.__after_fork)
+        on_startup(self.start)
+        on_shutdown(self.close)
+
+    def __after_fork(self):
+        # Threads don't survive a fork, the parent writes what it had pending
+        self.__pending_tokens = dict()
+        self.__pending_users = dict()
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__stop = threading.Event()
+
+    def start(self):
+        """Loads the revocations and starts syncing, checks do it themselves if it wasn't called."""
+        if self.__thread is not None:
+            return
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            # Loaded before the first check, a restart doesn't forget revocations
+            self.__sync()
+            self.__thread = threading.Thread(
+                target=self.__run, name='RevocationSync', daemon=True)
+            self.__thread.start()
+
+    def is_revoked(self, decoded: DecodedJWT) -> bool:
+        self.start()
+        jti = decoded._payload.get("jti")
+        if jti is not None and jti in self.__tokens:
+            return True
+        before = self.__users.get(token_user_id(decoded))
+        # Tokens have iat with milliseconds, older ones (whole seconds) issued in the second
+        # of the revocation are revoked even if they were issued just after it
+        return before is not None and decoded._payload.get("iat", 0) < before
+
+    def revoke(self, decoded: DecodedJWT):
+        """Until it expires, tokens without a jti can only be revoked by user."""
+        self.start()
+        jti = decoded._payload.get("jti")
+        if jti is None:
+            raise ValueError("The token doesn't have a jti")
+        expiration = int(decoded._payload.get("exp", time.time() + 365 * 24 * 3600))
+        with self.__lock:
+            self.__tokens[jti] = expiration
+            self.__pending_tokens[jti] = expiration
+
+    def revoke_user(self, user_id: int):
+        """Every token of the user issued before now."""
+        self.start()
+        before = time.time()
+        with self.__lock:
+            self.__users[user_id] = max(before, self.__users.get(user_id, 0))
+            self.__pending_users[user_id] = self.__users[user_id]
+
+    def __run(self):
+        while not self.__stop.wait(self.sync_interval):
+            with self.__lock:
+                self.__sync()
+
+    def __sync(self):
+        """Called with the lock held."""
+        tokens, users = self.__pending_tokens, self.__pending_users
+        now = int(time.time())
+        context = Context()
+        session = context.get_instance(DataSession)
+        try:
+            try:
+                repository = context.get_instance(RevocationRepository)
+                if tokens or users:
+                    repository.save(tokens, users)
+                if now >= self.__next_prune:
+                    repository.prune(now)
+                    self.__next_prune = now + PRUNE_INTERVAL
+                loaded_tokens, loaded_users = repository.load(now)
+            except Exception:
+                session.notifyError()
+                raise
+            finally:
+                session.close()
+        except Exception:
+            # Pending ones are kept for the next sync
+            logger.exception("Couldn't sync revoked tokens, retrying later")
+            return
+        self.__pending_tokens = dict()
+        self.__pending_users = dict()
+        self.__tokens = loaded_tokens
+        self.__users = loaded_users
+
+    def close(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            with self.__lock:
+                self.__sync()
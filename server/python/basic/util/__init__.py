@@ -7,6 +7,13 @@ from typing import List, Optional
 from .singleton import singleton
 from .injection import *
 from .hashing import *
+from .lifecycle import *
+from .logs import AccessLog, configure_logging
+from .events import *
+from .metrics import Metrics
+from .ratelimit import *
+from .serialization import *
+from .decoding import *
 
 import sys
 
@@ -34,7 +41,7 @@ type Property = Union[str, List[str]]
 class Properties:
     __cached: dict[str, Property] = dict()
     __listReader = re.compile(
-        r"^((?:[A-Za-z](?:\.(?=[^\=]))?)+(\[\d+\])?)=(.*)$")
+        r"^((?:\w(?:\.(?=[^\=]))?)+(\[\d+\])?)=(.*)$")
 
     def __init__(self):
         self.__loadFromFile()
@@ -78,4 +85,4 @@ def value(key: str, default: Optional[str] = None) -> Optional[Property]:
     return val
 
 def to_json(target: Any) -> str:
-    return json.dumps(target, default=lambda o: o.__dict__)
\ No newline at end of file
+    return dumps(target).decode('utf-8')
\ No newline at end of file
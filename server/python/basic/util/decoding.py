@@ -0,0 +1,239 @@
+"""
+Decoders from parsed JSON to typed objects, built once per class from it's annotations.\n
+A decoder checks the whole value in one pass: types, Enums (by name), ISO datetimes, lists, dicts,
+Optional and Unions, nested dataclasses, required and unknown fields. Every problem is reported
+with it's path, like "questions[0].type", up to MAX_ERRORS.
+"""
+from dataclasses import MISSING, dataclass, fields, is_dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+from functools import cache
+import types
+from typing import Any, Callable, Union, get_args, get_origin, get_type_hints
+
+MAX_ERRORS = 50
+
+
+class BodyValidationException(Exception):
+    errors: list[dict[str, str]]
+
+    def __init__(self, errors: list[dict[str, str]]):
+        super().__init__(f"{len(errors)} invalid fields")
+        self.errors = errors
+
+
+class _Invalid:
+    """Returned by a field decoder after adding it's error."""
+
+
+INVALID = _Invalid()
+
+# (value, path, errors) -> decoded value or INVALID
+type FieldDecoder = Callable[[Any, str, list[dict[str, str]]], Any]
+
+
+def _fail(errors: list[dict[str, str]], path: str, error: str) -> _Invalid:
+    if len(errors) < MAX_ERRORS:
+        errors.append({"field": path or "body", "error": error})
+    return INVALID
+
+
+def _child(path: str, name: str) -> str:
+    return f"{path}.{name}" if path else name
+
+
+@cache
+def decoder_for[T](cls: type[T]) -> Callable[[Any], T]:
+    """Decoder of cls, raises BodyValidationException. TypeError when cls has a type it can't decode."""
+    decode = _field_decoder(cls)
+
+    def decode_body(data: Any) -> T:
+        errors = list[dict[str, str]]()
+        value = decode(data, "", errors)
+        if errors:
+            raise BodyValidationException(errors)
+        return value
+    return decode_body
+
+
+@dataclass
+class _Forward:
+    """Stands for a dataclass while it's decoder is built, so recursive classes work."""
+    decode: FieldDecoder = None
+
+    def __call__(self, value, path, errors):
+        return self.decode(value, path, errors)
+
+
+# Field decoders by type, dataclasses reuse the ones of their field types
+__decoders: dict[Any, FieldDecoder] = dict()
+
+
+def _field_decoder(hint: Any) -> FieldDecoder:
+    try:
+        return __decoders[hint]
+    except KeyError:
+        pass
+    except TypeError:
+        # Unhashable annotations aren't cached
+        return _build(hint)
+    if is_dataclass(hint):
+        forward = __decoders[hint] = _Forward()
+        try:
+            forward.decode = decoder = _build(hint)
+        except TypeError:
+            del __decoders[hint]
+            raise
+    else:
+        decoder = _build(hint)
+    __decoders[hint] = decoder
+    return decoder
+
+
+def _build(hint: Any) -> FieldDecoder:
+    origin, args = get_origin(hint), get_args(hint)
+    if hint is Any or hint is object:
+        return lambda value, path, errors: value
+    if origin in (Union, types.UnionType):
+        return _union(args)
+    if origin is list or hint is list:
+        return _list(args[0] if args else Any)
+    if origin is dict or hint is dict:
+        return _dict(args[1] if len(args) == 2 else Any)
+    if is_dataclass(hint):
+        return _dataclass(hint)
+    if isinstance(hint, type):
+        if issubclass(hint, Enum):
+            return _enum(hint)
+        if issubclass(hint, bool):
+            return _simple(lambda v: isinstance(v, bool), "Expected true or false")
+        if issubclass(hint, int):
+            return _simple(lambda v: isinstance(v, int) and not isinstance(v, bool), "Expected an integer")
+        if issubclass(hint, float):
+            return _float
+        if issubclass(hint, str):
+            return _simple(lambda v: isinstance(v, str), "Expected a text")
+        if issubclass(hint, Decimal):
+            return _decimal
+        if issubclass(hint, datetime):
+            return _parsed(datetime.fromisoformat, "Expected an ISO 8601 datetime")
+        if issubclass(hint, date):
+            return _parsed(date.fromisoformat, "Expected an ISO 8601 date")
+    raise TypeError(f"Can't decode {hint!r} from JSON")
+
+
+def _simple(check: Callable[[Any], bool], error: str) -> FieldDecoder:
+    def decode(value, path, errors):
+        return value if check(value) else _fail(errors, path, error)
+    return decode
+
+
+def _float(value, path, errors):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return _fail(errors, path, "Expected a number")
+
+
+def _decimal(value, path, errors):
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        try:
+            return Decimal(str(value))
+        except InvalidOperation:
+            pass
+    return _fail(errors, path, "Expected a number")
+
+
+def _parsed(parse: Callable[[str], Any], error: str) -> FieldDecoder:
+    def decode(value, path, errors):
+        if isinstance(value, str):
+            try:
+                return parse(value)
+            except ValueError:
+                pass
+        return _fail(errors, path, error)
+    return decode
+
+
+def _enum(cls: type[Enum]) -> FieldDecoder:
+    members = cls.__members__
+    error = f"Expected one of {', '.join(members)}"
+
+    def decode(value, path, errors):
+        member = members.get(value) if isinstance(value, str) else None
+        return member if member is not None else _fail(errors, path, error)
+    return decode
+
+
+def _list(item_hint: Any) -> FieldDecoder:
+    decode_item = _field_decoder(item_hint)
+
+    def decode(value, path, errors):
+        if not isinstance(value, list):
+            return _fail(errors, path, "Expected a list")
+        return [decode_item(item, f"{path}[{index}]", errors) for index, item in enumerate(value)]
+    return decode
+
+
+def _dict(value_hint: Any) -> FieldDecoder:
+    decode_value = _field_decoder(value_hint)
+
+    def decode(value, path, errors):
+        if not isinstance(value, dict):
+            return _fail(errors, path, "Expected an object")
+        return {key: decode_value(item, _child(path, key), errors) for key, item in value.items()}
+    return decode
+
+
+def _union(args: tuple) -> FieldDecoder:
+    optional = type(None) in args
+    options = [_field_decoder(a) for a in args if a is not type(None)]
+    if len(options) == 1:
+        decode_option = options[0]
+
+        def decode_optional(value, path, errors):
+            return None if value is None else decode_option(value, path, errors)
+        return decode_optional
+    names = " or ".join(getattr(a, '__name__', str(a))
+                        for a in args if a is not type(None))
+
+    def decode(value, path, errors):
+        if value is None and optional:
+            return None
+        # First option that takes it, their errors are discarded
+        for option in options:
+            attempt = list[dict[str, str]]()
+            decoded = option(value, path, attempt)
+            if not attempt:
+                return decoded
+        return _fail(errors, path, f"Expected {names}")
+    return decode
+
+
+def _dataclass(cls: type) -> FieldDecoder:
+    hints = get_type_hints(cls)
+    decoders = list[tuple[str, FieldDecoder, bool]]()
+    for f in fields(cls):
+        if not f.init:
+            continue
+        required = f.default is MISSING and f.default_factory is MISSING
+        decoders.append((f.name, _field_decoder(hints[f.name]), required))
+    known = frozenset(name for name, _, _ in decoders)
+
+    def decode(value, path, errors):
+        if not isinstance(value, dict):
+            return _fail(errors, path, "Expected an object")
+        kwargs = dict[str, Any]()
+        for name, decode_field, required in decoders:
+            if name in value:
+                kwargs[name] = decode_field(value[name], _child(path, name), errors)
+            elif required:
+                _fail(errors, _child(path, name), "Missing")
+        if len(value) > len(kwargs):
+            for name in value.keys() - known:
+                _fail(errors, _child(path, str(name)), "Unknown field")
+        if errors:
+            # Not built, the body is rejected anyway
+            return INVALID
+        return cls(**kwargs)
+    return decode
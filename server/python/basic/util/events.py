@@ -0,0 +1,21 @@
+import logging
+from typing import Any, Callable
+
+logger = logging.getLogger('Events')
+
+__listeners: list[Callable[[str, Any], None]] = []
+
+
+def on_change(func: Callable[[str, Any], None]):
+    """Registers a function called with (topic, key) whenever stored data of the topic changes, like ("survey", 1)."""
+    __listeners.append(func)
+    return func
+
+
+def notify_change(topic: str, key: Any):
+    # Only this process hears it, other workers rely on their caches expiring
+    for func in __listeners:
+        try:
+            func(topic, key)
+        except Exception:
+            logger.exception(f"Change listener {func} failed")
@@ -1,14 +1,210 @@
 from abc import ABC, abstractmethod
+import base64
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from typing import Optional
+from .lifecycle import on_shutdown
+
+logger = logging.getLogger('Hashing')
 
 class PasswordEncoder(ABC):
     @abstractmethod
     def encode(self, pwd: str)->str:
         pass
 
+    def matches(self, pwd: str, encoded: str) -> bool:
+        """Constant time, so how much of it matched doesn't show in how long it takes."""
+        return hmac.compare_digest(self.encode(pwd).encode("utf-8"), encoded.encode("utf-8"))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        """True when encoded isn't what encode would give now, like a weaker algorithm or cost."""
+        return False
+
 class Md5PasswordEncoder(PasswordEncoder):
     def __init__(self):
         pass
 
     def encode(self, pwd: str)->str:
-        return hashlib.md5(pwd.encode("utf-8")).hexdigest()
\ No newline at end of file
+        return hashlib.md5(pwd.encode("utf-8")).hexdigest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def _parse(encoded: str) -> Optional[tuple[str, dict[str, int], bytes, bytes]]:
+    """$id$param=value,...$salt$hash into it's parts, None when it isn't that format."""
+    parts = encoded.split("$")
+    if len(parts) != 5 or parts[0]:
+        return None
+    _, id, params, salt, hash = parts
+    try:
+        return id, {k: int(v) for k, v in (p.split("=", 1) for p in params.split(","))}, \
+            _b64decode(salt), _b64decode(hash)
+    except ValueError:
+        return None
+
+
+class ScryptPasswordEncoder(PasswordEncoder):
+    """$scrypt$ln=14,r=8,p=1$salt$hash, N is 2^ln. Uses 128 * r * N bytes while hashing."""
+    ID = "scrypt"
+
+    def __init__(self, ln: int = 14, r: int = 8, p: int = 1):
+        self.ln = ln
+        self.r = r
+        self.p = p
+
+    def __hash(self, pwd: str, salt: bytes, ln: int, r: int, p: int, size: int) -> bytes:
+        n = 1 << ln
+        return hashlib.scrypt(pwd.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2) + 2**20, dklen=size)
+
+    def encode(self, pwd: str) -> str:
+        salt = os.urandom(16)
+        hash = self.__hash(pwd, salt, self.ln, self.r, self.p, 32)
+        return f"${self.ID}$ln={self.ln},r={self.r},p={self.p}${_b64encode(salt)}${_b64encode(hash)}"
+
+    def matches(self, pwd: str, encoded: str) -> bool:
+        parsed = _parse(encoded)
+        if parsed is None or parsed[0] != self.ID:
+            return False
+        _, params, salt, hash = parsed
+        try:
+            actual = self.__hash(pwd, salt, params["ln"], params["r"], params["p"], len(hash))
+        except (KeyError, ValueError):
+            return False
+        return hmac.compare_digest(actual, hash)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        parsed = _parse(encoded)
+        return parsed is None or parsed[0] != self.ID \
+            or parsed[1] != {"ln": self.ln, "r": self.r, "p": self.p}
+
+
+class Pbkdf2PasswordEncoder(PasswordEncoder):
+    """$pbkdf2-sha256$i=600000$salt$hash"""
+    ID = "pbkdf2-sha256"
+
+    def __init__(self, iterations: int = 600_000):
+        self.iterations = iterations
+
+    def encode(self, pwd: str) -> str:
+        salt = os.urandom(16)
+        hash = hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), salt, self.iterations)
+        return f"${self.ID}$i={self.iterations}${_b64encode(salt)}${_b64encode(hash)}"
+
+    def matches(self, pwd: str, encoded: str) -> bool:
+        parsed = _parse(encoded)
+        if parsed is None or parsed[0] != self.ID or "i" not in parsed[1]:
+            return False
+        _, params, salt, hash = parsed
+        actual = hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), salt, params["i"], len(hash))
+        return hmac.compare_digest(actual, hash)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        parsed = _parse(encoded)
+        return parsed is None or parsed[0] != self.ID or parsed[1] != {"i": self.iterations}
+
+
+class DelegatingPasswordEncoder(PasswordEncoder):
+    """
+    Encodes with default and verifies every format it knows, by the $id$ the hash starts with.
+    Hashes from before it (bare MD5 hex) are verified as MD5.
+    Anything not encoded by default, or with other parameters, needs a rehash.
+    """
+    LEGACY_MD5 = re.compile(r"^[0-9a-f]{32}$")
+
+    def __init__(self, default: PasswordEncoder, *others: PasswordEncoder):
+        self.default = default
+        self.encoders = {e.ID: e for e in (*others, default) if hasattr(e, "ID")}
+        self.md5 = Md5PasswordEncoder()
+
+    def __encoder_for(self, encoded: str) -> Optional[PasswordEncoder]:
+        if self.LEGACY_MD5.match(encoded):
+            return self.md5
+        parts = encoded.split("$", 2)
+        return self.encoders.get(parts[1]) if len(parts) == 3 and not parts[0] else None
+
+    def encode(self, pwd: str) -> str:
+        return self.default.encode(pwd)
+
+    def matches(self, pwd: str, encoded: str) -> bool:
+        encoder = self.__encoder_for(encoded)
+        return encoder is not None and encoder.matches(pwd, encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return self.__encoder_for(encoded) is not self.default or self.default.needs_rehash(encoded)
+
+
+class PooledPasswordEncoder(PasswordEncoder):
+    """
+    Runs encode and matches of another encoder in a pool of worker processes, so slow hashes
+    use other cores instead of holding the GIL of the process serving requests.\n
+    The pool starts with the first hash, from a forkserver so the workers don't copy a process
+    full of threads. Each process (like prefork workers) gets it's own pool.
+    With workers=0 hashes run in the calling thread.
+    """
+    __pool: Optional[ProcessPoolExecutor]
+
+    def __init__(self, encoder: PasswordEncoder, workers: int):
+        self.encoder = encoder
+        self.workers = workers
+        self.__pool = None
+        self.__lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.__after_fork)
+        on_shutdown(self.close)
+
+    def __after_fork(self):
+        # The pool belongs to the parent
+        self.__pool = None
+        self.__lock = threading.Lock()
+
+    def __executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("forkserver"))
+            return self.__pool
+
+    def __run(self, func, *args):
+        pool = self.__executor()
+        if pool is None:
+            return func(*args)
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            # A worker died, the next hash starts a new pool
+            logger.exception("Password hashing pool broke, restarting it")
+            with self.__lock:
+                if self.__pool is pool:
+                    self.__pool = None
+            return func(*args)
+
+    def encode(self, pwd: str) -> str:
+        return self.__run(self.encoder.encode, pwd)
+
+    def matches(self, pwd: str, encoded: str) -> bool:
+        return self.__run(self.encoder.matches, pwd, encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        # Only parses, not worth sending
+        return self.encoder.needs_rehash(encoded)
+
+    def close(self):
+        with self.__lock:
+            pool, self.__pool = self.__pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -1,5 +1,5 @@
 import inspect
-from typing import Any, Callable, Type, TypeVar
+from typing import Any, Callable, Optional, Type, TypeVar
 import logging
 from inspect import isabstract
 from .singleton import singleton
@@ -62,7 +62,7 @@ class ProviderRegistry:
         if not isabstract(target):
             raise InvalidClassForProviderException(target)
         typeRef = self.__solveClassForProvider(func)
-        logger.debug(f"Register provider for {target} with {typeRef}.")
+        logger.debug("Register provider for %s with %s.", target, typeRef)
         self.__provider[target] = func
 
     def register_provider_for_context(self, target: Type, func: Callable[[Any], Any]):
@@ -70,7 +70,7 @@ class ProviderRegistry:
             raise InvalidClassForProviderException(target)
         typeRef = self.__solveClassForProvider(func)
         logger.debug(
-            f"For contexts, register provider for {target} with {typeRef}.")
+            "For contexts, register provider for %s with %s.", target, typeRef)
         self.__providerForContext[target] = func
 
     def get(self, target: Type):
@@ -100,6 +100,16 @@ class Context:
             self._instances[target] = instance
         return self._instances[target]
 
+    def find_instance(self, target: Type[T]) -> Optional[T]:
+        """The instance of target if it was created or set, without creating it."""
+        return self._instances.get(target)
+
+    def set_instance(self, target: Type[T], instance: T):
+        """Adds an instance made outside the context, like the user of a request."""
+        if target in self._instances:
+            raise InstanceAlreadyExistsInContextException(self, target)
+        self._instances[target] = instance
+
 
 def inject(type: Type[T]) -> T:
     """Dependency injection where is applicable and isn't context_scoped.\n
@@ -0,0 +1,40 @@
+import logging
+from typing import Callable
+
+logger = logging.getLogger('Lifecycle')
+
+__startup_hooks: list[Callable[[], None]] = []
+__shutdown_hooks: list[Callable[[], None]] = []
+
+
+def on_startup(func: Callable[[], None]):
+    """
+    Registers a function to run before the server accepts requests, in every process serving them
+    (prefork workers run it after the fork). Work that would otherwise wait for the first request.
+    """
+    __startup_hooks.append(func)
+    return func
+
+
+def run_startup_hooks():
+    for func in __startup_hooks:
+        try:
+            func()
+        except Exception:
+            logger.exception(f"Startup hook {func} failed")
+
+
+def on_shutdown(func: Callable[[], None]):
+    """Registers a function to run after the server stops accepting and drained it's requests."""
+    __shutdown_hooks.append(func)
+    return func
+
+
+def run_shutdown_hooks():
+    # Last registered runs first, like atexit
+    while __shutdown_hooks:
+        func = __shutdown_hooks.pop()
+        try:
+            func()
+        except Exception:
+            logger.exception(f"Shutdown hook {func} failed")
@@ -0,0 +1,173 @@
+"""
+Logging levels from the properties, and the access log.\n
+The access log is JSON lines, one per request. Recording one only appends the raw values to a
+deque, without locks or formatting; a background thread turns them into JSON and writes them
+every log.access.flush_ms. When log.access.max_pending are waiting, new ones are dropped.
+Routes with a lot of traffic can be sampled, errors and slow requests are always logged.
+"""
+from collections import deque
+from datetime import datetime, timezone
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+from .lifecycle import on_shutdown
+from .serialization import dumps
+from .singleton import singleton
+
+FORMAT = '[%(name)s][%(levelname)s] - %(asctime)s: %(message)s'
+
+logger = logging.getLogger('AccessLog')
+
+
+def parse_levels(levels: str) -> dict[str, str]:
+    """Name:LEVEL,Name:LEVEL into {name: level}."""
+    parsed = dict[str, str]()
+    for entry in levels.split(","):
+        name, _, level = entry.strip().rpartition(":")
+        if name:
+            parsed[name] = level.upper()
+    return parsed
+
+
+def configure_logging():
+    """
+    Root level from log.level, and levels by logger from log.loggers, like "Repository:DEBUG".
+    Below the level, a logger.debug("%s", x) call returns before formatting anything.
+    """
+    from . import value
+    logging.basicConfig(format=FORMAT, level=value('log.level', 'INFO').upper())
+    for name, level in parse_levels(value('log.loggers', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def parse_rates(rates: str) -> dict[str, float]:
+    """route:rate,route:rate into {route: rate}, the rate goes after the last colon ({id:int})."""
+    parsed = dict[str, float]()
+    for entry in rates.split(","):
+        route, _, rate = entry.strip().rpartition(":")
+        if route:
+            parsed[route] = float(rate)
+    return parsed
+
+
+@singleton
+class AccessLog:
+    """
+    Requests as JSON lines, to log.access.file ("-" is stdout), opened for appending so prefork
+    workers can share it: each write is a whole batch of lines.\n
+    log.access.sample_rate applies to every route, log.access.sample overrides it by route template,
+    like "/metrics:0,/restapi/surveys/{survey_id:int}:0.1". Each line has the rate it was sampled at.
+    """
+    __pending: deque[tuple]
+    __thread: Optional[threading.Thread]
+
+    def __init__(self):
+        from . import value
+        self.enabled = value('log.access', 'true') == 'true'
+        self.file = value('log.access.file', '-')
+        self.flush_interval = float(value('log.access.flush_ms', '200')) / 1000
+        self.max_pending = int(value('log.access.max_pending', '100000'))
+        self.slow = float(value('log.access.slow_ms', '1000')) / 1000
+        self.sample_rate = float(value('log.access.sample_rate', '1'))
+        self.rates = parse_rates(value('log.access.sample', ''))
+        # Approximate, threads dropping at once can lose a count
+        self.dropped = 0
+        self.__reported_dropped = 0
+        self.__pending = deque()
+        self.__fd = None
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        os.register_at_fork(after_in_child=self.__after_fork)
+        on_shutdown(self.close)
+
+    def __after_fork(self):
+        # The parent writes what it had pending, the file stays open for appending
+        self.__pending = deque()
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+
+    def record(self, method: str, route: str, path: str, status: int, seconds: float,
+               bytes_in: int, bytes_out: int, client: str):
+        if not self.enabled:
+            return
+        rate = self.rates.get(route, self.sample_rate)
+        if rate < 1 and status < 400 and seconds < self.slow and random.random() >= rate:
+            return
+        if len(self.__pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        if self.__thread is None:
+            self.__start()
+        self.__pending.append((time.time(), method, route, path, status,
+                               seconds, bytes_in, bytes_out, client, rate))
+
+    def __start(self):
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__thread = threading.Thread(
+                target=self.__run, name='AccessLog', daemon=True)
+            self.__thread.start()
+
+    def __run(self):
+        while not self.__stop.wait(self.flush_interval):
+            self.flush()
+
+    def format(self, entry: tuple) -> bytes:
+        timestamp, method, route, path, status, seconds, bytes_in, bytes_out, client, rate = entry
+        return dumps({
+            "ts": datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='milliseconds'),
+            "method": method,
+            "route": route,
+            # Query strings can carry tokens
+            "path": path.partition("?")[0],
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "client": client,
+            "sample_rate": rate,
+        }) + b"\n"
+
+    def flush(self):
+        """Writes what's pending, called by the writer thread."""
+        pending = self.__pending
+        lines = list[bytes]()
+        while True:
+            try:
+                lines.append(self.format(pending.popleft()))
+            except IndexError:
+                break
+        if lines:
+            try:
+                self.__write(b"".join(lines))
+            except OSError:
+                logger.exception(f"Couldn't write {len(lines)} access log lines")
+        if self.dropped != self.__reported_dropped:
+            logger.warning(
+                "Dropped %d access log lines, more than %d were pending",
+                self.dropped - self.__reported_dropped, self.max_pending)
+            self.__reported_dropped = self.dropped
+
+    def __write(self, data: bytes):
+        if self.__fd is None:
+            self.__fd = 1 if self.file == '-' else \
+                os.open(self.file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.__fd, view):]
+
+    def close(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.flush()
+        if self.__fd is not None and self.__fd != 1:
+            os.close(self.__fd)
+        self.__fd = None
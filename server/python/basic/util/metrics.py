@@ -0,0 +1,172 @@
+"""
+Request and DataSession metrics, in the Prometheus text format.\n
+Every thread counts in it's own shard, without locks, and the shards are summed when scraped.
+Only the thread owning a shard writes it; the scrape copies the dicts and lists it reads,
+which the GIL makes atomic, so it never sees half of an update.
+With metrics.enabled=false nothing is recorded and /metrics isn't registered.
+"""
+from bisect import bisect_left
+import os
+import threading
+from typing import Iterable
+from .singleton import singleton
+
+# Upper bounds (le) of the latency histogram, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Positions in the lists of _Shard.requests, the bucket counts follow
+COUNT, SECONDS, BYTES_IN, BYTES_OUT, BUCKETS = range(5)
+OPENED, COMMITTED, ROLLED_BACK = range(3)
+
+
+class _Shard:
+    __slots__ = ("started", "finished", "requests", "sessions")
+
+    def __init__(self):
+        # In flight is started - finished of every shard, a request can end on another thread
+        self.started = 0
+        self.finished = 0
+        # (method, route, status) -> [count, seconds, bytes in, bytes out, *buckets (the last is +Inf)]
+        self.requests = dict[tuple[str, str, int], list]()
+        self.sessions = [0, 0, 0]
+
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+
+
+@singleton
+class Metrics:
+    """Counters of this process, rendered for /metrics."""
+    __shards: list[_Shard]
+
+    def __init__(self):
+        from . import value
+        self.enabled = value('metrics.enabled', 'true') == 'true'
+        self.__local = threading.local()
+        self.__shards = []
+        # Only taken by a thread's first record and by scrapes
+        self.__lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.__after_fork)
+
+    def __after_fork(self):
+        # Each prefork worker counts (and is scraped) on it's own
+        self.__local = threading.local()
+        self.__shards = []
+        self.__lock = threading.Lock()
+
+    def __shard(self) -> _Shard:
+        try:
+            return self.__local.shard
+        except AttributeError:
+            shard = self.__local.shard = _Shard()
+            with self.__lock:
+                self.__shards.append(shard)
+            return shard
+
+    def request_started(self):
+        if self.enabled:
+            self.__shard().started += 1
+
+    def request_finished(self, method: str, route: str, status: int, seconds: float, bytes_in: int, bytes_out: int):
+        if not self.enabled:
+            return
+        shard = self.__shard()
+        shard.finished += 1
+        key = (method, route, status)
+        counts = shard.requests.get(key)
+        if counts is None:
+            counts = shard.requests[key] = [0, 0.0, 0, 0] + [0] * (len(LATENCY_BUCKETS) + 1)
+        counts[COUNT] += 1
+        counts[SECONDS] += seconds
+        counts[BYTES_IN] += bytes_in
+        counts[BYTES_OUT] += bytes_out
+        counts[BUCKETS + bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def session_opened(self):
+        if self.enabled:
+            self.__shard().sessions[OPENED] += 1
+
+    def session_ended(self, committed: bool):
+        if self.enabled:
+            self.__shard().sessions[COMMITTED if committed else ROLLED_BACK] += 1
+
+    def __merged(self) -> tuple[int, dict[tuple[str, str, int], list], list[int]]:
+        with self.__lock:
+            shards = list(self.__shards)
+        in_flight = 0
+        requests = dict[tuple[str, str, int], list]()
+        sessions = [0, 0, 0]
+        for shard in shards:
+            # finished first, a request ending meanwhile can't make it negative
+            in_flight -= shard.finished
+            in_flight += shard.started
+            for key, counts in shard.requests.copy().items():
+                counts = list(counts)
+                merged = requests.get(key)
+                if merged is None:
+                    requests[key] = counts
+                else:
+                    for i, count in enumerate(counts):
+                        merged[i] += count
+            for i, count in enumerate(list(shard.sessions)):
+                sessions[i] += count
+        return max(in_flight, 0), requests, sessions
+
+    def render(self) -> str:
+        in_flight, requests, sessions = self.__merged()
+        lines = list[str]()
+
+        def family(name: str, type: str, help: str, samples: Iterable[tuple[str, str, float]]):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for suffix, labels, sample in samples:
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}{suffix}{labels} {sample}")
+
+        # Histograms and bytes by route, without the status
+        routes = dict[tuple[str, str], list]()
+        for (method, route, _), counts in requests.items():
+            merged = routes.get((method, route))
+            if merged is None:
+                routes[(method, route)] = list(counts)
+            else:
+                for i, count in enumerate(counts):
+                    merged[i] += count
+
+        family("http_requests_total", "counter",
+               "Requests by method, route and status (0 when no response was sent).",
+               (("", _labels(method=m, route=r, status=s), c[COUNT])
+                for (m, r, s), c in sorted(requests.items())))
+        family("http_requests_in_flight", "gauge", "Requests being handled.",
+               (("", "", in_flight),))
+
+        def histogram():
+            for (method, route), counts in sorted(routes.items()):
+                labels = _labels(method=method, route=route)
+                cumulative = 0
+                for le, count in zip((*LATENCY_BUCKETS, "+Inf"), counts[BUCKETS:]):
+                    cumulative += count
+                    yield "_bucket", f'{labels},le="{le}"', cumulative
+                yield "_sum", labels, counts[SECONDS]
+                yield "_count", labels, counts[COUNT]
+        family("http_request_duration_seconds", "histogram",
+               "Time from the request line read to the response written.", histogram())
+        family("http_request_body_bytes_total", "counter", "Request body bytes read.",
+               (("", _labels(method=m, route=r), c[BYTES_IN]) for (m, r), c in sorted(routes.items())))
+        family("http_response_bytes_total", "counter", "Response bytes written, headers included.",
+               (("", _labels(method=m, route=r), c[BYTES_OUT]) for (m, r), c in sorted(routes.items())))
+        family("datasessions_opened_total", "counter",
+               "DataSessions that got a connection.", (("", "", sessions[OPENED]),))
+        family("datasessions_committed_total", "counter",
+               "DataSessions ended with a commit.", (("", "", sessions[COMMITTED]),))
+        family("datasessions_rolled_back_total", "counter",
+               "DataSessions ended with a rollback, reads and errors.", (("", "", sessions[ROLLED_BACK]),))
+        lines.append("")
+        return "\n".join(lines)
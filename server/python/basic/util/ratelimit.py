@@ -0,0 +1,40 @@
+from collections import OrderedDict
+import threading
+import time
+from typing import Hashable, Optional
+
+
+class TokenBucketLimiter:
+    """
+    A token bucket per key, like an username or an IP.\n
+    Buckets hold up to capacity tokens and refill rate tokens per second, every attempt takes one.
+    At most max_keys buckets are kept, the least recently used go first, a dropped bucket comes back full.
+    """
+    __buckets: OrderedDict[Hashable, tuple[float, float]]
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = 100_000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        # (tokens, last refill) by key
+        self.__buckets = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def acquire(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Takes a token, returns 0 or the seconds until the bucket of key has one."""
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            tokens, last = self.__buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self.__buckets[key] = (tokens, now)
+            if len(self.__buckets) > self.max_keys:
+                self.__buckets.popitem(last=False)
+            return wait
+
+    def __len__(self) -> int:
+        return len(self.__buckets)
@@ -0,0 +1,220 @@
+"""
+JSON encoding straight to bytes, with orjson when it's installed (json.backend=auto) or the stdlib json.\n
+Dataclasses are encoded by an encoder generated once per class, Enums by name, datetimes
+with isoformat and Decimals as numbers. Other classes can get their own with register_encoder.
+Both backends give the same output: orjson would encode Enums outside dataclasses by value,
+so they are converted before it sees them (int and str ones, like HTTPStatus, stay by value
+as json encodes them), and NaN and infinities are null with both.
+"""
+from dataclasses import fields, is_dataclass
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from itertools import islice
+import json
+import logging
+import math
+import types
+from typing import Any, Callable, Optional, Union, get_args, get_origin, get_type_hints
+from .singleton import singleton
+
+logger = logging.getLogger('Serialization')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+type Encoder = Callable[[Any], Any]
+
+class _Encoders(dict[type, Encoder]):
+    """Encoders by exact type, made on first use."""
+
+    def __missing__(self, cls: type) -> Encoder:
+        encoder = self[cls] = _encoder_for(cls)
+        return encoder
+
+
+__encoders = _Encoders()
+
+
+def register_encoder(cls: type, encoder: Encoder):
+    """encoder returns something JSON can encode, it may contain other objects with encoders."""
+    __encoders[cls] = lambda o: _normalized(encoder(o))
+
+
+def to_jsonable(obj: Any) -> Any:
+    """The default hook of both backends, for objects they can't encode. Called for every one of them, keep it short."""
+    return __encoders[type(obj)](obj)
+
+
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+def _normalized(obj: Any) -> Any:
+    """
+    obj with Enums (values and keys) by name, int and str ones by value, and NaN and infinities as None, inside dicts, lists and tuples.
+    The same object when there's nothing to change, dataclasses and other objects are left
+    to the default hook, their encoders return it normalized (but for NaN, only the json backend needs it).
+    """
+    cls = type(obj)
+    if cls in _SCALARS:
+        return None if cls is float and not math.isfinite(obj) else obj
+    if isinstance(obj, Enum):
+        # json encodes int and str Enums (HTTPStatus) by value, without calling the default hook
+        return obj._value_ if isinstance(obj, (int, str)) else obj._name_
+    if isinstance(obj, dict):
+        changed = None
+        for i, (key, value) in enumerate(obj.items()):
+            new_key, new_value = _normalized(key), _normalized(value)
+            if changed is None and (new_key is not key or new_value is not value):
+                # Copied from the first change on
+                changed = dict(islice(obj.items(), i))
+            if changed is not None:
+                changed[new_key] = new_value
+        return obj if changed is None else changed
+    if isinstance(obj, (list, tuple)):
+        for i, item in enumerate(obj):
+            new_item = _normalized(item)
+            if new_item is not item:
+                return [*obj[:i], new_item, *map(_normalized, obj[i + 1:])]
+        return obj
+    return obj
+
+
+def _normalized_jsonable(obj: Any) -> Any:
+    return _normalized(to_jsonable(obj))
+
+
+def _encoder_for(cls: type) -> Encoder:
+    if is_dataclass(cls):
+        return _compile_dataclass(cls)
+    if issubclass(cls, Enum):
+        # _name_, name is a much slower descriptor
+        return lambda o: o._name_
+    if issubclass(cls, (datetime, date, time)):
+        return lambda o: o.isoformat()
+    if issubclass(cls, Decimal):
+        # Lossy past 17 digits, but clients expect a number
+        return float
+    if issubclass(cls, (set, frozenset, tuple)):
+        return lambda o: _normalized(list(o))
+    if hasattr(cls, '__dict__'):
+        # What to_json always did with plain objects
+        return lambda o: _normalized(vars(o))
+    raise TypeError(f"Object of type {cls.__name__} is not JSON serializable")
+
+
+def _enum_field(hint: Any) -> Optional[bool]:
+    """True for an Enum field, False for an Optional one, None otherwise."""
+    if isinstance(hint, type) and issubclass(hint, Enum):
+        return True
+    if get_origin(hint) in (Union, types.UnionType):
+        args = [a for a in get_args(hint) if a is not type(None)]
+        if len(args) == 1 and isinstance(args[0], type) and issubclass(args[0], Enum):
+            return False
+    return None
+
+
+_PLAIN_TYPES = (str, int, float, bool, datetime, date, time, Decimal)
+
+
+def _plain_field(hint: Any) -> bool:
+    """If the field can't hold an Enum outside a dataclass, so orjson needs no _normalized for it."""
+    if hint is type(None) or hint is Ellipsis:
+        return True
+    if isinstance(hint, type):
+        return is_dataclass(hint) or (issubclass(hint, _PLAIN_TYPES) and not issubclass(hint, Enum))
+    if get_origin(hint) in (Union, types.UnionType, list, set, frozenset, tuple, dict):
+        return all(_plain_field(arg) for arg in get_args(hint))
+    return False
+
+
+def _compile_dataclass(cls: type) -> Encoder:
+    """
+    def encode(o): return {"id": o.id, "type": o.type._name_, "data": _normalized(o.data), ...}\n
+    Other fields are left to the backend, which comes back here for nested objects.
+    """
+    try:
+        hints = get_type_hints(cls)
+    except Exception:
+        logger.debug("Can't resolve the annotations of %s", cls.__name__)
+        hints = {}
+    items = list[str]()
+    for f in fields(cls):
+        match _enum_field(hints.get(f.name)):
+            case True:
+                value = f"o.{f.name}._name_"
+            case False:
+                value = f"None if o.{f.name} is None else o.{f.name}._name_"
+            case _ if f.name in hints and _plain_field(hints[f.name]):
+                value = f"o.{f.name}"
+            case _:
+                # Like Any or dict[str, Any], it could have Enums
+                value = f"_normalized(o.{f.name})"
+        items.append(f"{f.name!r}: {value}")
+    namespace = dict[str, Any](_normalized=_normalized)
+    exec(f"def encode(o):\n    return {{{', '.join(items)}}}", namespace)
+    encode = namespace["encode"]
+    encode.__qualname__ = f"encode_{cls.__name__}"
+    return encode
+
+
+if orjson is not None:
+    # Ours, so both backends agree
+    _OPTIONS = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def _orjson_dumps(obj: Any) -> bytes:
+        return orjson.dumps(_normalized(obj), default=to_jsonable, option=_OPTIONS)
+
+# allow_nan=False, NaN would be written as is, which isn't JSON
+_json_encoder = json.JSONEncoder(
+    default=to_jsonable, ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+_json_normalizing_encoder = json.JSONEncoder(
+    default=_normalized_jsonable, ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    try:
+        return _json_encoder.encode(obj).encode('utf-8')
+    except (ValueError, TypeError):
+        # NaN, an infinity or an Enum key somewhere, rare enough to encode it again like orjson would
+        return _json_normalizing_encoder.encode(_normalized(obj)).encode('utf-8')
+
+
+@singleton
+class Serializer:
+    """The configured backend, json.backend is auto (orjson when installed), orjson or json."""
+    backend: str
+    dumps: Callable[[Any], bytes]
+    # ValueError when it isn't valid JSON or UTF-8
+    loads: Callable[[bytes], Any]
+
+    def __init__(self):
+        from . import value
+        backend = value('json.backend', 'auto')
+        if backend == 'auto':
+            backend = 'json' if orjson is None else 'orjson'
+        match backend:
+            case 'orjson':
+                if orjson is None:
+                    raise ImportError(
+                        "json.backend=orjson, but orjson isn't installed")
+                self.dumps = _orjson_dumps
+                self.loads = orjson.loads
+            case 'json':
+                self.dumps = _json_dumps
+                self.loads = json.loads
+            case _:
+                raise ValueError(f"Unknown json.backend \"{backend}\"")
+        self.backend = backend
+        logger.debug("Serializing JSON with %s", backend)
+
+
+def dumps(obj: Any) -> bytes:
+    """obj as UTF-8 JSON."""
+    return Serializer().dumps(obj)
+
+
+def loads(data: bytes) -> Any:
+    return Serializer().loads(data)
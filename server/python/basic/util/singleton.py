@@ -29,7 +29,7 @@ def singleton(cls: T):
     """
     def get_instance(*args, **kwargs) -> Type[T]:
         if cls not in SingletonRegistry.instances:
-            logger.debug(f"Created sigleton of {cls}")
+            logger.debug("Created sigleton of %s", cls)
             return SingletonRegistry._register(cls, cls(*args, **kwargs))
         return SingletonRegistry.get_instance(cls)
     